@@ -0,0 +1,73 @@
+import random
+from typing import Dict, List
+
+# benchmark_guardrail.py と benchmark_hooks.py が共有する、ベンチマーク用のテキストの素材
+
+# 言語ごとの、キーワードにもPIIにも該当しない文
+FILLER_SENTENCES: Dict[str, List[str]] = {
+    "en": [
+        "The quarterly report summarizes revenue growth across all regions.",
+        "Please translate the following paragraph into formal business Japanese.",
+        "The migration plan moves the batch jobs to the new cluster next month.",
+        "Summarize the meeting notes and list the decisions and next steps.",
+        "Compare the two proposals and explain which one fits the budget better.",
+        "The warehouse in Osaka handled twice as many orders as last year.",
+    ],
+    "ja": [
+        "富士山は日本で最も高い山で、標高は3776メートルです。",
+        "会議の議事録を要約し、決定事項と次のアクションを箇条書きにしてください。",
+        "来月から新しいクラスタでバッチ処理を実行する予定です。",
+        "次の段落を丁寧なビジネス英語に翻訳してください。",
+        "二つの提案を比較し、予算に合うのはどちらか説明してください。",
+        "大阪の倉庫では昨年の二倍の注文を処理しました。",
+    ],
+}
+
+# 言語ごとの、PIIを含む文
+PII_SENTENCES: Dict[str, List[str]] = {
+    "en": [
+        "Contact alice.tanaka@example.co.jp for the contract.",
+        "Call the support desk at 555-123-4567 after noon.",
+        "The card 4111-1111-1111-1111 was charged twice.",
+        "Ship the samples to postal code 100-0005 by Friday.",
+    ],
+    "ja": [
+        "お問い合わせは yamada.taro@example.jp までお願いします。",
+        "担当者の電話番号は03-1234-5678です。",
+        "カード番号4111-1111-1111-1111で決済しました。",
+        "住所は〒100-0001 東京都千代田区です。",
+        "マイナンバーは1234 5678 9012です。",
+    ],
+}
+
+LANGS = tuple(FILLER_SENTENCES)
+
+
+def generate_text(size: int, rng: random.Random, lang: str, pii_ratio: float = 0.0, unit: str = "bytes") -> str:
+    """
+    指定したおおよその長さのテキストを生成します
+
+    Args:
+        size (int): 長さ（unit の単位）
+        rng (random.Random): 乱数生成器
+        lang (str): 言語（"en" / "ja"、または両方の文を混ぜる "mixed"）
+        pii_ratio (float): PIIを含む文の割合
+        unit (str): "bytes"（UTF-8）または "chars"
+    """
+    if lang == "mixed":
+        filler = [sentence for sentences in FILLER_SENTENCES.values() for sentence in sentences]
+        pii = [sentence for sentences in PII_SENTENCES.values() for sentence in sentences]
+    else:
+        filler, pii = FILLER_SENTENCES[lang], PII_SENTENCES[lang]
+    separator = "" if lang == "ja" else " "
+    parts = []
+    length = 0
+    while length < size:
+        sentence = rng.choice(pii if rng.random() < pii_ratio else filler)
+        parts.append(sentence)
+        length += (len(sentence.encode()) if unit == "bytes" else len(sentence)) + len(separator)
+    text = separator.join(parts)
+    if unit == "bytes":
+        # 文字の途中で切れた分は捨てる
+        return text.encode()[:size].decode(errors="ignore")
+    return text[:size]
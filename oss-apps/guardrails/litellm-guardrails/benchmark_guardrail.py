@@ -0,0 +1,123 @@
+import argparse
+import random
+import re
+import statistics
+import time
+from typing import Callable, List, Optional
+
+from benchmark_corpus import generate_text
+from custom_guardrail import (
+    DEFAULT_INAPPROPRIATE_PATTERNS,
+    DEFAULT_SENSITIVE_PATTERNS,
+    DEFAULT_SUSPICIOUS_PATTERNS,
+    KeywordMatcher,
+    PIIMasker,
+    ahocorasick,
+)
+
+def generate_prompt(size: int, seed: int, keyword: Optional[str] = None, pii_ratio: float = 0.0) -> str:
+    """
+    指定したおおよその文字数のプロンプトを生成します
+
+    Args:
+        size (int): 文字数
+        seed (int): 乱数シード
+        keyword (Optional[str]): 末尾に埋め込むキーワード（最悪ケースの照合位置）
+        pii_ratio (float): PIIを含む文の割合
+    """
+    text = generate_text(size, random.Random(seed), "mixed", pii_ratio, unit="chars")
+    if keyword is not None:
+        text += " " + keyword
+    return text
+
+
+def synthetic_keywords(count: int, seed: int) -> List[str]:
+    """キーワードリストのサイズを変えるための、本文に現れない合成キーワード"""
+    rng = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(6, 14))) + " zq" for _ in range(count)]
+
+
+def legacy_search(patterns: List[str]) -> Callable[[str], Optional[str]]:
+    """変更前の実装と同じ、メッセージごとに小文字化してキーワードごとに `in` で走査する照合"""
+    def search(text: str) -> Optional[str]:
+        for pattern in list(patterns):
+            if pattern in text.lower():
+                return pattern
+        return None
+    return search
+
+
+def legacy_mask(text: str) -> str:
+    """変更前の実装と同じ、PIIの種類ごとに re.sub で走査し、文字列全体を比較するマスク"""
+    content = re.sub(r'\b[\w\.-]+@[\w\.-]+\.\w+\b', '[EMAIL]', text)
+    content = re.sub(r'(\d{2,4}[-.]?\d{2,4}[-.]?\d{4}|\d{10,11}|\d{3}[-.]?\d{4}[-.]?\d{4})', '[PHONE]', content)
+    content = re.sub(r'\b\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4}\b', '[CREDIT_CARD]', content)
+    return content if content != text else text
+
+
+def time_search(search: Callable[[str], object], texts: List[str], repeat: int) -> float:
+    """1回あたりの処理時間の中央値（ミリ秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            search(text)
+        samples.append((time.perf_counter() - start) * 1000 / len(texts))
+    return statistics.median(samples)
+
+
+def print_header(headers: List[str]):
+    print("| " + " | ".join(headers) + " |")
+    print("|" + "|".join(["---"] * len(headers)) + "|")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SecurityGuardrail キーワード照合のベンチマーク')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1_000, 10_000, 100_000, 1_000_000],
+                        help='プロンプトの文字数（デフォルト: 1000 10000 100000 1000000）')
+    parser.add_argument('--list-sizes', nargs='+', type=int, default=[0, 300],
+                        help='既定のリストに追加する合成キーワードの数（デフォルト: 0 300）')
+    parser.add_argument('--pii-ratios', nargs='+', type=float, default=[0.0, 0.1, 0.5],
+                        help='PIIマスクの計測で、PIIを含む文の割合（デフォルト: 0.0 0.1 0.5）')
+    parser.add_argument('--repeat', type=int, default=5, help='計測の繰り返し回数（デフォルト: 5）')
+    args = parser.parse_args()
+
+    base_patterns = DEFAULT_SUSPICIOUS_PATTERNS + DEFAULT_SENSITIVE_PATTERNS + DEFAULT_INAPPROPRIATE_PATTERNS
+    print(f"pyahocorasick: {'あり' if ahocorasick is not None else 'なし（正規表現にフォールバック）'}\n")
+
+    print("キーワード照合\n")
+    print_header(["文字数", "キーワード数", "変更前 (ms)", "正規表現 (ms)", "Aho-Corasick (ms)"])
+    for extra in args.list_sizes:
+        patterns = base_patterns + synthetic_keywords(extra, seed=extra)
+        matcher = KeywordMatcher({"keywords": patterns})
+        fallback = KeywordMatcher({"keywords": patterns}, use_automaton=False)
+
+        for size in args.sizes:
+            # 照合されないプロンプトと、末尾の最後のキーワードで照合されるプロンプト
+            texts = [generate_prompt(size, seed=0), generate_prompt(size, seed=1, keyword=patterns[-1])]
+            repeat = args.repeat if size < 1_000_000 else max(1, args.repeat // 2)
+            row = [f"{size:,}", str(len(patterns))]
+            for search in (legacy_search(patterns), fallback.search,
+                           matcher.search if matcher._automaton is not None else None):
+                if search is None:
+                    row.append("-")
+                    continue
+                row.append(f"{time_search(search, texts, repeat):.3f}")
+            print("| " + " | ".join(row) + " |")
+
+    print("\nPIIマスク\n")
+    print_header(["文字数", "PIIの割合", "変更前 (ms)", "1パス (ms)", "1パス (MB/s)"])
+    masker = PIIMasker()
+    for pii_ratio in args.pii_ratios:
+        for size in args.sizes:
+            texts = [generate_prompt(size, seed=seed, pii_ratio=pii_ratio) for seed in range(2)]
+            repeat = args.repeat if size < 1_000_000 else max(1, args.repeat // 2)
+            legacy_ms = time_search(legacy_mask, texts, repeat)
+            masker_ms = time_search(masker.mask, texts, repeat)
+            megabytes = sum(len(text.encode()) for text in texts) / len(texts) / 2**20
+            print(f"| {size:,} | {pii_ratio:.0%} | {legacy_ms:.3f} | {masker_ms:.3f} | {megabytes / (masker_ms / 1000):.1f} |")
+
+
+if __name__ == "__main__":
+    main()
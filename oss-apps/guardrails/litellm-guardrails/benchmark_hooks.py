@@ -0,0 +1,270 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import statistics
+import tracemalloc
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import litellm
+
+from benchmark_corpus import LANGS, generate_text
+from custom_guardrail import SecurityGuardrail, ahocorasick
+
+STAGES = ("pre_call", "post_call")
+
+
+def generate_request(size: int, seed: int, lang: str, pii_ratio: float, turns: int) -> Dict[str, Any]:
+    """
+    合計がおおよそ size バイトの、turns 個のメッセージからなるリクエストを生成します。
+    メッセージは user と assistant が交互になり、最後は user です
+    """
+    rng = random.Random(seed)
+    messages = []
+    for turn in range(turns):
+        role = "user" if (turns - turn) % 2 == 1 else "assistant"
+        messages.append({"role": role, "content": generate_text(max(1, size // turns), rng, lang, pii_ratio)})
+    return {"model": "benchmark", "messages": messages}
+
+
+def generate_response(size: int, seed: int, lang: str, pii_ratio: float) -> litellm.ModelResponse:
+    """おおよそ size バイトの応答を生成します"""
+    content = generate_text(size, random.Random(seed), lang, pii_ratio)
+    return litellm.ModelResponse(choices=[{"message": {"role": "assistant", "content": content}}])
+
+
+def request_bytes(stage: str, payload: Any) -> int:
+    if stage == "pre_call":
+        return sum(len(message["content"].encode()) for message in payload["messages"])
+    return sum(len(choice.message.content.encode()) for choice in payload.choices)
+
+
+def make_payload(stage: str, size: int, seed: int, lang: str, pii_ratio: float, turns: int) -> Any:
+    if stage == "pre_call":
+        return generate_request(size, seed, lang, pii_ratio, turns)
+    return generate_response(size, seed, lang, pii_ratio)
+
+
+async def call_hook(guardrail: SecurityGuardrail, stage: str, payload: Any):
+    if stage == "pre_call":
+        await guardrail.async_pre_call_hook(None, None, payload, "completion")
+    else:
+        await guardrail.async_post_call_success_hook({}, None, payload)
+
+
+async def run_scenario(guardrail: SecurityGuardrail, stage: str, size: int, lang: str, pii_ratio: float,
+                       turns: int, min_requests: int, min_seconds: float, seed: int) -> Dict[str, Any]:
+    """
+    1つの条件でフックを繰り返し呼び出し、レイテンシとアロケーションを計測します
+
+    判定結果のキャッシュは run_benchmark で無効にし、リクエストは毎回異なる内容で生成します（生成は計測に含みません）。
+    アロケーションは tracemalloc を有効にした別の1回で計測し、レイテンシの計測には影響させません。
+    プロセスプールで照合したメッセージのアロケーションはワーカー側のため含まれません
+    """
+    # ウォームアップ（プールのワーカーの起動などを計測に含めない）
+    await call_hook(guardrail, stage, make_payload(stage, size, seed, lang, pii_ratio, turns))
+
+    latencies = []
+    total_bytes = 0
+    elapsed = 0.0
+    while len(latencies) < min_requests or elapsed < min_seconds:
+        payload = make_payload(stage, size, seed + len(latencies) + 1, lang, pii_ratio, turns)
+        total_bytes += request_bytes(stage, payload)
+        start = time.perf_counter()
+        await call_hook(guardrail, stage, payload)
+        latency = time.perf_counter() - start
+        latencies.append(latency)
+        elapsed += latency
+
+    payload = make_payload(stage, size, seed - 1, lang, pii_ratio, turns)
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        await call_hook(guardrail, stage, payload)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "stage": stage,
+        "lang": lang,
+        "size": size,
+        "pii_ratio": pii_ratio,
+        "turns": turns,
+        "requests": len(latencies),
+        "mb_per_sec": total_bytes / 2**20 / elapsed,
+        "latency_ms_p50": quantiles[49] * 1000,
+        "latency_ms_p95": quantiles[94] * 1000,
+        "latency_ms_p99": quantiles[98] * 1000,
+        "alloc_peak_kib": (peak - baseline) / 1024,
+    }
+
+
+def scenario_key(result: Dict[str, Any]) -> str:
+    return f"{result['stage']}/{result['lang']}/{result['size']}B/pii={result['pii_ratio']}/turns={result['turns']}"
+
+
+def compare_with_baseline(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float,
+                          min_delta_ms: float) -> List[str]:
+    """
+    ベースラインより遅くなった、またはアロケーションが増えた条件を返します
+
+    p50 のレイテンシが (1 + tolerance) 倍を超え、かつ min_delta_ms ミリ秒以上遅い場合と、
+    アロケーションのピークが (1 + tolerance) 倍を超え、かつ 64 KiB 以上多い場合を回帰とします
+    """
+    previous = {scenario_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        base = previous.get(scenario_key(result))
+        if base is None:
+            continue
+        latency, base_latency = result["latency_ms_p50"], base["latency_ms_p50"]
+        if latency > base_latency * (1 + tolerance) and latency - base_latency >= min_delta_ms:
+            regressions.append(f"{scenario_key(result)}: p50 {base_latency:.3f} ms -> {latency:.3f} ms")
+        alloc, base_alloc = result["alloc_peak_kib"], base["alloc_peak_kib"]
+        if alloc > base_alloc * (1 + tolerance) and alloc - base_alloc >= 64:
+            regressions.append(f"{scenario_key(result)}: alloc peak {base_alloc:.0f} KiB -> {alloc:.0f} KiB")
+    return regressions
+
+
+def markdown_table(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]]) -> str:
+    """計測結果を markdown の表にします。ベースラインがあれば p50 の比も出力します"""
+    previous = {scenario_key(result): result for result in baseline["results"]} if baseline else {}
+    headers = ["フック", "言語", "バイト数", "PIIの割合", "メッセージ数", "リクエスト数", "MB/s",
+               "p50 (ms)", "p95 (ms)", "p99 (ms)", "アロケーション (KiB)"]
+    if baseline:
+        headers.append("p50 / ベースライン")
+    lines = ["| " + " | ".join(headers) + " |", "|" + "|".join(["---"] * len(headers)) + "|"]
+    for result in results:
+        row = [
+            result["stage"],
+            result["lang"],
+            f"{result['size']:,}",
+            f"{result['pii_ratio']:.0%}",
+            str(result["turns"]),
+            str(result["requests"]),
+            f"{result['mb_per_sec']:.1f}",
+            f"{result['latency_ms_p50']:.3f}",
+            f"{result['latency_ms_p95']:.3f}",
+            f"{result['latency_ms_p99']:.3f}",
+            f"{result['alloc_peak_kib']:.0f}",
+        ]
+        if baseline:
+            base = previous.get(scenario_key(result))
+            row.append(f"{result['latency_ms_p50'] / base['latency_ms_p50']:.2f}x"
+                       if base and base["latency_ms_p50"] else "-")
+        lines.append("| " + " | ".join(row) + " |")
+    return "\n".join(lines) + "\n"
+
+
+async def run_benchmark(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    guardrail = SecurityGuardrail(
+        guardrail_name="benchmark",
+        log_level="warning",
+        offload_threshold=args.offload_threshold,
+        offload_mode=args.offload_mode,
+        # 生成する本文は語句の繰り返しのため、判定結果のキャッシュは無効にして毎回照合させる
+        verdict_cache_size=0,
+    )
+    # ワーカーの起動（guardrail_scan の import）が最初の条件の計測と重ならないよう、全ワーカーの起動を待つ
+    await asyncio.gather(*(guardrail.offloader.run(time.sleep, 0.5) for _ in range(guardrail.offloader.workers)))
+    results = []
+    try:
+        for stage in args.stages:
+            for lang in args.langs:
+                for size in args.sizes:
+                    for pii_ratio in args.pii_ratios:
+                        # 応答は1つのメッセージのため、メッセージ数を変えるのはリクエストだけ
+                        for turns in (args.turns if stage == "pre_call" else [1]):
+                            result = await run_scenario(guardrail, stage, size, lang, pii_ratio, turns,
+                                                        args.min_requests, args.min_seconds, args.seed)
+                            print(f"{scenario_key(result)}: {result['latency_ms_p50']:.3f} ms, "
+                                  f"{result['mb_per_sec']:.1f} MB/s", file=sys.stderr)
+                            results.append(result)
+    finally:
+        guardrail.offloader.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='SecurityGuardrail のフックを直接呼び出すスループットのベンチマーク（プロキシとLLMは使いません）'
+    )
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                        help='計測するフック（デフォルト: pre_call post_call）')
+    parser.add_argument('--langs', nargs='+', choices=LANGS, default=list(LANGS),
+                        help='生成するテキストの言語（デフォルト: en ja）')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1_000, 10_000, 100_000, 1_000_000],
+                        help='リクエストと応答のバイト数（デフォルト: 100 1000 10000 100000 1000000）')
+    parser.add_argument('--pii-ratios', nargs='+', type=float, default=[0.0, 0.1, 0.5],
+                        help='PIIを含む文の割合（デフォルト: 0.0 0.1 0.5）')
+    parser.add_argument('--turns', nargs='+', type=int, default=[1, 8],
+                        help='リクエストのメッセージ数（デフォルト: 1 8）')
+    parser.add_argument('--min-requests', type=int, default=5,
+                        help='条件ごとの最小リクエスト数（デフォルト: 5）')
+    parser.add_argument('--min-seconds', type=float, default=0.5,
+                        help='条件ごとの最小計測時間（秒、デフォルト: 0.5）')
+    parser.add_argument('--offload-threshold', type=int, default=64 * 1024,
+                        help='この文字数以上のメッセージをワーカーで照合（デフォルト: 65536、ガードレールと同じ）')
+    parser.add_argument('--offload-mode', choices=["process", "thread"], default="process",
+                        help='ワーカーの種類（デフォルト: process）')
+    parser.add_argument('--seed', type=int, default=0, help='乱数シード（デフォルト: 0）')
+    parser.add_argument('--output', default=None, help='計測結果を保存する JSON ファイル')
+    parser.add_argument('--save-baseline', default=None, help='計測結果をベースラインとして保存する JSON ファイル')
+    parser.add_argument('--baseline', default=None,
+                        help='比較するベースラインの JSON ファイル。回帰があれば終了コード 1 で終了します')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='回帰とみなすベースラインからの増加率（デフォルト: 0.25）')
+    parser.add_argument('--min-delta-ms', type=float, default=0.05,
+                        help='回帰とみなす p50 の最小の差（ミリ秒、デフォルト: 0.05）')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    results = asyncio.run(run_benchmark(args))
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "litellm": getattr(litellm, "__version__", None),
+        "pyahocorasick": ahocorasick is not None,
+        "settings": {
+            "offload_threshold": args.offload_threshold,
+            "offload_mode": args.offload_mode,
+            "min_requests": args.min_requests,
+            "min_seconds": args.min_seconds,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    print(f"pyahocorasick: {'あり' if ahocorasick is not None else 'なし（正規表現にフォールバック）'}\n")
+    print(markdown_table(results, baseline))
+
+    if baseline is not None:
+        regressions = compare_with_baseline(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"ベースライン（{baseline['timestamp']}）からの回帰:")
+            for regression in regressions:
+                print(f"- {regression}")
+            sys.exit(1)
+        print(f"ベースライン（{baseline['timestamp']}）からの回帰はありません")
+
+
+if __name__ == "__main__":
+    main()
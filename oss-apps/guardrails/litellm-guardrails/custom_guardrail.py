@@ -1,5 +1,16 @@
-from typing import Any, Dict, List, Literal, Optional, Union, AsyncGenerator
-import re
+from typing import Any, Dict, Iterable, List, Literal, Optional, Tuple, Union, AsyncGenerator
+import os
+import json
+import time
+import random
+import asyncio
+import bisect
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import litellm
 from litellm._logging import verbose_proxy_logger
 from litellm.caching.caching import DualCache
@@ -7,18 +18,614 @@ from litellm.integrations.custom_guardrail import CustomGuardrail
 from litellm.proxy._types import UserAPIKeyAuth
 from litellm.types.guardrails import GuardrailEventHooks
 from litellm.proxy.utils import ModelResponse
+from litellm.types.utils import Delta, ModelResponseStream, StreamingChoices
 import logging
+# 照合とマスクの処理は litellm に依存しない guardrail_scan.py にあり、プロセスプールのワーカーはそれだけを読み込む。
+# litellm はこのファイルをパスから読み込むため、このディレクトリを PYTHONPATH に含めて起動すること
+import guardrail_scan
+from guardrail_scan import (
+    DEFAULT_PII_PATTERNS,
+    KeywordMatcher,
+    PIIMasker,
+    ahocorasick,
+    scan_input,
+    scan_output,
+)
 
-# ロガーの設定
-logging.basicConfig(level=logging.DEBUG)
+# ロガーの設定（ルートロガーは変更せず、このモジュールのロガーにだけハンドラを付ける）
 logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(_handler)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+# プロンプトインジェクションの疑いがあるフレーズ
+DEFAULT_SUSPICIOUS_PATTERNS = [
+    "system prompt",
+    "ignore previous",
+    "reveal instructions",
+    "ignore above",
+    "system message"
+]
+
+# 機密情報を示すフレーズ
+DEFAULT_SENSITIVE_PATTERNS = [
+    "password",
+    "secret",
+    "confidential",
+    "private key",
+    "api key",
+    "token",
+    "credential",
+    "authentication",
+    "access key",
+    "ssh key",
+    "encryption key",
+    "certificate"
+]
+
+# 不適切な内容を示すフレーズ
+DEFAULT_INAPPROPRIATE_PATTERNS = [
+    "hack",
+    "exploit",
+    "vulnerability",
+    "attack",
+    "malware",
+    "virus",
+    "ransomware",
+    "phishing",
+    "backdoor",
+    "crack",
+    "breach",
+    "compromise"
+]
+
+
+class ScanOffloader:
+    """
+    大きなメッセージの照合とマスクをスレッドまたはプロセスのプールで実行し、
+    プロキシのイベントループが他のリクエストを処理し続けられるようにします
+
+    同時に実行するのはワーカー数までで、それを超えた分はイベントループ上で順番を待ちます。
+    プロセスでは照合が並列に実行され、ループが止まるのはテキストのハッシュと受け渡しの間だけです。
+    スレッドは追加のプロセスを起動しませんが、正規表現の1回の走査の間は GIL が解放されないため、
+    一致の少ないテキストではループが止まる時間が短くなりません。
+    """
+
+    def __init__(self, mode: str = "process", workers: int = 2, initializer=None, initargs: tuple = ()):
+        """
+        Args:
+            mode (str): "process" または "thread"
+            workers (int): プールのワーカー数
+            initializer: プロセスプールのワーカーの初期化関数
+            initargs (tuple): initializer の引数
+        """
+        if mode not in ("thread", "process"):
+            raise ValueError(f"offload_mode must be 'thread' or 'process': {mode!r}")
+        self.mode = mode
+        self.workers = max(1, workers)
+        self._initializer = initializer
+        self._initargs = initargs
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._started_at = time.monotonic()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.active = 0
+        self.completed = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def uses_processes(self) -> bool:
+        return self.mode == "process"
+
+    def _get_executor(self) -> Executor:
+        """プールは最初に使うときに作成します"""
+        if self._executor is None:
+            if self.uses_processes:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=self._initializer,
+                    initargs=self._initargs,
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="guardrail-scan")
+            self._started_at = time.monotonic()
+        return self._executor
+
+    async def run(self, fn, *args):
+        """プールで fn(*args) を実行し、結果を返します"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queue_depth -= 1
+        self.active += 1
+        executor = self._get_executor()
+        start = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        finally:
+            self.active -= 1
+            self.completed += 1
+            self.busy_seconds += time.monotonic() - start
+            self._slots.release()
+
+    def prestart(self):
+        """
+        ワーカーを起動しておきます。プロセスの起動（インタープリタと guardrail_scan の import）には時間がかかるため、
+        最初の大きなメッセージがその時間を待たないようにします
+        """
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(time.sleep, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        """待ち行列の長さとプールの使用率を取得します"""
+        elapsed = time.monotonic() - self._started_at
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "active": self.active,
+            "completed": self.completed,
+            "busy_seconds": self.busy_seconds,
+            "utilization": self.busy_seconds / (self.workers * elapsed) if self._executor and elapsed > 0 else 0.0,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# 同じ設定のガードレール（pre_call と post_call など）で共有するプール
+_offloaders: Dict[Tuple[str, int, str], ScanOffloader] = {}
+
+
+def get_offloader(mode: str, workers: int, fingerprint: str, initargs: tuple) -> ScanOffloader:
+    """照合の設定が同じガードレールには同じプールを返します"""
+    key = (mode, workers, fingerprint)
+    if key not in _offloaders:
+        _offloaders[key] = ScanOffloader(mode=mode, workers=workers, initializer=guardrail_scan.init_worker,
+                                         initargs=initargs)
+    return _offloaders[key]
+
+
+class VerdictCache:
+    """
+    メッセージ内容のハッシュをキーに、判定結果（ブロック理由やマスク後のテキスト）をメモ化します
+
+    マルチターンの会話では毎ターン過去のメッセージ全体が再送されるため、
+    同じ内容の照合とマスクを繰り返さないようにします。
+    プロセス内のLRU（件数と文字数の上限、TTL付き）を第1層とし、
+    DualCache（Redis など）を渡した場合は複数のプロキシで共有する第2層として使います。
+    """
+
+    def __init__(self, namespace: str, max_entries: int = 10000, max_chars: int = 64 * 2**20,
+                 ttl: float = 3600.0):
+        """
+        Args:
+            namespace (str): キーの接頭辞。照合の設定が変わればキーも変わるようにします
+            max_entries (int): プロセス内に保持する判定結果の件数
+            max_chars (int): プロセス内に保持するマスク後テキストの合計文字数
+            ttl (float): 判定結果の有効期間（秒）
+        """
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # キー -> (有効期限, 判定結果, サイズ)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any], int]]" = OrderedDict()
+        self._chars = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, kind: str, content: str) -> str:
+        """照合の種類（pre / post）と内容のハッシュからキーを作ります"""
+        digest = hashlib.sha256(content.encode("utf-8", "surrogatepass")).hexdigest()
+        return f"{self.namespace}:{kind}:{digest}"
+
+    @staticmethod
+    def _size(verdict: Dict[str, Any]) -> int:
+        masked = verdict.get("masked")
+        return len(masked) if masked else 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """プロセス内の判定結果を取得します。期限切れや未登録なら None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, verdict, size = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return verdict
+                del self._entries[key]
+                self._chars -= size
+            self.misses += 1
+            return None
+
+    def put(self, key: str, verdict: Dict[str, Any]):
+        """判定結果をプロセス内に保存し、上限を超えた分を古いものから削除します"""
+        size = self._size(verdict)
+        if size > self.max_chars:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._chars -= previous[2]
+            self._entries[key] = (time.monotonic() + self.ttl, verdict, size)
+            self._chars += size
+            while len(self._entries) > self.max_entries or self._chars > self.max_chars:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._chars -= evicted_size
+                self.evictions += 1
+
+    async def aget(self, key: str, shared: Optional[DualCache] = None) -> Optional[Dict[str, Any]]:
+        """プロセス内、次に共有キャッシュの順に判定結果を取得します"""
+        verdict = self.get(key)
+        if verdict is not None or shared is None:
+            return verdict
+        try:
+            verdict = await shared.async_get_cache(key)
+        except Exception as e:
+            logger.warning("Shared verdict cache lookup failed: %s", e)
+            return None
+        if isinstance(verdict, str):
+            verdict = json.loads(verdict)
+        if verdict is not None:
+            with self._lock:
+                self.misses -= 1
+                self.shared_hits += 1
+            self.put(key, verdict)
+        return verdict
+
+    async def aput(self, key: str, verdict: Dict[str, Any], shared: Optional[DualCache] = None):
+        """判定結果をプロセス内と共有キャッシュに保存します"""
+        self.put(key, verdict)
+        if shared is None:
+            return
+        try:
+            await shared.async_set_cache(key, verdict, ttl=self.ttl)
+        except Exception as e:
+            logger.warning("Shared verdict cache update failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット率などのカウンタを取得します"""
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "chars": self._chars,
+                "evictions": self.evictions,
+            }
+
+
+# レイテンシのヒストグラムのバケットの上限（秒）
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class GuardrailMetrics:
+    """
+    ガードレール1つ分の計測値です
+
+    フックとチェックごとの処理時間のヒストグラム（バケットごとの件数・合計・件数）と、
+    照合したキーワードやマスクしたPIIの種類ごとのカウンタを保持します。
+    判定結果のキャッシュやワーカーのプールの統計は、登録した関数から出力時に取得します
+    """
+
+    def __init__(self, guardrail: str):
+        self.guardrail = guardrail
+        self._lock = threading.Lock()
+        # (フック, チェック) -> [バケットごとの件数（最後は上限を超えた分）, 合計秒, 件数]
+        self._histograms: Dict[Tuple[str, str], list] = {}
+        # (カウンタ名, ラベルの組) -> 件数
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], int] = {}
+        self._collectors: Dict[str, Any] = {}
+
+    def observe(self, hook: str, check: str, seconds: float):
+        """処理時間を記録します"""
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            histogram = self._histograms.get((hook, check))
+            if histogram is None:
+                histogram = self._histograms[(hook, check)] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def inc(self, name: str, amount: int = 1, **labels: str):
+        """カウンタを加算します"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_collector(self, name: str, stats):
+        """出力時に呼び出して統計を取得する関数（VerdictCache.stats など）を登録します"""
+        self._collectors[name] = stats
+
+    @staticmethod
+    def _quantile(buckets: List[int], count: int, q: float) -> Optional[float]:
+        """バケットから分位数を推定します（該当するバケットの上限、超えた分は None）"""
+        rank = q * count
+        seen = 0
+        for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+            seen += bucket
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """計測値を JSON にできる辞書で取得します"""
+        with self._lock:
+            histograms = {key: (list(value[0]), value[1], value[2]) for key, value in self._histograms.items()}
+            counters = dict(self._counters)
+        latency = {}
+        for (hook, check), (buckets, total, count) in sorted(histograms.items()):
+            latency.setdefault(hook, {})[check] = {
+                "count": count,
+                "sum_seconds": total,
+                "mean_ms": total / count * 1000 if count else 0.0,
+                **{name: (value * 1000 if value is not None else None)
+                   for name, value in (("p50_ms", self._quantile(buckets, count, 0.5)),
+                                       ("p95_ms", self._quantile(buckets, count, 0.95)),
+                                       ("p99_ms", self._quantile(buckets, count, 0.99)))},
+                "buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], buckets)),
+            }
+        counter_values: Dict[str, list] = {}
+        for (name, labels), value in sorted(counters.items()):
+            counter_values.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        collected = {}
+        for name, stats in self._collectors.items():
+            try:
+                collected[name] = stats()
+            except Exception as e:
+                logger.warning("Collecting %s stats failed: %s", name, e)
+        return {"latency": latency, "counters": counter_values, **collected}
+
+    def render_prometheus(self) -> List[str]:
+        """計測値を Prometheus のテキスト形式の行で取得します（# TYPE の行は含みません）"""
+        guardrail = _prometheus_label(self.guardrail)
+        with self._lock:
+            histograms = {key: (list(value[0]), value[1], value[2]) for key, value in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = []
+        for (hook, check), (buckets, total, count) in sorted(histograms.items()):
+            labels = f'guardrail="{guardrail}",hook="{hook}",check="{check}"'
+            cumulative = 0
+            for bound, bucket in zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], buckets):
+                cumulative += bucket
+                lines.append(f'guardrail_check_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'guardrail_check_seconds_sum{{{labels}}} {total}')
+            lines.append(f'guardrail_check_seconds_count{{{labels}}} {count}')
+        for (name, labels), value in sorted(counters.items()):
+            label_text = "".join(f',{key}="{_prometheus_label(str(label))}"' for key, label in labels)
+            lines.append(f'guardrail_{name}_total{{guardrail="{guardrail}"{label_text}}} {value}')
+        for name, stats in self._collectors.items():
+            try:
+                values = stats()
+            except Exception as e:
+                logger.warning("Collecting %s stats failed: %s", name, e)
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'guardrail_{name}_{key}{{guardrail="{guardrail}"}} {value}')
+        return lines
+
+
+def _prometheus_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# ガードレール名 -> 計測値（エクスポートはすべてのガードレールの分をまとめて出力する）
+_metrics: Dict[str, GuardrailMetrics] = {}
+
+
+def get_metrics(guardrail: str) -> GuardrailMetrics:
+    """ガードレールの計測値を取得します。同じ名前では同じインスタンスを返します"""
+    metrics = _metrics.get(guardrail)
+    if metrics is None:
+        metrics = _metrics[guardrail] = GuardrailMetrics(guardrail)
+    return metrics
+
+
+def metrics_snapshot() -> Dict[str, Any]:
+    """すべてのガードレールの計測値を JSON にできる辞書で取得します"""
+    return {"timestamp": time.time(),
+            "guardrails": {name: metrics.snapshot() for name, metrics in sorted(_metrics.items())}}
+
+
+def render_metrics_prometheus() -> str:
+    """すべてのガードレールの計測値を Prometheus のテキスト形式で取得します"""
+    lines = ["# TYPE guardrail_check_seconds histogram"]
+    for _, metrics in sorted(_metrics.items()):
+        lines.extend(metrics.render_prometheus())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """/metrics（Prometheus のテキスト形式）と /metrics.json を返すハンドラ"""
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = render_metrics_prometheus().encode(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(metrics_snapshot()).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics request: " + format, *args)
+
+
+def write_metrics_file(path: str):
+    """
+    計測値をファイルに書き出します。拡張子が .json なら JSON、それ以外は Prometheus のテキスト形式で、
+    読み手が書きかけのファイルを見ないよう一時ファイルから置き換えます
+    """
+    text = json.dumps(metrics_snapshot(), indent=2) if path.endswith(".json") else render_metrics_prometheus()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+# 起動済みのエクスポート（同じポートやファイルはガードレールが複数あっても1度だけ起動する）
+_exporters: Dict[Tuple[str, Any], Any] = {}
+_exporters_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """
+    計測値を返す HTTP サーバーをデーモンスレッドで起動します
+
+    計測値には認証がないため、デフォルトではループバックアドレスでだけ待ち受けます
+    """
+    with _exporters_lock:
+        if ("port", port) in _exporters:
+            return
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="guardrail-metrics-server", daemon=True).start()
+        _exporters[("port", port)] = server
+    logger.info("Serving guardrail metrics on http://%s:%d/metrics", host, port)
+
+
+def start_metrics_file_writer(path: str, interval: float):
+    """計測値を interval 秒ごとにファイルに書き出すデーモンスレッドを起動します"""
+    def write_periodically():
+        while True:
+            time.sleep(interval)
+            try:
+                write_metrics_file(path)
+            except OSError as e:
+                logger.warning("Writing guardrail metrics to %s failed: %s", path, e)
+
+    with _exporters_lock:
+        if ("file", path) in _exporters:
+            return
+        thread = threading.Thread(target=write_periodically, name="guardrail-metrics-writer", daemon=True)
+        thread.start()
+        _exporters[("file", path)] = thread
+    logger.info("Writing guardrail metrics to %s every %gs", path, interval)
+
+
+class _Payload:
+    """
+    ログに出力するときにだけ文字列にするペイロードです。
+    max_chars を超える分は切り詰め、ログのレベルが無効な呼び出しでは何も整形しません
+    """
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value: Any, max_chars: int):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        text = self.value if isinstance(self.value, str) else repr(self.value)
+        if len(text) <= self.max_chars:
+            return text
+        return f"{text[:self.max_chars]}...(+{len(text) - self.max_chars} chars)"
+
 
 class SecurityGuardrail(CustomGuardrail):
     def __init__(self, **kwargs):
-        logger.debug(f"Initializing SecurityGuardrail with kwargs: {kwargs}")
+        """
+        config.yml の litellm_params で suspicious_patterns / sensitive_patterns /
+        inappropriate_patterns を指定すると、既定のキーワードリストを置き換えます。
+        pii_patterns（種類と、正規表現または [正規表現, 先頭になりうる文字] の辞書）を指定すると、
+        マスクするPIIの種類を追加・上書きします。値を true にすると、デフォルトでは無効な
+        組み込みの種類（MY_NUMBER / POSTAL_CODE）を有効にします。
+        判定結果のキャッシュは verdict_cache_size / verdict_cache_max_chars / verdict_cache_ttl で調整し、
+        verdict_cache_shared: true でプロキシの DualCache（Redis など）と共有します。
+        offload_threshold（文字数）以上のメッセージは offload_mode（process / thread）の
+        offload_workers 個のワーカーのプールで照合します（offload_prestart: true で起動時にワーカーを起動）
+        log_level でこのモジュールのログのレベルを指定します。DEBUG ではリクエストと応答の本文を
+        log_payload_sample_rate の割合のリクエストについて、log_payload_max_chars 文字までログに出力します。
+        フックとチェックごとの処理時間と照合の件数は metrics_host（デフォルト: 127.0.0.1）の
+        metrics_port の /metrics（Prometheus 形式）と /metrics.json で返し、
+        metrics_file を指定すると metrics_interval 秒ごとに書き出します
+        """
+        if "log_level" in kwargs:
+            logger.setLevel(str(kwargs["log_level"]).upper())
+        self.log_payload_sample_rate = float(kwargs.get("log_payload_sample_rate", 0.01))
+        self.log_payload_max_chars = int(kwargs.get("log_payload_max_chars", 1000))
+        logger.debug("Initializing SecurityGuardrail with kwargs: %s", kwargs)
         self.optional_params = kwargs
+        # キーワードの照合器はメッセージごとではなく初期化時に1度だけ構築する
+        self.injection_matcher = KeywordMatcher({
+            "suspicious": kwargs.get("suspicious_patterns", DEFAULT_SUSPICIOUS_PATTERNS),
+        })
+        self.output_matcher = KeywordMatcher({
+            "sensitive": kwargs.get("sensitive_patterns", DEFAULT_SENSITIVE_PATTERNS),
+            "inappropriate": kwargs.get("inappropriate_patterns", DEFAULT_INAPPROPRIATE_PATTERNS),
+        })
+        self.pii_masker = PIIMasker()
+        for name, pattern in (kwargs.get("pii_patterns") or {}).items():
+            if pattern is True:
+                self.pii_masker.enable(name)
+            elif isinstance(pattern, str):
+                self.pii_masker.register(name, pattern)
+            else:
+                self.pii_masker.register(name, *pattern)
+
+        # 照合の設定が変わると別のキーになるよう、設定のハッシュを名前空間にする
+        fingerprint = hashlib.sha256(json.dumps([
+            self.injection_matcher.keywords,
+            self.output_matcher.keywords,
+            self.pii_masker.patterns,
+        ]).encode()).hexdigest()[:16]
+        self.verdict_cache = VerdictCache(
+            namespace=f"security_guardrail:{fingerprint}",
+            max_entries=int(kwargs.get("verdict_cache_size", 10000)),
+            max_chars=int(kwargs.get("verdict_cache_max_chars", 64 * 2**20)),
+            ttl=float(kwargs.get("verdict_cache_ttl", 3600)),
+        )
+        self.verdict_cache_shared = bool(kwargs.get("verdict_cache_shared", False))
+
+        # 大きなメッセージの照合はイベントループの外で実行する
+        self.offload_threshold = int(kwargs.get("offload_threshold", 64 * 1024))
+        self.offloader = get_offloader(
+            mode=kwargs.get("offload_mode", "process"),
+            workers=int(kwargs.get("offload_workers", min(2, os.cpu_count() or 1))),
+            fingerprint=fingerprint,
+            initargs=(self.injection_matcher.categories, self.output_matcher.categories,
+                      self.pii_masker.patterns),
+        )
+        if kwargs.get("offload_prestart", False):
+            self.offloader.prestart()
         super().__init__(**kwargs)
 
+        self.metrics = get_metrics(self.guardrail_name or "security_guardrail")
+        self.metrics.add_collector("verdict_cache", self.verdict_cache.stats)
+        self.metrics.add_collector("offload", self.offloader.stats)
+        if kwargs.get("metrics_port"):
+            start_metrics_server(int(kwargs["metrics_port"]), kwargs.get("metrics_host", "127.0.0.1"))
+        if kwargs.get("metrics_file"):
+            start_metrics_file_writer(kwargs["metrics_file"], float(kwargs.get("metrics_interval", 15)))
+
     async def async_pre_call_hook(
         self,
         user_api_key_dict: UserAPIKeyAuth,
@@ -38,48 +645,41 @@ class SecurityGuardrail(CustomGuardrail):
         """
         プロンプトインジェクション検出とPII情報のマスキングを行います
         """
-        logger.debug(f"Pre-call hook received data: {data}")
-        logger.debug(f"Call type: {call_type}")
-
-        messages = data.get("messages", [])
-        if messages:
-            for message in messages:
-                content = message.get("content")
-                logger.debug(f"Processing message content: {content}")
-                
-                if isinstance(content, str):
-                    # プロンプトインジェクション検出
-                    suspicious_patterns = [
-                        "system prompt",
-                        "ignore previous",
-                        "reveal instructions",
-                        "ignore above",
-                        "system message"
-                    ]
-                    for pattern in suspicious_patterns:
-                        if pattern in content.lower():
-                            logger.warning(f"Detected suspicious pattern: {pattern}")
-                            raise ValueError(f"Potential prompt injection detected: {pattern}")
-
-                    # PII情報のマスキング
-                    original_content = content
-                    
-                    # メールアドレス
-                    content = re.sub(r'\b[\w\.-]+@[\w\.-]+\.\w+\b', '[EMAIL]', content)
-                    # 電話番号 (日本の形式も含む)
-                    content = re.sub(r'(\d{2,4}[-.]?\d{2,4}[-.]?\d{4}|\d{10,11}|\d{3}[-.]?\d{4}[-.]?\d{4})', '[PHONE]', content)
-                    # クレジットカード番号
-                    content = re.sub(r'\b\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4}\b', '[CREDIT_CARD]', content)
-                    
-                    if content != original_content:
-                        logger.info("PII information was masked in the content")
-                        logger.debug(f"Original: {original_content}")
-                        logger.debug(f"Masked: {content}")
-                    
-                    message["content"] = content
-
-        logger.debug(f"Pre-call messages after processing: {messages}")
-        return data
+        start = time.perf_counter()
+        log_payload = self._log_payload()
+        if log_payload:
+            logger.debug("Pre-call hook received data (%s): %s", call_type, self._payload(data))
+
+        try:
+            shared_cache = cache if self.verdict_cache_shared else None
+            messages = data.get("messages", [])
+            if messages:
+                # 1つのリクエストのメッセージは並行して照合し、結果はメッセージの順に適用する
+                targets = [message for message in messages if isinstance(message.get("content"), str)]
+                verdicts = await asyncio.gather(
+                    *(self._input_verdict(message["content"], shared_cache) for message in targets)
+                )
+                for message, verdict in zip(targets, verdicts):
+                    if "blocked" in verdict:
+                        pattern = verdict["blocked"]
+                        self.metrics.inc("matches", check="injection", category="suspicious", pattern=pattern)
+                        logger.warning("Detected suspicious pattern: %s", pattern)
+                        raise ValueError(f"Potential prompt injection detected: {pattern}")
+
+                    if verdict["masked"] is not None:
+                        for entity, count in verdict["counts"].items():
+                            self.metrics.inc("pii_masked", count, entity=entity)
+                        logger.info("PII information was masked in the content: %s", verdict["counts"])
+                        if log_payload:
+                            logger.debug("Original: %s", self._payload(message["content"]))
+                            logger.debug("Masked: %s", self._payload(verdict["masked"]))
+                        message["content"] = verdict["masked"]
+
+            if log_payload:
+                logger.debug("Pre-call messages after processing: %s", self._payload(messages))
+            return data
+        finally:
+            self.metrics.observe("pre_call", "total", time.perf_counter() - start)
 
     async def async_post_call_success_hook(
         self,
@@ -90,52 +690,140 @@ class SecurityGuardrail(CustomGuardrail):
         """
         LLMの出力を検証し、機密情報や不適切な内容が含まれていないかチェックします
         """
-        logger.debug(f"Post-call hook received response: {response}")
-
-        if isinstance(response, litellm.ModelResponse):
-            for choice in response.choices:
-                if isinstance(choice.message.content, str):
-                    content = choice.message.content.lower()
-                    logger.debug(f"Checking content: {content}")
-                    
-                    # 機密情報のチェック
-                    sensitive_patterns = [
-                        "password",
-                        "secret",
-                        "confidential",
-                        "private key",
-                        "api key",
-                        "token",
-                        "credential",
-                        "authentication",
-                        "access key",
-                        "ssh key",
-                        "encryption key",
-                        "certificate"
-                    ]
-                    for pattern in sensitive_patterns:
-                        if pattern in content:
-                            logger.warning(f"Detected sensitive information: {pattern}")
-                            raise ValueError(f"Response contains sensitive information: {pattern}")
-
-                    # 不適切な内容のチェック
-                    inappropriate_patterns = [
-                        "hack",
-                        "exploit",
-                        "vulnerability",
-                        "attack",
-                        "malware",
-                        "virus",
-                        "ransomware",
-                        "phishing",
-                        "backdoor",
-                        "crack",
-                        "breach",
-                        "compromise"
-                    ]
-                    for pattern in inappropriate_patterns:
-                        if pattern in content:
-                            logger.warning(f"Detected inappropriate content: {pattern}")
-                            raise ValueError(f"Response contains potentially harmful content: {pattern}")
+        start = time.perf_counter()
+        if self._log_payload():
+            logger.debug("Post-call hook received response: %s", self._payload(response))
+
+        try:
+            if isinstance(response, litellm.ModelResponse):
+                for choice in response.choices:
+                    if isinstance(choice.message.content, str):
+                        self._raise_violation(await self._output_violation(choice.message.content))
+        finally:
+            self.metrics.observe("post_call", "total", time.perf_counter() - start)
 
         logger.debug("Post-call check completed successfully")
+
+    async def async_post_call_streaming_iterator_hook(
+        self,
+        user_api_key_dict: UserAPIKeyAuth,
+        response: Any,
+        request_data: dict,
+    ) -> AsyncGenerator[ModelResponseStream, None]:
+        """
+        ストリーミング応答をチャンクごとに検証し、違反が見つかった時点でストリームを打ち切ります
+
+        チャンクの境界をまたぐキーワードも検出できるよう、まだ返していないテキストの末尾
+        （最長のキーワードより1文字短い分）を次のチャンクの前に付けて照合します。この末尾は
+        次のチャンクで照合されるまで返さず、後から一致したキーワードの一部がクライアントに
+        届かないようにします。保留した末尾は finish_reason のあるチャンク、なければ
+        ストリームの最後に追加するチャンクで返します。遅れるのはこの数文字だけで、
+        応答全体はバッファしません。
+        """
+        overlap = self.output_matcher.max_length - 1
+        # choice の index -> 照合済みでまだ返していないテキストの末尾
+        pending: Dict[int, str] = {}
+        last_chunk = None
+        async for chunk in response:
+            last_chunk = chunk
+            for choice in getattr(chunk, "choices", None) or []:
+                delta = getattr(choice, "delta", None)
+                content = getattr(delta, "content", None)
+                if isinstance(content, str) and content:
+                    window = pending.pop(choice.index, "") + content
+                    violation, seconds = scan_output(self.output_matcher, window)
+                    self.metrics.observe("post_call_streaming", "output", seconds)
+                    self._raise_violation(violation)
+                    if overlap > 0 and not getattr(choice, "finish_reason", None):
+                        pending[choice.index] = window[-overlap:]
+                        window = window[:-overlap]
+                    delta.content = window
+                elif getattr(choice, "finish_reason", None) and choice.index in pending and delta is not None:
+                    delta.content = pending.pop(choice.index)
+            yield chunk
+
+        # finish_reason のチャンクがなかった choice の保留分を返す
+        pending = {index: text for index, text in pending.items() if text}
+        if pending and last_chunk is not None:
+            yield ModelResponseStream(
+                id=last_chunk.id,
+                created=last_chunk.created,
+                model=last_chunk.model,
+                choices=[StreamingChoices(index=index, delta=Delta(content=text))
+                         for index, text in sorted(pending.items())],
+            )
+
+        logger.debug("Streaming post-call check completed successfully")
+
+    async def _input_verdict(self, content: str, shared_cache: Optional[DualCache]) -> Dict[str, Any]:
+        """
+        メッセージの判定結果をキャッシュから取得し、なければ照合します（scan_input を参照）
+        """
+        key = self.verdict_cache.key("pre", content)
+        verdict = await self.verdict_cache.aget(key, shared_cache)
+        if verdict is not None:
+            self.metrics.inc("messages", hook="pre_call", source="cache")
+            return verdict
+
+        if len(content) < self.offload_threshold:
+            source = "inline"
+            verdict, timings = self._scan_input(content)
+        else:
+            source = "offload"
+            if self.offloader.uses_processes:
+                verdict, timings = await self.offloader.run(guardrail_scan.worker_scan_input, content)
+            else:
+                verdict, timings = await self.offloader.run(self._scan_input, content)
+        self.metrics.inc("messages", hook="pre_call", source=source)
+        for check, seconds in timings.items():
+            self.metrics.observe("pre_call", check, seconds)
+        await self.verdict_cache.aput(key, verdict, shared_cache)
+        return verdict
+
+    async def _output_violation(self, content: str) -> Optional[Tuple[str, str]]:
+        """
+        LLMの出力の照合結果 (カテゴリ, フレーズ) をキャッシュから取得し、なければ照合します
+        """
+        key = self.verdict_cache.key("post", content)
+        verdict = self.verdict_cache.get(key)
+        if verdict is not None:
+            self.metrics.inc("messages", hook="post_call", source="cache")
+            return verdict["violation"]
+
+        if len(content) < self.offload_threshold:
+            source = "inline"
+            violation, seconds = scan_output(self.output_matcher, content)
+        else:
+            source = "offload"
+            if self.offloader.uses_processes:
+                violation, seconds = await self.offloader.run(guardrail_scan.worker_scan_output, content)
+            else:
+                violation, seconds = await self.offloader.run(scan_output, self.output_matcher, content)
+        self.metrics.inc("messages", hook="post_call", source=source)
+        self.metrics.observe("post_call", "output", seconds)
+        self.verdict_cache.put(key, {"violation": violation})
+        return violation
+
+    def _scan_input(self, content: str) -> Tuple[Dict[str, Any], Dict[str, float]]:
+        """プロンプトインジェクションを検出し、PII情報をマスクします（scan_input を参照）"""
+        timings: Dict[str, float] = {}
+        return scan_input(self.injection_matcher, self.pii_masker, content, timings), timings
+
+    def _raise_violation(self, match: Optional[Tuple[str, str]]):
+        """出力の照合結果 (カテゴリ, フレーズ) が違反であれば ValueError を送出します"""
+        if match is not None:
+            category, pattern = match
+            self.metrics.inc("matches", check="output", category=category, pattern=pattern)
+            if category == "sensitive":
+                logger.warning("Detected sensitive information: %s", pattern)
+                raise ValueError(f"Response contains sensitive information: {pattern}")
+            logger.warning("Detected inappropriate content: %s", pattern)
+            raise ValueError(f"Response contains potentially harmful content: {pattern}")
+
+    def _log_payload(self) -> bool:
+        """リクエストの本文をログに出力するか（DEBUG が有効で、サンプルに選ばれたとき）"""
+        return (logger.isEnabledFor(logging.DEBUG)
+                and random.random() < self.log_payload_sample_rate)
+
+    def _payload(self, value: Any) -> _Payload:
+        return _Payload(value, self.log_payload_max_chars)
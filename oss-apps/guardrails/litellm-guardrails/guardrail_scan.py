@@ -0,0 +1,288 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import re
+import time
+import itertools
+
+# ガードレールの照合とマスクの処理。litellm に依存しないため、照合をプロセスプールで
+# 実行するときのワーカーは litellm を読み込まずにこのモジュールだけを import します
+
+try:
+    # pyahocorasick が入っていれば全キーワードを1つのオートマトンで照合する
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """
+    キーワードを共通の接頭辞でまとめた正規表現を作ります（例: api key, access key -> a(?:pi key|ccess key)）
+
+    選択肢の先頭の文字がすべて異なるため、各位置で試す選択肢はキーワードの数ではなく
+    一致する接頭辞の長さに比例します
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # ここで終わるキーワードがあれば、続きは省略可能（最長一致）
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """
+    カテゴリごとのキーワードリストを初期化時に1つの照合器にまとめ、1回の走査で照合します
+
+    大文字小文字は区別しません。複数のキーワードが含まれる場合は、
+    カテゴリの順、カテゴリ内ではリストの順で最初のキーワードを返します。
+    pyahocorasick がインストールされていればそのオートマトンで、なければキーワードを
+    共通の接頭辞でまとめた1つの正規表現で、どちらもテキストを1回だけ走査して照合します。
+    """
+
+    def __init__(self, categories: Dict[str, Iterable[str]], use_automaton: bool = True):
+        """
+        Args:
+            categories (Dict[str, Iterable[str]]): カテゴリ名とキーワードのリスト（優先順）
+            use_automaton (bool): False にすると pyahocorasick があっても正規表現で照合します（比較用）
+        """
+        self.categories = {category: list(words) for category, words in categories.items()}
+        # 優先順位 -> (カテゴリ, キーワード)
+        self.keywords: List[Tuple[str, str]] = []
+        seen = set()
+        for category, words in self.categories.items():
+            for word in words:
+                keyword = word.lower()
+                if keyword and keyword not in seen:
+                    seen.add(keyword)
+                    self.keywords.append((category, keyword))
+        # 最長のキーワードの長さ（ストリーミングでチャンク間に残す文字数の計算に使う）
+        self.max_length = max((len(keyword) for _, keyword in self.keywords), default=0)
+
+        self._automaton = None
+        self._regex = None
+        if ahocorasick is not None and use_automaton and self.keywords:
+            self._automaton = ahocorasick.Automaton()
+            for rank, (_, keyword) in enumerate(self.keywords):
+                self._automaton.add_word(keyword, rank)
+            self._automaton.make_automaton()
+        elif self.keywords:
+            ranks = {keyword: rank for rank, (_, keyword) in enumerate(self.keywords)}
+            # 正規表現は各位置で最長のキーワードを返すため、その位置から始まる短いキーワード
+            # （接頭辞）も含めた最も高い優先順位を一致したキーワードごとに求めておく
+            self._prefix_ranks = {
+                keyword: min(ranks[keyword[:end]] for end in range(1, len(keyword) + 1) if keyword[:end] in ranks)
+                for keyword in ranks
+            }
+            # 先読みにすることで、重なり合うキーワードもすべての位置で照合する
+            self._regex = re.compile(f"(?=({_trie_pattern(ranks)}))")
+
+    def search(self, text: str) -> Optional[Tuple[str, str]]:
+        """
+        テキストに含まれる最も優先順位の高いキーワードを探します
+
+        Args:
+            text (str): 照合するテキスト
+
+        Returns:
+            Optional[Tuple[str, str]]: (カテゴリ, キーワード)、含まれなければ None
+        """
+        lowered = text.lower()
+        if self._automaton is not None:
+            best = None
+            for _, rank in self._automaton.iter(lowered):
+                if best is None or rank < best:
+                    best = rank
+                    if rank == 0:
+                        break
+            return self.keywords[best] if best is not None else None
+
+        best = None
+        if self._regex is not None:
+            for match in self._regex.finditer(lowered):
+                rank = self._prefix_ranks[match.group(1)]
+                if best is None or rank < best:
+                    best = rank
+                    if rank == 0:
+                        break
+        return self.keywords[best] if best is not None else None
+
+
+# 組み込みのPIIの種類、正規表現と、一致の先頭になりうる文字（文字クラスの中身、不明なら None）。
+# 同じ位置で複数のパターンに一致する場合は先に書いたものが優先される
+# （16桁のカード番号や12桁のマイナンバーを電話番号より先に判定する）
+BUILTIN_PII_PATTERNS = {
+    # メールアドレス
+    "EMAIL": (r'\b[\w\.-]+@[\w\.-]+\.\w+\b', None),
+    # クレジットカード番号
+    "CREDIT_CARD": (r'(?<!\d)\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4}(?!\d)', r'\d'),
+    # マイナンバー（12桁）
+    "MY_NUMBER": (r'(?<!\d)\d{4}[-\s]?\d{4}[-\s]?\d{4}(?!\d)', r'\d'),
+    # 電話番号 (日本の形式も含む)
+    "PHONE": (r'\d{2,4}[-.]?\d{2,4}[-.]?\d{4}|\d{10,11}|\d{3}[-.]?\d{4}[-.]?\d{4}', r'\d'),
+    # 郵便番号
+    "POSTAL_CODE": (r'(?:〒\s?)?(?<!\d)\d{3}-\d{4}(?!\d)', r'\d〒'),
+}
+
+# デフォルトでマスクする種類。MY_NUMBER と POSTAL_CODE は桁数だけで判定するため
+# 注文番号などもマスクされやすく、pii_patterns で指定したときだけ有効にする
+DEFAULT_PII_PATTERNS = {
+    name: BUILTIN_PII_PATTERNS[name] for name in ("EMAIL", "CREDIT_CARD", "PHONE")
+}
+
+
+class PIIMasker:
+    """
+    PIIの種類ごとの正規表現を名前付きグループの選択として1つにまとめ、1回の走査でマスクします
+
+    一致した部分は `[種類]`（例: `[EMAIL]`）に置き換えられます。
+    先頭になりうる文字が分かっている連続した種類は先読み `(?=[...])` でまとめ、
+    それらの文字以外の位置では個々のパターンを試さずに次へ進みます。
+    """
+
+    def __init__(self, patterns: Optional[Dict[str, Tuple[str, Optional[str]]]] = None):
+        """
+        Args:
+            patterns (Optional[Dict[str, Tuple[str, Optional[str]]]]): PIIの種類と
+                (正規表現, 先頭になりうる文字) の辞書（優先順）。省略時は DEFAULT_PII_PATTERNS
+        """
+        self.patterns: Dict[str, Tuple[str, Optional[str]]] = {}
+        for name, (pattern, start_chars) in (DEFAULT_PII_PATTERNS if patterns is None else patterns).items():
+            self._add(name, pattern, start_chars)
+        self._compile()
+
+    def _add(self, name: str, pattern: str, start_chars: Optional[str]):
+        """パターンを検証して追加します"""
+        if not name.isidentifier():
+            raise ValueError(f"PII entity name must be an identifier: {name!r}")
+        if re.compile(pattern).groupindex:
+            raise ValueError(f"PII pattern for {name} must not contain named groups")
+        if start_chars is not None:
+            re.compile(f"[{start_chars}]")
+        self.patterns[name] = (pattern, start_chars)
+
+    def _compile(self):
+        parts = []
+        for guarded, entities in itertools.groupby(self.patterns.items(), key=lambda item: item[1][1] is not None):
+            entities = list(entities)
+            alternation = "|".join(f"(?P<{name}>{pattern})" for name, (pattern, _) in entities)
+            if guarded:
+                start_chars = "".join(dict.fromkeys(start for _, (_, start) in entities))
+                alternation = f"(?=[{start_chars}])(?:{alternation})"
+            parts.append(alternation)
+        self._regex = re.compile("|".join(parts))
+
+    def enable(self, name: str):
+        """
+        組み込みのPIIの種類（BUILTIN_PII_PATTERNS）を、組み込みの優先順位の位置に追加します
+
+        Args:
+            name (str): PIIの種類（例: MY_NUMBER）
+        """
+        if name not in BUILTIN_PII_PATTERNS:
+            raise ValueError(f"Unknown built-in PII entity: {name!r}, expected one of {list(BUILTIN_PII_PATTERNS)}")
+        self._add(name, *BUILTIN_PII_PATTERNS[name])
+        # 組み込みの種類は組み込みの順、それ以外は追加した順でその後ろに並べる
+        order = list(BUILTIN_PII_PATTERNS)
+        self.patterns = dict(sorted(
+            self.patterns.items(), key=lambda item: order.index(item[0]) if item[0] in order else len(order)
+        ))
+        self._compile()
+
+    def register(self, name: str, pattern: str, start_chars: Optional[str] = None):
+        """
+        PIIの種類を追加します。既存の種類は優先順位を変えずにパターンを置き換えます
+
+        Args:
+            name (str): PIIの種類（置換後の文字列 `[name]` に使われます）
+            pattern (str): 正規表現
+            start_chars (Optional[str]): 一致の先頭になりうる文字（文字クラスの中身、例: `\\d`）
+        """
+        self._add(name, pattern, start_chars)
+        self._compile()
+
+    def mask(self, text: str) -> Tuple[str, Dict[str, int]]:
+        """
+        テキストに含まれるPIIをマスクします
+
+        Args:
+            text (str): マスクするテキスト
+
+        Returns:
+            Tuple[str, Dict[str, int]]: マスクしたテキストと、種類ごとのマスクした件数
+        """
+        counts: Dict[str, int] = {}
+
+        def replace(match: re.Match) -> str:
+            # 外側の名前付きグループが最後に閉じるため lastgroup が一致した種類になる
+            name = match.lastgroup
+            counts[name] = counts.get(name, 0) + 1
+            return f"[{name}]"
+
+        return self._regex.sub(replace, text), counts
+
+
+def scan_input(injection_matcher: KeywordMatcher, pii_masker: PIIMasker, content: str,
+               timings: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """
+    プロンプトインジェクションを検出し、PII情報をマスクします
+
+    Args:
+        timings (Optional[Dict[str, float]]): 指定すると、チェックごとの処理時間（秒）を
+            "injection" / "pii" に記録します
+
+    Returns:
+        Dict[str, Any]: 検出したフレーズ {"blocked": フレーズ}、または
+        マスク後のテキスト（変更がなければ None）と種類ごとの件数 {"masked": ..., "counts": ...}
+    """
+    # プロンプトインジェクション検出
+    start = time.perf_counter()
+    match = injection_matcher.search(content)
+    if timings is not None:
+        timings["injection"] = time.perf_counter() - start
+    if match is not None:
+        return {"blocked": match[1]}
+
+    # PII情報のマスキング
+    start = time.perf_counter()
+    masked, counts = pii_masker.mask(content)
+    if timings is not None:
+        timings["pii"] = time.perf_counter() - start
+    return {"masked": masked if counts else None, "counts": counts}
+
+
+def scan_output(output_matcher: KeywordMatcher, content: str) -> Tuple[Optional[Tuple[str, str]], float]:
+    """LLMの出力を照合し、結果 (カテゴリ, フレーズ) と処理時間（秒）を返します"""
+    start = time.perf_counter()
+    violation = output_matcher.search(content)
+    return violation, time.perf_counter() - start
+
+
+# プロセスプールのワーカーで使う照合器（init_worker で構築する）
+_scanners: Optional[Tuple[KeywordMatcher, KeywordMatcher, PIIMasker]] = None
+
+
+def init_worker(injection_categories: Dict[str, List[str]], output_categories: Dict[str, List[str]],
+                pii_patterns: Dict[str, Tuple[str, Optional[str]]]):
+    """プロセスプールのワーカーで、親プロセスと同じ設定の照合器を構築します"""
+    global _scanners
+    _scanners = (KeywordMatcher(injection_categories), KeywordMatcher(output_categories),
+                 PIIMasker(pii_patterns))
+
+
+def worker_scan_input(content: str) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    injection_matcher, _, pii_masker = _scanners
+    timings: Dict[str, float] = {}
+    return scan_input(injection_matcher, pii_masker, content, timings), timings
+
+
+def worker_scan_output(content: str) -> Tuple[Optional[Tuple[str, str]], float]:
+    return scan_output(_scanners[1], content)
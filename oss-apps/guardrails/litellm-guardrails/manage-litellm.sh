@@ -8,6 +8,8 @@ NC='\033[0m' # No Color
 CONFIG_FILE="default_config.yml"
 ROLE_NAME=""
 ENV_FILE=".env"
+MOCK=""
+METRICS=""
 
 log_info() {
     echo -e "${GREEN}[INFO]${NC} $1"
@@ -33,7 +35,17 @@ start_services() {
         log_warn "環境変数ファイルが見つかりません: $ENV_FILE"
     fi
     
-    cmd="$cmd -f docker-compose.yml up -d"
+    if [ -n "$MOCK" ]; then
+        log_info "モックのLLM（mock-llm）と config.mock.yml で起動します"
+        cmd="CONFIG_FILE=config.mock.yml $cmd --profile mock"
+    fi
+    
+    cmd="$cmd -f docker-compose.yml"
+    if [ -n "$METRICS" ]; then
+        log_info "ガードレールの /metrics を 127.0.0.1:19464 に公開します"
+        cmd="$cmd -f docker-compose.metrics.yml"
+    fi
+    cmd="$cmd up -d --build"
     log_info "実行コマンド: $cmd"
     eval "$cmd"
     
@@ -47,7 +59,7 @@ start_services() {
 
 stop_services() {
     log_info "LiteLLM サービスを停止しています..."
-    docker compose -f docker-compose.yml down
+    docker compose -f docker-compose.yml --profile mock down
     log_info "LiteLLM が停止しました"
 }
 
@@ -121,10 +133,13 @@ show_help() {
     echo
     echo "Options:"
     echo "  -e, --env-file FILE - 環境変数ファイルを指定 (デフォルト: .env)"
+    echo "  -m, --mock          - Bedrock の代わりにモックのLLMを使用 (負荷試験用)"
+    echo "  --metrics           - ガードレールの /metrics をホストの 127.0.0.1:19464 に公開"
     echo "  -h, --help          - このヘルプメッセージを表示"
     echo
     echo "Examples:"
     echo "  $0 start -e custom.env"
+    echo "  $0 start --mock"
     echo "  $0 set-policy"
 }
 
@@ -143,6 +158,12 @@ while [[ "$#" -gt 0 ]]; do
             ENV_FILE="$2"
             shift
             ;;
+        -m|--mock)
+            MOCK=1
+            ;;
+        --metrics)
+            METRICS=1
+            ;;
         -h|--help)
             show_help
             exit 0
@@ -0,0 +1,146 @@
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def last_user_message(messages):
+    """最後の user メッセージのテキスト（content が配列の場合は text の部分をつなげる）"""
+    for message in reversed(messages or []):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content")
+        if isinstance(content, list):
+            return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        return content or ""
+    return ""
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI 互換の /chat/completions を模したハンドラ
+
+    応答は最後の user メッセージをそのまま返します。プロキシのガードレールがマスクした
+    プレースホルダーは応答にも現れるため、test_guardrails.py の判定もそのまま使えます
+    """
+    protocol_version = "HTTP/1.1"
+    latency_ms = 0.0
+    jitter_ms = 0.0
+    max_echo_chars = 2000
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/models", "/v1/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "mock-model", "object": "model", "owned_by": "mock"}]})
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": {"message": f"Not found: {self.path}"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/chat/completions", "/v1/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Not found: {self.path}"}})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError as e:
+            self.send_json(400, {"error": {"message": f"Invalid JSON: {e}"}})
+            return
+
+        # 上流のLLMの応答時間を模す
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        prompt = last_user_message(body.get("messages"))
+        text = f"Mock response: {prompt[:self.max_echo_chars]}"
+        model = body.get("model", "mock-model")
+        created = int(time.time())
+        completion_id = f"chatcmpl-mock-{created}-{random.randrange(16**8):08x}"
+        if body.get("stream"):
+            self.send_stream(completion_id, created, model, text)
+            return
+
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in body.get("messages") or [])
+        completion_tokens = len(text.split())
+        self.send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, completion_id: str, created: int, model: str, text: str):
+        """単語ごとのチャンクを Server-Sent Events で返します"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        words = text.split(" ")
+        for index, word in enumerate(words):
+            delta = {"content": word if index == 0 else " " + word}
+            if index == 0:
+                delta["role"] = "assistant"
+            self.send_event(completion_id, created, model, delta, None)
+        self.send_event(completion_id, created, model, {}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def send_event(self, completion_id: str, created: int, model: str, delta: dict, finish_reason):
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='負荷試験用の OpenAI 互換のモックサーバー（入力をそのまま返します）')
+    parser.add_argument('--host', default='127.0.0.1', help='待ち受けるアドレス（デフォルト: 127.0.0.1）')
+    parser.add_argument('--port', type=int, default=8080, help='待ち受けるポート（デフォルト: 8080）')
+    parser.add_argument('--latency-ms', type=float, default=200, help='応答までの時間（ミリ秒、デフォルト: 200）')
+    parser.add_argument('--jitter-ms', type=float, default=50, help='応答時間のばらつき（ミリ秒、デフォルト: 50）')
+    args = parser.parse_args()
+
+    MockHandler.latency_ms = args.latency_ms
+    MockHandler.jitter_ms = args.jitter_ms
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    print(f"Mock OpenAI server listening on http://{args.host}:{args.port}/v1 "
+          f"(latency {args.latency_ms:.0f}±{args.jitter_ms:.0f} ms)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
-import requests
+import httpx
 import json
 import os
+import sys
+import time
+import hashlib
+import sqlite3
+import asyncio
 import argparse
+import statistics
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 # テスト対象のモデルリスト
 MODELS = [
@@ -124,16 +130,16 @@ TEST_CASES = [
     }
 ]
 
-def test_request(messages: List[Dict[str, str]], model: str, guardrails: List[str] = None, guardrail_config: Dict[str, Any] = None) -> Dict[str, Any]:
+PROXY_URL = "http://localhost:14000/chat/completions"
+PROXY_HEADERS = {
+    "Content-Type": "application/json",
+    "Authorization": "Bearer sk-litellm-test-key"
+}
+
+def build_request_data(messages: List[Dict[str, str]], model: str, guardrails: List[str] = None, guardrail_config: Dict[str, Any] = None) -> Dict[str, Any]:
     """
-    LLMにリクエストを送信し、結果を返す
+    プロキシに送信するリクエストの本文を作成
     """
-    url = "http://localhost:14000/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": "Bearer sk-litellm-test-key"
-    }
-    
     data = {
         "model": model,
         "messages": messages,
@@ -146,29 +152,161 @@ def test_request(messages: List[Dict[str, str]], model: str, guardrails: List[st
     
     if guardrail_config:
         data["guardrail_config"] = guardrail_config
-    
-    print("\n--- リクエスト内容 ---")
-    print(json.dumps(data, indent=2, ensure_ascii=False))
-    
+    return data
+
+def parse_response(response: Any) -> Dict[str, Any]:
+    """
+    httpx のレスポンスを結果の辞書に変換
+    """
+    result = {
+        "status_code": response.status_code,
+        "headers": dict(response.headers),
+        "content": response.text,
+    }
     try:
-        response = requests.post(url, headers=headers, json=data)
-        result = {
-            "status_code": response.status_code,
-            "headers": dict(response.headers),
-            "content": response.text,
-        }
+        result["json"] = response.json()
+    except ValueError:
+        result["json"] = None
+    return result
+
+def error_result(e: Exception) -> Dict[str, Any]:
+    return {
+        "status_code": -1,
+        "error": str(e),
+        "headers": {},
+        "content": None,
+        "json": None
+    }
+
+def request_key(data: Dict[str, Any]) -> str:
+    """
+    リクエストの (model, messages, guardrails, guardrail_config) の正規化したJSONのSHA-256
+    """
+    canonical = {
+        "model": data["model"],
+        "messages": data["messages"],
+        "guardrails": data.get("guardrails") or [],
+        "guardrail_config": data.get("guardrail_config") or {},
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode()).hexdigest()
+
+class Cassette:
+    """
+    リクエストごとのレスポンスを記録し、ネットワークを使わずに再生するためのJSONLファイル
+
+    1行が1つのレスポンスで、同じリクエストを記録し直すと後の行が優先される。
+    record モードではプロキシに送信したレスポンスを追記し、replay モードでは記録したレスポンスを返す。
+    replay で記録のないリクエストは送信せず、misses に記録する
+    """
+    def __init__(self, path: str, mode: str):
+        self.path = path
+        self.mode = mode
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.misses: List[Dict[str, Any]] = []
+        self.recorded = 0
         try:
-            result["json"] = response.json()
-        except json.JSONDecodeError:
-            result["json"] = None
+            with open(path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+        except FileNotFoundError:
+            if mode == "replay":
+                raise
+
+    def replay(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """記録したレスポンスを返す（記録がなければ misses に追加して None）"""
+        entry = self.entries.get(request_key(data))
+        if entry is None:
+            self.misses.append(data)
+            return None
+        return entry["result"]
+
+    def record(self, data: Dict[str, Any], result: Dict[str, Any]):
+        """レスポンスを追記する（接続エラーなど、プロキシの応答がない結果は記録しない）"""
+        if result["status_code"] < 0:
+            return
+        entry = {
+            "key": request_key(data),
+            "recorded_at": datetime.now().isoformat(),
+            "model": data["model"],
+            "guardrails": data.get("guardrails"),
+            "result": result,
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.entries[entry["key"]] = entry
+        self.recorded += 1
+
+class RateLimiter:
+    """
+    1秒あたりのリクエスト数の上限に合わせて、リクエストの開始を一定の間隔に揃える
+    """
+    def __init__(self, rate: Optional[float]):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+async def async_test_request(client: httpx.AsyncClient, messages: List[Dict[str, str]], model: str, guardrails: List[str] = None, guardrail_config: Dict[str, Any] = None, cassette: Optional[Cassette] = None) -> Dict[str, Any]:
+    """
+    接続プールを共有するクライアントでLLMにリクエストを送信し、結果を返す
+
+    cassette が replay モードなら送信せずに記録した結果を返し（記録がなければエラーの結果）、
+    record モードなら送信した結果を記録する
+    """
+    data = build_request_data(messages, model, guardrails, guardrail_config)
+    if cassette is not None and cassette.mode == "replay":
+        result = cassette.replay(data)
+        if result is None:
+            return error_result(RuntimeError(f"カセットに記録がありません: {data['model']} {request_key(data)[:12]}"))
         return result
+    try:
+        response = await client.post(PROXY_URL, headers=PROXY_HEADERS, json=data)
+        result = parse_response(response)
     except Exception as e:
-        return {
-            "status_code": -1,
-            "error": str(e),
-            "content": None,
-            "json": None
-        }
+        return error_result(e)
+    if cassette is not None:
+        cassette.record(data, result)
+    return result
+
+async def run_tests(jobs: List[tuple], concurrency: int, rate_limits: Dict[str, Optional[float]], timeout: float, on_result, cassette: Optional[Cassette] = None) -> None:
+    """
+    (テストケース, モデル) の組を並行して実行する
+
+    同時に実行するリクエストは concurrency 件まで、モデルごとの開始間隔は rate_limits
+    （1秒あたりのリクエスト数、None は無制限）に従う。結果は完了した順に on_result に渡す。
+    cassette が replay モードならネットワークを使わないため、開始間隔の制限もしない
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    replaying = cassette is not None and cassette.mode == "replay"
+    limiters = {model: RateLimiter(None if replaying else rate) for model, rate in rate_limits.items()}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        async def run_job(test_case: Dict[str, Any], model: str):
+            await limiters[model].acquire()
+            async with semaphore:
+                result = await async_test_request(
+                    client,
+                    test_case["messages"],
+                    model,
+                    test_case.get("guardrails"),
+                    test_case.get("guardrail_config"),
+                    cassette
+                )
+            on_result(test_case, model, result)
+
+        await asyncio.gather(*(run_job(test_case, model) for test_case, model in jobs))
 
 def analyze_result(result: Dict[str, Any], test_case: Dict[str, Any]) -> str:
     """
@@ -216,22 +354,297 @@ def analyze_result(result: Dict[str, Any], test_case: Dict[str, Any]) -> str:
     
     return "❓ 不明なテストケース"
 
-def load_previous_results() -> Dict[str, Dict[str, Any]]:
+# テスト結果の保存先（実行ごとの履歴を追記する SQLite データベース）
+RESULTS_DB = "/tmp/guardrails_test_results.sqlite3"
+# 以前の形式の保存先（データベースが空のときに1つの実行として取り込む）
+LEGACY_RESULTS_FILE = "/tmp/guardrails_test_results.json"
+
+RESULTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    mode TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    test_name TEXT NOT NULL,
+    model TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    status_code INTEGER,
+    analysis TEXT NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_test_model ON results (test_name, model, id);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_id);
+"""
+
+def open_results_store(path: str = RESULTS_DB) -> sqlite3.Connection:
     """
-    前回のテスト結果を読み込む
+    テスト結果のデータベースを開く（なければ作成し、以前の形式の結果を取り込む）
+    """
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(RESULTS_SCHEMA)
+    if conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0] == 0:
+        import_legacy_results(conn)
+    return conn
+
+def import_legacy_results(conn: sqlite3.Connection, path: str = LEGACY_RESULTS_FILE):
+    """
+    以前の形式（キーが "テストケース名_モデル" のJSON）の結果を1つの実行として取り込む
     """
     try:
-        with open("/tmp/guardrails_test_results.json", "r") as f:
-            return json.load(f)
+        with open(path, "r") as f:
+            legacy = json.load(f)
     except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+        return
+    run_id = start_run(conn, "legacy")
+    names = sorted((test_case["name"] for test_case in TEST_CASES), key=len, reverse=True)
+    for key, entry in legacy.items():
+        # テストケース名に "_" が含まれうるため、既知の名前で分割する
+        name = next((name for name in names if key.startswith(f"{name}_")), None)
+        if name is not None:
+            save_result(conn, run_id, name, key[len(name) + 1:], entry)
 
-def save_results(results: Dict[str, Dict[str, Any]]):
+def start_run(conn: sqlite3.Connection, mode: str) -> int:
     """
-    テスト結果を保存
+    実行を記録し、その ID を返す
     """
-    with open("/tmp/guardrails_test_results.json", "w") as f:
-        json.dump(results, f, indent=2)
+    with conn:
+        cursor = conn.execute("INSERT INTO runs (started_at, mode) VALUES (?, ?)", (datetime.now().isoformat(), mode))
+    return cursor.lastrowid
+
+def save_result(conn: sqlite3.Connection, run_id: int, test_name: str, model: str, entry: Dict[str, Any]):
+    """
+    テスト結果を1行追記する（それまでの結果は書き直さない）
+    """
+    with conn:
+        conn.execute(
+            "INSERT INTO results (run_id, test_name, model, timestamp, status_code, analysis, result) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (run_id, test_name, model, entry["timestamp"], entry["result"].get("status_code"), entry["analysis"],
+             json.dumps(entry["result"], ensure_ascii=False)),
+        )
+
+def row_to_entry(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "run_id": row["run_id"],
+        "timestamp": row["timestamp"],
+        "result": json.loads(row["result"]),
+        "analysis": row["analysis"],
+    }
+
+def load_previous_result(conn: sqlite3.Connection, test_name: str, model: str) -> Optional[Dict[str, Any]]:
+    """
+    テストケースとモデルの組の最新の結果を取得する
+    """
+    row = conn.execute(
+        "SELECT * FROM results WHERE test_name = ? AND model = ? ORDER BY id DESC LIMIT 1", (test_name, model)
+    ).fetchone()
+    return row_to_entry(row) if row else None
+
+def load_run_results(conn: sqlite3.Connection, run_id: int) -> Dict[str, Dict[str, Any]]:
+    """
+    1つの実行の結果を "テストケース名_モデル" をキーとする辞書で取得する
+    """
+    rows = conn.execute("SELECT * FROM results WHERE run_id = ? ORDER BY id", (run_id,))
+    return {f"{row['test_name']}_{row['model']}": row_to_entry(row) for row in rows}
+
+def list_runs(conn: sqlite3.Connection, limit: int = 20):
+    """
+    最近の実行の一覧を表示
+    """
+    rows = conn.execute(
+        """
+        SELECT runs.id, runs.started_at, runs.mode, COUNT(results.id) AS total,
+               SUM(results.analysis LIKE '✅%') AS passed
+        FROM runs LEFT JOIN results ON results.run_id = runs.id
+        GROUP BY runs.id ORDER BY runs.id DESC LIMIT ?
+        """,
+        (limit,),
+    ).fetchall()
+    print("| 実行 | 開始時刻 | モード | テスト数 | 成功 |")
+    print("|---|---|---|---|---|")
+    for row in rows:
+        print(f"| {row['id']} | {row['started_at']} | {row['mode']} | {row['total']} | {row['passed'] or 0} |")
+
+def diff_runs(conn: sqlite3.Connection, base_run: Optional[int] = None, run: Optional[int] = None) -> str:
+    """
+    2つの実行で分析結果が変わったテストケースとモデルの組をMarkdown形式の表で返す
+    （指定しなければ、結果のある最新の2つの実行を比較する）
+    """
+    if base_run is None or run is None:
+        latest = [row[0] for row in conn.execute(
+            "SELECT DISTINCT run_id FROM results ORDER BY run_id DESC LIMIT 2")]
+        if len(latest) < 2:
+            return "比較できる実行が2つありません\n"
+        run, base_run = latest
+    base = load_run_results(conn, base_run)
+    current = load_run_results(conn, run)
+
+    headers = ["テストケース", "モデル", f"実行 {base_run}", f"実行 {run}"]
+    markdown = "| " + " | ".join(headers) + " |\n"
+    markdown += "|" + "|".join(["---"] * len(headers)) + "|\n"
+    changed = 0
+    for test_case in TEST_CASES:
+        for model in MODELS:
+            key = f"{test_case['name']}_{model}"
+            before = base[key]["analysis"] if key in base else "未テスト"
+            after = current[key]["analysis"] if key in current else "未テスト"
+            if before != after:
+                markdown += f"| {test_case['name']} | {model} | {before} | {after} |\n"
+                changed += 1
+    if not changed:
+        return f"実行 {base_run} と実行 {run} の分析結果に違いはありません\n"
+    return markdown
+
+def load_payloads(test_cases: List[Dict[str, Any]], model: str, guardrails: Optional[List[str]]) -> List[Dict[str, Any]]:
+    """
+    負荷試験で繰り返し送信するリクエストを作成
+
+    guardrails が None ならテストケースのガードレールをそのまま使い、空のリストならガードレールなしで送信する
+    """
+    payloads = []
+    for test_case in test_cases:
+        if guardrails is None:
+            payloads.append(build_request_data(test_case["messages"], model, test_case.get("guardrails"), test_case.get("guardrail_config")))
+        else:
+            payloads.append(build_request_data(test_case["messages"], model, guardrails, test_case.get("guardrail_config") if guardrails else None))
+    return payloads
+
+async def run_load(payloads: List[Dict[str, Any]], duration: float, rps: Optional[float], concurrency: int, timeout: float) -> Dict[str, Any]:
+    """
+    payloads を順番に繰り返し送信し、duration 秒の間の各リクエストのレイテンシとステータスを記録
+
+    rps を指定すると、応答を待たずに一定の間隔でリクエストを開始する（オープンループ）。
+    接続が concurrency 件を超えると空きを待ち、その待ち時間もレイテンシに含める。
+    rps を指定しなければ、concurrency 件のリクエストを常に実行し続ける（クローズドループ）
+    """
+    records = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        async def send(payload: Dict[str, Any], start: float):
+            try:
+                response = await client.post(PROXY_URL, headers=PROXY_HEADERS, json=payload)
+                status = response.status_code
+            except Exception:
+                status = -1
+            records.append((time.monotonic() - start, status))
+
+        started = time.monotonic()
+        deadline = started + duration
+        if rps:
+            tasks = []
+            interval = 1.0 / rps
+            index = 0
+            while started + index * interval < deadline:
+                # 開始予定時刻から計測し、送信側の遅れもレイテンシに含める
+                scheduled = started + index * interval
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(send(payloads[index % len(payloads)], scheduled)))
+                index += 1
+            await asyncio.gather(*tasks)
+        else:
+            counter = iter(range(10**12))
+
+            async def worker():
+                while time.monotonic() < deadline:
+                    await send(payloads[next(counter) % len(payloads)], time.monotonic())
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    return summarize_load(records, elapsed)
+
+def summarize_load(records: List[tuple], elapsed: float) -> Dict[str, Any]:
+    """
+    負荷試験の記録からスループット、エラー率、レイテンシの分位数を集計
+    """
+    latencies = sorted(latency for latency, _ in records)
+    statuses: Dict[str, int] = {}
+    for _, status in records:
+        group = "failed" if status < 0 else f"{status // 100}xx"
+        statuses[group] = statuses.get(group, 0) + 1
+    ok = statuses.get("2xx", 0)
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    else:
+        quantiles = latencies * 99 or [0.0] * 99
+    return {
+        "requests": len(records),
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(records) / elapsed if elapsed else 0.0,
+        "ok_rps": ok / elapsed if elapsed else 0.0,
+        "error_rate": 1 - ok / len(records) if records else 0.0,
+        "statuses": dict(sorted(statuses.items())),
+        "latency_ms_p50": quantiles[49] * 1000,
+        "latency_ms_p95": quantiles[94] * 1000,
+        "latency_ms_p99": quantiles[98] * 1000,
+    }
+
+def create_load_table(reports: Dict[str, Dict[str, Any]]) -> str:
+    """
+    負荷試験の結果をガードレールの設定ごとにMarkdown形式の表に変換
+    """
+    headers = ["ガードレール", "リクエスト数", "スループット (req/s)", "成功 (req/s)", "エラー率", "ステータス", "p50 (ms)", "p95 (ms)", "p99 (ms)"]
+    markdown = "| " + " | ".join(headers) + " |\n"
+    markdown += "|" + "|".join(["---"] * len(headers)) + "|\n"
+    for name, report in reports.items():
+        row = [
+            name,
+            str(report["requests"]),
+            f"{report['throughput_rps']:.1f}",
+            f"{report['ok_rps']:.1f}",
+            f"{report['error_rate']:.1%}",
+            ", ".join(f"{group}: {count}" for group, count in report["statuses"].items()),
+            f"{report['latency_ms_p50']:.1f}",
+            f"{report['latency_ms_p95']:.1f}",
+            f"{report['latency_ms_p99']:.1f}",
+        ]
+        markdown += "| " + " | ".join(row) + " |\n"
+    return markdown
+
+def run_load_test(args: argparse.Namespace, test_cases: List[Dict[str, Any]]):
+    """
+    ガードレールの設定ごとに負荷試験を実行し、結果を比較する表を表示
+    """
+    model = args.load_model
+    mode = f"{args.rps} req/s" if args.rps else f"同時実行数 {args.concurrency}"
+    print(f"負荷試験: {model}, {mode}, 設定ごとに {args.duration} 秒")
+
+    reports = {}
+    for config in args.load_guardrails:
+        # "none" はガードレールなし、"case" はテストケースのガードレール、それ以外はカンマ区切りのガードレール名
+        if config == "none":
+            guardrails = []
+        elif config == "case":
+            guardrails = None
+        else:
+            guardrails = config.split(",")
+        payloads = load_payloads(test_cases, model, guardrails)
+        print(f"\n--- {config} ---")
+        report = asyncio.run(run_load(payloads, args.duration, args.rps, max(1, args.concurrency), args.timeout))
+        print(f"{report['requests']} リクエスト, p50 {report['latency_ms_p50']:.1f} ms, エラー率 {report['error_rate']:.1%}")
+        reports[config] = report
+
+    print("\n=== 負荷試験の結果 ===\n")
+    print(create_load_table(reports))
+    if args.load_output:
+        with open(args.load_output, "w") as f:
+            json.dump({
+                "timestamp": datetime.now().isoformat(),
+                "model": model,
+                "duration": args.duration,
+                "rps": args.rps,
+                "concurrency": args.concurrency,
+                "test_cases": [test_case["name"] for test_case in test_cases],
+                "reports": reports,
+            }, f, indent=2, ensure_ascii=False)
+        print(f"結果を保存しました: {args.load_output}")
 
 def print_result_details(test_case: Dict[str, Any], model: str, result: Dict[str, Any], analysis: str):
     """
@@ -243,6 +656,10 @@ def print_result_details(test_case: Dict[str, Any], model: str, result: Dict[str
     print(f"入力: {test_case['messages'][0]['content']}")
     print(f"ステータスコード: {result['status_code']}")
     print(f"分析結果: {analysis}")
+
+    print("\n--- リクエスト内容 ---")
+    request_data = build_request_data(test_case["messages"], model, test_case.get("guardrails"), test_case.get("guardrail_config"))
+    print(json.dumps(request_data, indent=2, ensure_ascii=False))
     
     print("\n--- レスポンスヘッダー ---")
     print(json.dumps(result["headers"], indent=2, ensure_ascii=False))
@@ -261,6 +678,8 @@ def print_result_details(test_case: Dict[str, Any], model: str, result: Dict[str
 def create_markdown_table(results: Dict[str, Dict[str, Any]]) -> str:
     """
     テスト結果をMarkdown形式の表に変換
+
+    結果の辞書の順序（並行実行では完了順）によらず、行は TEST_CASES、列は MODELS の順に並べる
     """
     # ヘッダー行の作成
     headers = ["テストケース"] + MODELS
@@ -355,19 +774,48 @@ def main():
     parser.add_argument('--list', action='store_true', help='利用可能なテストケースを表示')
     parser.add_argument('--test', nargs='+', choices=TEST_CASES_CONFIG.keys(), help='実行するテストケースを指定')
     parser.add_argument('--disable', nargs='+', choices=TEST_CASES_CONFIG.keys(), help='無効化するテストケースを指定')
+    parser.add_argument('--concurrency', type=int, default=8, help='同時に送信するリクエスト数の上限（デフォルト: 8、1 で逐次実行）')
+    parser.add_argument('--rate-limit', type=float, default=None, help='モデルごとの1秒あたりのリクエスト数の上限（デフォルト: 無制限）')
+    parser.add_argument('--model-rate-limit', nargs='+', default=[], metavar='MODEL=RPS', help='特定のモデルの1秒あたりのリクエスト数の上限（--rate-limit より優先）')
+    parser.add_argument('--timeout', type=float, default=120, help='リクエストのタイムアウト秒数（デフォルト: 120）')
+    parser.add_argument('--load', action='store_true', help='正しさのテストの代わりに、テストケースのリクエストを繰り返し送信する負荷試験を実行')
+    parser.add_argument('--duration', type=float, default=30, help='負荷試験でガードレールの設定ごとに送信し続ける秒数（デフォルト: 30）')
+    parser.add_argument('--rps', type=float, default=None, help='負荷試験の目標リクエスト数/秒（指定しなければ --concurrency 件を常に実行）')
+    parser.add_argument('--load-guardrails', nargs='+', default=["none", "custom-pre-guard", "presidio-pre-guard"], help='比較するガードレールの設定。none、case（テストケースの指定どおり）、またはカンマ区切りのガードレール名（デフォルト: none custom-pre-guard presidio-pre-guard）')
+    parser.add_argument('--load-model', default=MODELS[0], help=f'負荷試験で使うモデル（デフォルト: {MODELS[0]}）')
+    parser.add_argument('--load-output', default=None, help='負荷試験の結果を保存するJSONファイル')
+    parser.add_argument('--results-db', default=RESULTS_DB, help=f'テスト結果を追記するSQLiteデータベース（デフォルト: {RESULTS_DB}）')
+    parser.add_argument('--history', action='store_true', help='これまでの実行の一覧を表示')
+    parser.add_argument('--diff', nargs='*', type=int, metavar='RUN', help='2つの実行の分析結果の違いを表示（指定しなければ最新の2つ）')
+    parser.add_argument('--show-run', type=int, metavar='RUN', help='指定した実行の結果の表を表示')
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument('--record', metavar='CASSETTE', help='レスポンスをカセット（JSONL）に記録する')
+    cassette_group.add_argument('--replay', metavar='CASSETTE', help='ネットワークを使わず、カセットに記録したレスポンスでテストする')
     args = parser.parse_args()
 
     if args.list:
         list_test_cases()
         return
 
+    if args.history or args.diff is not None or args.show_run is not None:
+        conn = open_results_store(args.results_db)
+        if args.history:
+            list_runs(conn)
+        if args.diff is not None:
+            if len(args.diff) not in (0, 2):
+                parser.error("--diff には実行を2つ指定するか、何も指定しないでください")
+            print(diff_runs(conn, *args.diff))
+        if args.show_run is not None:
+            print(create_markdown_table(load_run_results(conn, args.show_run)))
+        return
+
     # テストケースの有効/無効を設定
     if args.disable:
         for category in args.disable:
             TEST_CASES_CONFIG[category]["enabled"] = False
 
     print("LiteLLM Guardrails テスト\n")
-    print(f"モード: {'前回の結果を使用' if args.use_previous else '新規実行'}")
+    print(f"モード: {'負荷試験' if args.load else '前回の結果を使用' if args.use_previous else '新規実行'}")
     
     # 選択されたテストケースを取得
     selected_test_cases = get_enabled_test_cases(args.test)
@@ -380,50 +828,95 @@ def main():
         print(f"- {test_case['name']}")
     print()
     
-    # 前回の結果を読み込む（必要な場合）
-    results = load_previous_results() if args.use_previous else {}
+    if args.load:
+        run_load_test(args, selected_test_cases)
+        return
+    
+    rate_limits = {model: args.rate_limit for model in MODELS}
+    for value in args.model_rate_limit:
+        model, _, rate = value.rpartition("=")
+        if model not in rate_limits:
+            parser.error(f"不明なモデルです: {model}")
+        rate_limits[model] = float(rate)
+
+    cassette = None
+    if args.record or args.replay:
+        try:
+            cassette = Cassette(args.record or args.replay, "record" if args.record else "replay")
+        except FileNotFoundError:
+            parser.error(f"カセットが見つかりません: {args.replay}")
+        print(f"カセット: {cassette.path}（{cassette.mode}、記録済み {len(cassette.entries)} 件）")
+    
+    conn = open_results_store(args.results_db)
+    run_id = start_run(conn, cassette.mode if cassette else "use_previous" if args.use_previous else "new")
+    print(f"実行 {run_id} の結果を {args.results_db} に保存します")
+    
+    # 前回の結果を読み込む（必要な場合）。実行ごとに全体の結果を比較できるよう、この実行にも記録する
+    results = {}
+    if args.use_previous:
+        for model in MODELS:
+            for test_case in selected_test_cases:
+                previous = load_previous_result(conn, test_case["name"], model)
+                if previous is not None:
+                    results[f"{test_case['name']}_{model}"] = previous
+                    save_result(conn, run_id, test_case["name"], model, previous)
+    
+    # 前回の結果がない組だけを実行する
+    jobs = [
+        (test_case, model)
+        for model in MODELS
+        for test_case in selected_test_cases
+        if f"{test_case['name']}_{model}" not in results
+    ]
+    
+    def on_result(test_case: Dict[str, Any], model: str, result: Dict[str, Any]):
+        analysis = analyze_result(result, test_case)
+        print(f"完了: {test_case['name']} / {model}: {analysis}")
+        
+        # 結果を保存
+        entry = {
+            "timestamp": datetime.now().isoformat(),
+            "result": result,
+            "analysis": analysis
+        }
+        results[f"{test_case['name']}_{model}"] = entry
+        # カセットにない結果は --use-previous で使われないよう保存しない
+        if not (cassette is not None and cassette.mode == "replay" and result["status_code"] < 0):
+            save_result(conn, run_id, test_case["name"], model, entry)
+    
+    if jobs:
+        print(f"{len(jobs)} 件のリクエストを送信します（同時実行数: {args.concurrency}）")
+        start = time.monotonic()
+        asyncio.run(run_tests(jobs, max(1, args.concurrency), rate_limits, args.timeout, on_result, cassette))
+        print(f"所要時間: {time.monotonic() - start:.1f} 秒")
     
-    # 各モデルでテストを実行
+    # 結果の詳細は完了順ではなくモデルとテストケースの順に表示する
+    executed = {f"{test_case['name']}_{model}" for test_case, model in jobs}
     for model in MODELS:
         print(f"\n=== モデル: {model} ===")
         for test_case in selected_test_cases:
             key = f"{test_case['name']}_{model}"
-            
-            # 前回の結果を使用するかチェック
-            if args.use_previous and key in results:
+            if key not in executed:
                 print(f"\n{test_case['name']}: 前回の結果を使用")
-                print_result_details(
-                    test_case,
-                    model,
-                    results[key]["result"],
-                    results[key]["analysis"]
-                )
-                continue
-            
-            # 新規テストを実行
-            result = test_request(
-                test_case["messages"],
+            print_result_details(
+                test_case,
                 model,
-                test_case.get("guardrails"),
-                test_case.get("guardrail_config")
+                results[key]["result"],
+                results[key]["analysis"]
             )
-            analysis = analyze_result(result, test_case)
-            
-            # 結果を表示
-            print_result_details(test_case, model, result, analysis)
-            
-            # 結果を保存
-            results[key] = {
-                "timestamp": datetime.now().isoformat(),
-                "result": result,
-                "analysis": analysis
-            }
-            save_results(results)
     
     # Markdown形式の結果表を表示
     print("\n=== テスト結果の比較表 ===\n")
     markdown_table = create_markdown_table(results)
     print(markdown_table)
+    
+    if cassette is not None and cassette.mode == "record":
+        print(f"{cassette.recorded} 件のレスポンスを {cassette.path} に記録しました")
+    if cassette is not None and cassette.misses:
+        print(f"エラー: {len(cassette.misses)} 件のリクエストがカセットに記録されていません（--record {cassette.path} で記録してください）")
+        for data in cassette.misses:
+            print(f"- {data['model']} {data.get('guardrails')} {request_key(data)[:12]}: {data['messages'][-1]['content']}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,60 @@
+import pytest
+
+from guardrail_scan import BUILTIN_PII_PATTERNS, DEFAULT_PII_PATTERNS, PIIMasker
+
+
+def test_default_entities_are_the_baseline_set():
+    assert list(DEFAULT_PII_PATTERNS) == ["EMAIL", "CREDIT_CARD", "PHONE"]
+
+
+@pytest.mark.parametrize("text, expected, counts", [
+    ("mail taro@example.com now", "mail [EMAIL] now", {"EMAIL": 1}),
+    ("tel 090-1234-5678", "tel [PHONE]", {"PHONE": 1}),
+    ("tel 0312345678", "tel [PHONE]", {"PHONE": 1}),
+    # 以前は電話番号が先に適用され "[PHONE]-3456" になっていた
+    ("card 1234-5678-9012-3456", "card [CREDIT_CARD]", {"CREDIT_CARD": 1}),
+    ("card 1234 5678 9012 3456", "card [CREDIT_CARD]", {"CREDIT_CARD": 1}),
+    ("card 1234567890123456", "card [CREDIT_CARD]", {"CREDIT_CARD": 1}),
+])
+def test_default_labels(text, expected, counts):
+    assert PIIMasker().mask(text) == (expected, counts)
+
+
+@pytest.mark.parametrize("text", [
+    "マイナンバーは1234 5678 9012です",
+    "〒100-0001 東京都千代田区",
+    "order 123-4567",
+])
+def test_opt_in_entities_are_not_masked_by_default(text):
+    assert PIIMasker().mask(text) == (text, {})
+
+
+def test_enable_my_number_takes_priority_over_phone():
+    masker = PIIMasker()
+    masker.enable("MY_NUMBER")
+    assert masker.mask("番号 1234 5678 9012")[0] == "番号 [MY_NUMBER]"
+    assert masker.mask("番号 123456789012")[0] == "番号 [MY_NUMBER]"
+    assert masker.mask("card 1234-5678-9012-3456")[0] == "card [CREDIT_CARD]"
+    assert list(masker.patterns) == ["EMAIL", "CREDIT_CARD", "MY_NUMBER", "PHONE"]
+
+
+def test_enable_postal_code_keeps_custom_entities_last():
+    masker = PIIMasker()
+    masker.register("EMPLOYEE_ID", r"EMP-\d{6}", "E")
+    masker.enable("POSTAL_CODE")
+    assert list(masker.patterns) == ["EMAIL", "CREDIT_CARD", "PHONE", "POSTAL_CODE", "EMPLOYEE_ID"]
+    assert masker.mask("〒100-0001 EMP-123456") == ("[POSTAL_CODE] [EMPLOYEE_ID]",
+                                                    {"POSTAL_CODE": 1, "EMPLOYEE_ID": 1})
+
+
+def test_enable_rejects_unknown_entities():
+    with pytest.raises(ValueError):
+        PIIMasker().enable("PASSPORT")
+
+
+def test_worker_masker_keeps_the_enabled_order():
+    masker = PIIMasker()
+    masker.enable("MY_NUMBER")
+    # プロセスプールのワーカーは patterns から同じ照合器を作る
+    assert PIIMasker(masker.patterns).mask("123456789012") == masker.mask("123456789012")
+    assert set(BUILTIN_PII_PATTERNS) >= set(masker.patterns)
@@ -0,0 +1,82 @@
+import asyncio
+import os
+
+import pytest
+
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+from litellm.types.utils import Delta, ModelResponseStream, StreamingChoices  # noqa: E402
+
+from custom_guardrail import SecurityGuardrail  # noqa: E402
+
+
+def pre_call(guardrail, content):
+    data = {"messages": [{"role": "user", "content": content}]}
+    result = asyncio.run(guardrail.async_pre_call_hook(None, None, data, "completion"))
+    return result["messages"][0]["content"]
+
+
+def test_pre_call_masks_the_default_entities_only():
+    guardrail = SecurityGuardrail(guardrail_name="test-default-pii")
+    assert pre_call(guardrail, "card 1234-5678-9012-3456, 番号 1234 5678 9012, 〒100-0001") == \
+        "card [CREDIT_CARD], 番号 1234 5678 9012, 〒100-0001"
+
+
+def test_pre_call_masks_opt_in_entities():
+    guardrail = SecurityGuardrail(guardrail_name="test-opt-in-pii",
+                                  pii_patterns={"MY_NUMBER": True, "POSTAL_CODE": True})
+    assert pre_call(guardrail, "番号 123456789012, 〒100-0001") == "番号 [MY_NUMBER], [POSTAL_CODE]"
+
+
+def stream(pieces, finish=True):
+    for i, piece in enumerate(pieces):
+        last = finish and i == len(pieces) - 1
+        yield ModelResponseStream(id="chatcmpl-test", model="mock-model", choices=[StreamingChoices(
+            index=0, delta=Delta(content=piece), finish_reason="stop" if last else None,
+        )])
+
+
+def run_stream(guardrail, chunks):
+    """フックが返したテキストと、送出された例外（なければ None）を返します"""
+    async def source():
+        for chunk in chunks:
+            yield chunk
+
+    async def consume():
+        emitted = []
+        try:
+            async for chunk in guardrail.async_post_call_streaming_iterator_hook(None, source(), {}):
+                emitted.extend(choice.delta.content or "" for choice in chunk.choices)
+        except ValueError as e:
+            return "".join(emitted), e
+        return "".join(emitted), None
+
+    return asyncio.run(consume())
+
+
+@pytest.fixture(scope="module")
+def stream_guardrail():
+    return SecurityGuardrail(guardrail_name="test-streaming")
+
+
+@pytest.mark.parametrize("pieces", [
+    ["my pass", "word is hunter2"],
+    ["x" * 40 + " p", "a", "s", "swo", "rd"],
+    ["The quick brown fox jumps over the lazy dog. " * 3 + "passw", "ord: hunter2"],
+])
+def test_streaming_never_emits_a_fragment_of_a_split_keyword(stream_guardrail, pieces):
+    emitted, error = run_stream(stream_guardrail, stream(pieces))
+    assert error is not None and "password" in str(error)
+    full = "".join(pieces)
+    start = full.lower().index("password")
+    # 返したテキストはキーワードの手前で止まっている
+    assert full.startswith(emitted)
+    assert len(emitted) <= start
+
+
+@pytest.mark.parametrize("finish", [True, False])
+def test_streaming_returns_the_whole_clean_response(stream_guardrail, finish):
+    pieces = ["Hello", ", this is ", "a clean response ", "split into ", "many small chunks."]
+    emitted, error = run_stream(stream_guardrail, stream(pieces, finish=finish))
+    assert error is None
+    assert emitted == "".join(pieces)
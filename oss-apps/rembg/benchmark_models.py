@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import PIL.Image
+import PIL.ImageDraw
+import onnxruntime as ort
+from rembg.sessions import sessions
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = Path(__file__).parent / "models"
+
+
+def available_models(models_dir: Path) -> List[str]:
+    """List the models in the models directory that rembg knows how to run"""
+    return sorted(path.stem for path in models_dir.glob("*.onnx") if path.stem in sessions)
+
+
+def synthetic_image(long_side: int, seed: int) -> PIL.Image.Image:
+    """
+    Generate a deterministic test image: a gradient background with a few
+    foreground shapes, at 4:3 aspect ratio
+    """
+    rng = np.random.RandomState(seed)
+    width, height = long_side, long_side * 3 // 4
+    gradient = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    colors = rng.randint(0, 256, size=(2, 3)).astype(np.float32)
+    background = (colors[0] * (1 - gradient) + colors[1] * gradient).repeat(height, axis=0)
+    image = PIL.Image.fromarray(background.astype(np.uint8))
+    draw = PIL.ImageDraw.Draw(image)
+    for _ in range(3):
+        x0, y0 = rng.randint(0, width // 2), rng.randint(0, height // 2)
+        x1, y1 = x0 + rng.randint(width // 8, width // 2), y0 + rng.randint(height // 8, height // 2)
+        draw.ellipse((x0, y0, x1, y1), fill=tuple(int(c) for c in rng.randint(0, 256, size=3)))
+    return image
+
+
+def load_images(long_side: int, count: int, fixture_dir: Optional[Path]) -> List[PIL.Image.Image]:
+    """Get `count` test images whose longest side is `long_side`"""
+    if fixture_dir is None:
+        return [synthetic_image(long_side, seed) for seed in range(count)]
+
+    paths = sorted(path for path in fixture_dir.iterdir()
+                   if path.suffix.lower() in {'.png', '.jpg', '.jpeg', '.webp'}
+                   and not path.name.startswith("output_"))
+    if not paths:
+        raise FileNotFoundError(f"No images found in {fixture_dir}")
+    images = []
+    for i in range(count):
+        image = PIL.Image.open(paths[i % len(paths)]).convert("RGB")
+        scale = long_side / max(image.size)
+        images.append(image.resize((max(1, round(image.width * scale)),
+                                    max(1, round(image.height * scale))),
+                                   PIL.Image.Resampling.LANCZOS))
+    return images
+
+
+def percentile_ms(latencies: List[float], q: float) -> float:
+    """Get a latency percentile in milliseconds"""
+    return float(np.percentile(latencies, q) * 1000)
+
+
+def peak_rss_mib() -> float:
+    """Get the peak resident set size of the current process in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def run_config(model_name: str, intra_op_threads: int, inter_op_threads: int,
+               resolutions: List[int], batch_sizes: List[int], repeat: int,
+               fixture_dir: Optional[str]) -> Dict[str, Any]:
+    """
+    Benchmark one model with one thread configuration
+
+    Runs in a fresh process so that the session creation is a cold start
+    and the peak RSS only covers this configuration.
+
+    Returns:
+        Dict[str, Any]: Cold start time, peak RSS and one result per
+        resolution and batch size
+    """
+    # Imported here so the benchmark process itself never loads a session
+    from rembg_python import ImageProcessor
+
+    logging.getLogger("rembg_python").setLevel(logging.WARNING)
+    logging.getLogger("session_pool").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        processor = ImageProcessor(
+            work_dir, model_name,
+            intra_op_num_threads=intra_op_threads or None,
+            inter_op_num_threads=inter_op_threads or None,
+        )
+        start = time.perf_counter()
+        processor._get_model_session(model_name)
+        cold_start = time.perf_counter() - start
+
+        results = []
+        for long_side in resolutions:
+            for batch_size in batch_sizes:
+                images = load_images(long_side, batch_size, Path(fixture_dir) if fixture_dir else None)
+                # Warm up once so lazy allocations are not measured
+                processor._remove_batch(model_name, images)
+
+                latencies = []
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    batch_start = time.perf_counter()
+                    processor._remove_batch(model_name, images)
+                    latencies.extend([(time.perf_counter() - batch_start) / batch_size] * batch_size)
+                elapsed = time.perf_counter() - start
+
+                results.append({
+                    "resolution": f"{images[0].width}x{images[0].height}",
+                    "batch_size": batch_size,
+                    "images": len(latencies),
+                    "latency_ms_p50": percentile_ms(latencies, 50),
+                    "latency_ms_p90": percentile_ms(latencies, 90),
+                    "latency_ms_p99": percentile_ms(latencies, 99),
+                    "images_per_sec": len(latencies) / elapsed,
+                })
+
+    return {
+        "model": model_name,
+        "intra_op_threads": intra_op_threads,
+        "inter_op_threads": inter_op_threads,
+        "cold_start_seconds": cold_start,
+        "peak_rss_mib": peak_rss_mib(),
+        "results": results,
+    }
+
+
+def markdown_table(report: Dict[str, Any]) -> str:
+    """Render the benchmark report as a markdown table"""
+    headers = ["model", "intra", "inter", "cold start (s)", "resolution", "batch",
+               "p50 (ms)", "p90 (ms)", "p99 (ms)", "images/sec", "peak RSS (MiB)"]
+    lines = ["| " + " | ".join(headers) + " |", "|" + "|".join(["---"] * len(headers)) + "|"]
+    for config in report["configs"]:
+        for result in config["results"]:
+            row = [
+                config["model"],
+                str(config["intra_op_threads"] or "default"),
+                str(config["inter_op_threads"] or "sequential"),
+                f"{config['cold_start_seconds']:.2f}",
+                result["resolution"],
+                str(result["batch_size"]),
+                f"{result['latency_ms_p50']:.1f}",
+                f"{result['latency_ms_p90']:.1f}",
+                f"{result['latency_ms_p99']:.1f}",
+                f"{result['images_per_sec']:.2f}",
+                f"{config['peak_rss_mib']:.0f}",
+            ]
+            lines.append("| " + " | ".join(row) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark rembg models and ONNX Runtime settings')
+    parser.add_argument('--models', nargs='+', default=None,
+                      help='Models to benchmark (default: every model in models/)')
+    parser.add_argument('--resolutions', nargs='+', type=int, default=[512, 1024, 2048],
+                      help='Longest side of the test images (default: 512 1024 2048)')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4],
+                      help='Inference batch sizes (default: 1 4)')
+    parser.add_argument('--intra-threads', nargs='+', type=int, default=[0, 1, 4],
+                      help='ONNX Runtime intra-op thread counts, 0 for the default (default: 0 1 4)')
+    parser.add_argument('--inter-threads', nargs='+', type=int, default=[0],
+                      help='ONNX Runtime inter-op thread counts, 0 for sequential execution (default: 0)')
+    parser.add_argument('--repeat', type=int, default=5,
+                      help='Measured runs per resolution and batch size (default: 5)')
+    parser.add_argument('--images', default=None,
+                      help='Directory of fixture images to use instead of synthetic ones')
+    parser.add_argument('--output', default='benchmark_results.json',
+                      help='JSON report path (default: benchmark_results.json)')
+    parser.add_argument('--markdown', default='benchmark_results.md',
+                      help='Markdown table path (default: benchmark_results.md)')
+
+    args = parser.parse_args()
+
+    models = args.models or available_models(MODELS_DIR)
+    if not models:
+        logger.error(f"No models found in {MODELS_DIR}, run download_models.py first")
+        sys.exit(1)
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "onnxruntime": ort.__version__,
+        "providers": ort.get_available_providers(),
+        "settings": {
+            "resolutions": args.resolutions,
+            "batch_sizes": args.batch_sizes,
+            "repeat": args.repeat,
+            "images": args.images or "synthetic",
+        },
+        "configs": [],
+    }
+
+    context = multiprocessing.get_context("spawn")
+    for model_name in models:
+        for intra in args.intra_threads:
+            for inter in args.inter_threads:
+                logger.info(f"Benchmarking {model_name} with intra={intra or 'default'}, "
+                            f"inter={inter or 'sequential'}")
+                try:
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                        config = executor.submit(
+                            run_config, model_name, intra, inter, args.resolutions,
+                            args.batch_sizes, args.repeat, args.images,
+                        ).result()
+                except Exception as e:
+                    logger.error(f"Error benchmarking {model_name}: {str(e)}")
+                    continue
+                report["configs"].append(config)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    table = markdown_table(report)
+    with open(args.markdown, 'w') as f:
+        f.write(table)
+
+    print(table)
+    logger.info(f"Saved results to {args.output} and {args.markdown}")
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,329 @@
 import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
 # Set the models directory
 models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
 
-# Create models directory if it doesn't exist
-os.makedirs(models_dir, exist_ok=True)
-
 # Define base URL
 BASE_URL = "https://github.com/danielgatis/rembg/releases/download/v0.0.0/"
 
-# Define models and their filenames, please check models you need
+# Define models and their release file names, the models downloaded by default
+# are listed in DEFAULT_MODELS, please check models you need
 MODELS = {
     "u2net": "u2net.onnx",
     "u2netp": "u2netp.onnx",
-    #"u2net_human_seg": "u2net_human_seg.onnx",
-    #"u2net_cloth_seg": "u2net_cloth_seg.onnx",
-    #"silueta": "silueta.onnx",
+    "u2net_human_seg": "u2net_human_seg.onnx",
+    "u2net_cloth_seg": "u2net_cloth_seg.onnx",
+    "silueta": "silueta.onnx",
     "isnet-general-use": "isnet-general-use.onnx",
     "isnet-anime": "isnet-anime.onnx",
-    #"sam-encoder": "vit_b-encoder-quant.onnx",
-    #"sam-decoder": "vit_b-decoder-quant.onnx",
-    #"birefnet-general": "BiRefNet-general-epoch_244.onnx",
-    #"birefnet-general-lite": "BiRefNet-general-bb_swin_v1_tiny-epoch_232.onnx",
-    #"birefnet-portrait": "BiRefNet-portrait-epoch_150.onnx",
-    #"birefnet-dis": "BiRefNet-DIS-epoch_590.onnx",
-    #"birefnet-hrsod": "BiRefNet-HRSOD_DHU-epoch_115.onnx",
-    #"birefnet-cod": "BiRefNet-COD-epoch_125.onnx",
-    #"birefnet-massive": "BiRefNet-massive-TR_DIS5K_TR_TEs-epoch_420.onnx"
+    "sam-encoder": "vit_b-encoder-quant.onnx",
+    "sam-decoder": "vit_b-decoder-quant.onnx",
+    "birefnet-general": "BiRefNet-general-epoch_244.onnx",
+    "birefnet-general-lite": "BiRefNet-general-bb_swin_v1_tiny-epoch_232.onnx",
+    "birefnet-portrait": "BiRefNet-portrait-epoch_150.onnx",
+    "birefnet-dis": "BiRefNet-DIS-epoch_590.onnx",
+    "birefnet-hrsod": "BiRefNet-HRSOD_DHU-epoch_115.onnx",
+    "birefnet-cod": "BiRefNet-COD-epoch_125.onnx",
+    "birefnet-massive": "BiRefNet-massive-TR_DIS5K_TR_TEs-epoch_420.onnx",
 }
 
-def download_file(url, filepath):
-    """
-    Download a file with progress bar
-    """
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-    total_size = int(response.headers.get('content-length', 0))
-    
-    with open(filepath, 'wb') as f, tqdm(
-        desc=os.path.basename(filepath),
-        total=total_size,
-        unit='iB',
-        unit_scale=True,
-        unit_divisor=1024,
-    ) as pbar:
-        for data in response.iter_content(chunk_size=1024):
-            size = f.write(data)
-            pbar.update(size)
+DEFAULT_MODELS = ["u2net", "u2netp", "isnet-general-use", "isnet-anime"]
+
+# Digests of the release files, keyed by release file name, tracked next to
+# this script. Values are "<algorithm>:<hex digest>"; the md5 entries are the
+# ones pinned by the rembg package, --upgrade-checksums replaces them with
+# the SHA-256 of a download that matched them
+CHECKSUMS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "checksums.json")
+CHECKSUM_ALGORITHMS = ("sha256", "md5")
+
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = (10, 60)
+
+
+class ChecksumError(Exception):
+    """A downloaded file does not match its recorded digest"""
+
+
+def load_checksums(path):
+    """
+    Load the digest manifest
+    """
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def parse_digest(value):
+    """
+    Split a manifest value into its algorithm and hex digest
+    """
+    algorithm, _, hexdigest = value.partition(":")
+    if algorithm not in CHECKSUM_ALGORITHMS or not hexdigest:
+        raise ValueError(f"Invalid digest {value!r}, expected one of "
+                         f"{', '.join(a + ':<hex>' for a in CHECKSUM_ALGORITHMS)}")
+    return algorithm, hexdigest.lower()
+
+
+def save_checksums(path, checksums):
+    """
+    Write the digest manifest atomically
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(dict(sorted(checksums.items())), f, indent=2)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def create_session(workers):
+    """
+    Create an HTTP session whose connection pool fits the concurrent downloads
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class Digests:
+    """SHA-256 and the digest a file is verified against, computed in one read"""
+
+    def __init__(self, expected=None):
+        self.expected = parse_digest(expected) if expected is not None else None
+        self._hashes = {"sha256": hashlib.sha256()}
+        if self.expected is not None:
+            self._hashes.setdefault(self.expected[0], hashlib.new(self.expected[0]))
+
+    def update(self, data):
+        for digest in self._hashes.values():
+            digest.update(data)
+
+    @property
+    def sha256(self):
+        return self._hashes["sha256"].hexdigest()
+
+    def matches(self):
+        """Whether the data matches the expected digest (True if none is expected)"""
+        if self.expected is None:
+            return True
+        algorithm, hexdigest = self.expected
+        return self._hashes[algorithm].hexdigest() == hexdigest
+
+    def actual(self):
+        algorithm = self.expected[0] if self.expected is not None else "sha256"
+        return f"{algorithm}:{self._hashes[algorithm].hexdigest()}"
+
+
+def hash_existing(path, digest, chunk_size):
+    """
+    Feed an existing partial file to a digest, returning its size
+    """
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return size
+
+
+def file_digests(path, expected=None, chunk_size=CHUNK_SIZE):
+    """
+    Hash a file with SHA-256 and the algorithm of the expected digest
+    """
+    digests = Digests(expected)
+    hash_existing(path, digests, chunk_size)
+    return digests
+
+
+def download_file(session, url, filepath, expected=None, chunk_size=CHUNK_SIZE, position=0):
+    """
+    Download a file with progress bar, resuming a previous partial download
+
+    The data is written to <filepath>.part and renamed to filepath once it
+    matches the expected "<algorithm>:<hex digest>", so filepath never holds
+    an incomplete or unverified file.
+
+    Returns:
+        str: SHA-256 hex digest of the downloaded file
+    """
+    part_path = filepath + ".part"
+    digest = Digests(expected)
+    offset = hash_existing(part_path, digest, chunk_size) if os.path.exists(part_path) else 0
+
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with session.get(url, stream=True, headers=headers, timeout=TIMEOUT) as response:
+        if offset and response.status_code == 416:
+            # The partial file already holds the whole file
+            total_size = offset
+        else:
+            response.raise_for_status()
+            if offset and response.status_code != 206:
+                # Range not supported, start over
+                offset = 0
+                digest = Digests(expected)
+            total_size = offset + int(response.headers.get('content-length', 0))
+
+            with open(part_path, 'ab' if offset else 'wb') as f, tqdm(
+                desc=os.path.basename(filepath),
+                initial=offset,
+                total=total_size,
+                unit='iB',
+                unit_scale=True,
+                unit_divisor=1024,
+                position=position,
+                leave=False,
+            ) as pbar:
+                for data in response.iter_content(chunk_size=chunk_size):
+                    size = f.write(data)
+                    digest.update(data)
+                    pbar.update(size)
+                received = pbar.n
+
+            if response.headers.get('content-length') and received != total_size:
+                # Kept as .part, the next attempt resumes from it
+                raise requests.ConnectionError(f"Connection closed after {received} of {total_size} bytes")
+
+    if not digest.matches():
+        os.remove(part_path)
+        if offset:
+            # The resumed partial file may be stale or corrupt, start over once
+            return download_file(session, url, filepath, expected, chunk_size, position)
+        raise ChecksumError(f"Checksum mismatch for {os.path.basename(filepath)}: "
+                            f"expected {expected}, got {digest.actual()}")
+    os.replace(part_path, filepath)
+    return digest.sha256
+
+
+def download_model(session, base_url, model_name, output_path, expected, chunk_size, retries, position):
+    """
+    Download a model, retrying (and resuming) after network errors
+
+    Returns:
+        str: SHA-256 hex digest of the downloaded file
+    """
+    url = base_url + MODELS[model_name]
+    for attempt in range(1, retries + 1):
+        try:
+            return download_file(session, url, output_path, expected, chunk_size, position)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == retries:
+                raise
+            tqdm.write(f"Retrying {model_name} ({attempt}/{retries}) after error: {str(e)}")
+
 
 def main():
+    parser = argparse.ArgumentParser(
+        description='Download the rembg models in parallel, resuming partial downloads'
+    )
+    parser.add_argument('--models', nargs='+', default=DEFAULT_MODELS,
+                      help=f'Models to download (default: {" ".join(DEFAULT_MODELS)})')
+    parser.add_argument('--all', action='store_true',
+                      help='Download every known model')
+    parser.add_argument('--base-url', default=BASE_URL,
+                      help='URL the model files are downloaded from, e.g. a local mirror')
+    parser.add_argument('--models-dir', default=models_dir,
+                      help='Directory the models are saved to (default: models/)')
+    parser.add_argument('--workers', type=int, default=4,
+                      help='Number of concurrent downloads (default: 4)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                      help=f'Read size in bytes (default: {CHUNK_SIZE})')
+    parser.add_argument('--retries', type=int, default=3,
+                      help='Attempts per model before giving up (default: 3)')
+    parser.add_argument('--verify', action='store_true',
+                      help='Verify the checksum of already downloaded models instead of skipping them')
+    parser.add_argument('--checksums', default=CHECKSUMS_PATH,
+                      help='Digest manifest, keyed by release file name (default: checksums.json next to this script)')
+    parser.add_argument('--allow-missing-checksums', action='store_true',
+                      help='Download models missing from the manifest without verifying them, instead of failing')
+    parser.add_argument('--upgrade-checksums', action='store_true',
+                      help='Replace the md5 entries of verified models with their SHA-256 in the manifest')
+
+    args = parser.parse_args()
+
+    models = list(MODELS) if args.all else args.models
+    unknown = [model_name for model_name in models if model_name not in MODELS]
+    if unknown:
+        parser.error(f"Unknown models: {', '.join(unknown)}")
+    if args.upgrade_checksums and args.allow_missing_checksums:
+        parser.error("--upgrade-checksums cannot be combined with --allow-missing-checksums")
+    base_url = args.base_url if args.base_url.endswith("/") else args.base_url + "/"
+
+    # Create models directory if it doesn't exist
+    os.makedirs(args.models_dir, exist_ok=True)
+    checksums = load_checksums(args.checksums)
+    upgraded = {}
+
     print("Starting model downloads...")
-    
-    for model_name, filename in MODELS.items():
-        output_path = os.path.join(models_dir, filename)
-        
-        if os.path.exists(output_path):
-            print(f"Model {filename} already exists, skipping...")
+    pending = []
+    failed = []
+    for model_name in models:
+        # Saved under the model name, the file name the sessions are loaded from
+        output_path = os.path.join(args.models_dir, f"{model_name}.onnx")
+        expected = checksums.get(MODELS[model_name])
+        if expected is None and not args.allow_missing_checksums:
+            print(f"No checksum for {MODELS[model_name]} in {args.checksums}, skipping {model_name} "
+                  f"(use --allow-missing-checksums to download it unverified)")
+            failed.append(model_name)
             continue
-            
-        url = BASE_URL + filename
-        print(f"\nDownloading {model_name}...")
-        try:
-            download_file(url, output_path)
-            print(f"Successfully downloaded {model_name}")
-        except Exception as e:
-            print(f"Error downloading {model_name}: {str(e)}")
+        if not os.path.exists(output_path):
+            if expected is None:
+                print(f"Warning: downloading {model_name} without a checksum")
+            pending.append((model_name, output_path, expected))
+        elif not args.verify:
+            print(f"Model {model_name} already exists, skipping...")
+        elif expected is None:
+            print(f"No checksum for {model_name}, cannot verify it")
+        else:
+            digests = file_digests(output_path, expected, args.chunk_size)
+            if not digests.matches():
+                print(f"Model {model_name} does not match its checksum, downloading it again...")
+                os.remove(output_path)
+                pending.append((model_name, output_path, expected))
+            else:
+                print(f"Model {model_name} verified")
+                upgraded[MODELS[model_name]] = digests.sha256
+
+    session = create_session(max(1, args.workers))
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {
+            executor.submit(download_model, session, base_url, model_name, output_path,
+                            expected, args.chunk_size, args.retries, position): (model_name, expected)
+            for position, (model_name, output_path, expected) in enumerate(pending)
+        }
+        for future in as_completed(futures):
+            model_name, expected = futures[future]
+            try:
+                sha256 = future.result()
+            except Exception as e:
+                tqdm.write(f"Error downloading {model_name}: {str(e)}")
+                failed.append(model_name)
+                continue
+            if expected is None:
+                tqdm.write(f"Successfully downloaded {model_name}, unverified SHA-256 {sha256}")
+            else:
+                tqdm.write(f"Successfully downloaded {model_name}, checksum verified")
+                upgraded[MODELS[model_name]] = sha256
+
+    if args.upgrade_checksums:
+        # Only digests of files that matched a pinned entry are written
+        changed = {name: f"sha256:{sha256}" for name, sha256 in upgraded.items()
+                   if checksums.get(name) != f"sha256:{sha256}"}
+        if changed:
+            checksums.update(changed)
+            save_checksums(args.checksums, checksums)
+            print(f"Recorded the SHA-256 of {', '.join(sorted(changed))} in {args.checksums}")
+
+    if failed:
+        print(f"Failed models: {', '.join(failed)}")
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     main()
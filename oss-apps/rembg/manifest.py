@@ -0,0 +1,145 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = ".rembg_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """Compute the SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ProcessingManifest:
+    """Record of processed inputs, used to skip unchanged images on re-runs"""
+
+    def __init__(self, output_dir: Path):
+        """
+        Load the manifest stored in the output directory
+
+        Args:
+            output_dir (Path): Directory the processed images are written to
+        """
+        self.path = Path(output_dir) / MANIFEST_FILENAME
+        self.entries: Dict[str, Dict[str, Any]] = self._load()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._recorded: Dict[str, Dict[str, Any]] = {}
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """Load the manifest entries, starting empty if the file is missing or invalid"""
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable manifest {self.path}: {e}")
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            logger.warning(f"Ignoring manifest {self.path} with unsupported version")
+            return {}
+        return manifest.get("entries", {})
+
+    def fingerprint(self, input_path: Path) -> Dict[str, Any]:
+        """
+        Get the content fingerprint of an input file
+
+        The file is only re-hashed when its size or modification time differ
+        from the recorded entry, so unchanged inputs cost a single stat call.
+
+        Args:
+            input_path (Path): Path to the input image
+
+        Returns:
+            Dict[str, Any]: Size, modification time and SHA-256 of the file
+        """
+        stat = input_path.stat()
+        entry = self.entries.get(input_path.name)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            sha256 = entry["sha256"]
+        else:
+            sha256 = file_sha256(input_path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+
+    def is_up_to_date(self, input_path: Path, fingerprint: Dict[str, Any], model_name: str,
+                      variant: str, config_entry: Optional[Dict], output_path: Path) -> bool:
+        """
+        Check whether the recorded output of an input is still valid
+
+        Args:
+            input_path (Path): Path to the input image
+            fingerprint (Dict[str, Any]): Current fingerprint of the input
+            model_name (str): Model the input would be processed with
+            variant (str): Resolved variant of that model
+            config_entry (Optional[Dict]): config.json entry of the input
+            output_path (Path): Path the output would be written to
+
+        Returns:
+            bool: True if the input can be skipped
+        """
+        entry = self.entries.get(input_path.name)
+        if not entry:
+            return False
+        if (entry["sha256"] != fingerprint["sha256"] or entry["size"] != fingerprint["size"]
+                or entry["model"] != model_name or entry.get("variant") != variant
+                or entry["config"] != config_entry
+                or entry["output"] != output_path.name):
+            return False
+        try:
+            return output_path.stat().st_size == entry["output_size"]
+        except FileNotFoundError:
+            return False
+
+    def record(self, input_path: Path, fingerprint: Dict[str, Any], model_name: str, variant: str,
+               config_entry: Optional[Dict], output_path: Path):
+        """Record a successfully processed input"""
+        entry = dict(fingerprint)
+        entry.update({
+            "model": model_name,
+            "variant": variant,
+            "config": config_entry,
+            "output": output_path.name,
+            "output_size": output_path.stat().st_size,
+        })
+        with self._lock:
+            self.entries[input_path.name] = entry
+            self._recorded[input_path.name] = entry
+            self._dirty = True
+
+    def take_recorded(self) -> Dict[str, Dict[str, Any]]:
+        """Get the entries recorded since the last call, e.g. to hand them to another process"""
+        with self._lock:
+            recorded, self._recorded = self._recorded, {}
+        return recorded
+
+    def merge(self, entries: Dict[str, Dict[str, Any]]):
+        """Add entries recorded by another process"""
+        if not entries:
+            return
+        with self._lock:
+            self.entries.update(entries)
+            self._dirty = True
+
+    def save(self):
+        """Write the manifest atomically if it changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump({"version": MANIFEST_VERSION, "entries": self.entries}, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        logger.info(f"Saved manifest with {len(self.entries)} entries to {self.path}")
@@ -0,0 +1,79 @@
+import os
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import PIL.Image
+
+logger = logging.getLogger(__name__)
+
+MASK_CACHE_DIRNAME = ".rembg_masks"
+
+
+class MaskCache:
+    """On-disk cache of predicted alpha masks, keyed by input content hash, model and model variant"""
+
+    def __init__(self, cache_dir: Path):
+        """
+        Initialize the cache
+
+        Masks are stored as 8-bit grayscale PNGs under
+        <cache_dir>/<model>/<variant>/<first two hex digits>/<sha256>.png.
+
+        Args:
+            cache_dir (Path): Directory holding the cached masks
+        """
+        self.cache_dir = Path(cache_dir)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def _path(self, sha256: str, model_name: str, variant: str) -> Path:
+        """Get the file of a cached mask"""
+        return self.cache_dir / model_name / variant / sha256[:2] / f"{sha256}.png"
+
+    def get(self, sha256: str, model_name: str, variant: str) -> Optional[PIL.Image.Image]:
+        """
+        Load a cached mask
+
+        Args:
+            sha256 (str): SHA-256 of the input file
+            model_name (str): Model the mask was predicted with
+            variant (str): Resolved model variant the mask was predicted with
+
+        Returns:
+            Optional[PIL.Image.Image]: The mask, or None if it is not cached
+        """
+        path = self._path(sha256, model_name, variant)
+        try:
+            mask = PIL.Image.open(path)
+            mask.load()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except (OSError, SyntaxError) as e:
+            logger.warning(f"Ignoring unreadable cached mask {path}: {str(e)}")
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return mask
+
+    def put(self, sha256: str, model_name: str, variant: str, mask: PIL.Image.Image):
+        """Store a mask, atomically so concurrent readers never see a partial file"""
+        path = self._path(sha256, model_name, variant)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        mask.convert("L").save(tmp_path, format="PNG")
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.writes += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the cache counters"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "writes": self.writes}
@@ -0,0 +1,256 @@
+import re
+import fnmatch
+import logging
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Reserved config.json keys, the other keys are file names
+RULES_KEY = "_rules"
+LATENCY_BUDGET_KEY = "_latency_budget_ms"
+
+RULE_CONDITIONS = ("glob", "min_pixels", "max_pixels", "min_aspect", "max_aspect")
+
+
+class RoutingRule(NamedTuple):
+    """A config.json routing rule: a model for images matching all the set conditions"""
+    model: str
+    fallback: Tuple[str, ...]
+    glob: Optional[str] = None
+    min_pixels: Optional[int] = None
+    max_pixels: Optional[int] = None
+    min_aspect: Optional[float] = None
+    max_aspect: Optional[float] = None
+
+    @property
+    def needs_size(self) -> bool:
+        return any(value is not None for value in (self.min_pixels, self.max_pixels,
+                                                   self.min_aspect, self.max_aspect))
+
+    def matches_size(self, image_size: Optional[Tuple[int, int]]) -> bool:
+        """Check the pixel count and aspect ratio (width / height) conditions"""
+        if not self.needs_size:
+            return True
+        if image_size is None:
+            return False
+        width, height = image_size
+        pixels = width * height
+        aspect = width / height if height else float("inf")
+        return ((self.min_pixels is None or pixels >= self.min_pixels)
+                and (self.max_pixels is None or pixels <= self.max_pixels)
+                and (self.min_aspect is None or aspect >= self.min_aspect)
+                and (self.max_aspect is None or aspect <= self.max_aspect))
+
+
+def _has_wildcard(pattern: str) -> bool:
+    return any(char in pattern for char in "*?[")
+
+
+def _fallback_models(value: Any) -> Tuple[str, ...]:
+    """Normalize a "fallback" entry, a model name or a list of them, fastest last"""
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        return (value,)
+    return tuple(value)
+
+
+class ModelRouter:
+    """
+    Picks the model of an image from config.json
+
+    Exact file name entries take precedence. Otherwise the first rule of the
+    "_rules" list whose conditions all match is used, and the default model
+    if none does. Rules are compiled into an index when the config is loaded:
+    literal globs, "prefix*" globs and "*suffix" globs go into dicts probed
+    once per prefix/suffix length of the file name, so their lookup cost does
+    not grow with the number of rules. Other globs are combined into one regex
+    alternation whose named groups identify the first matching rule.
+    """
+
+    def __init__(self, config: Dict[str, Any], default_model: str):
+        """
+        Compile the routing rules
+
+        Args:
+            config (Dict[str, Any]): Parsed config.json
+            default_model (str): Model used when no entry or rule matches
+        """
+        self.config = config
+        self.default_model = default_model
+        self.rules: List[RoutingRule] = []
+        for index, rule in enumerate(config.get(RULES_KEY, [])):
+            try:
+                self.rules.append(RoutingRule(
+                    model=rule["model"],
+                    fallback=_fallback_models(rule.get("fallback")),
+                    **{key: rule[key] for key in RULE_CONDITIONS if key in rule},
+                ))
+            except (KeyError, TypeError) as e:
+                logger.error(f"Ignoring invalid routing rule #{index} {rule!r}: {e}")
+
+        # Glob index: literal, prefix and suffix globs map to their rules,
+        # other patterns are matched by a single regex whose first matching
+        # group wins
+        self._literal_globs: Dict[str, List[int]] = {}
+        self._prefix_globs: Dict[str, List[int]] = {}
+        self._suffix_globs: Dict[str, List[int]] = {}
+        wildcard_patterns = []
+        self._wildcard_rules: List[int] = []
+        self._wildcard_regexes: List["re.Pattern"] = []
+        for index, rule in enumerate(self.rules):
+            if rule.glob is None:
+                continue
+            if not _has_wildcard(rule.glob):
+                self._literal_globs.setdefault(rule.glob, []).append(index)
+            elif rule.glob.endswith("*") and not _has_wildcard(rule.glob[:-1]):
+                self._prefix_globs.setdefault(rule.glob[:-1], []).append(index)
+            elif rule.glob.startswith("*") and not _has_wildcard(rule.glob[1:]):
+                self._suffix_globs.setdefault(rule.glob[1:], []).append(index)
+            else:
+                pattern = fnmatch.translate(rule.glob)
+                wildcard_patterns.append(f"(?P<r{len(self._wildcard_rules)}>{pattern})")
+                self._wildcard_rules.append(index)
+                self._wildcard_regexes.append(re.compile(pattern))
+        self._glob_regex = re.compile("|".join(wildcard_patterns)) if wildcard_patterns else None
+
+        # Rules without a glob are checked on image properties only
+        self._property_rules = [index for index, rule in enumerate(self.rules) if rule.glob is None]
+        self.needs_size = any(rule.needs_size for rule in self.rules)
+
+    def _first_glob_rule(self, image_name: str, image_size: Optional[Tuple[int, int]]) -> Optional[int]:
+        """Get the index of the first rule with a glob that matches the image"""
+        candidates = list(self._literal_globs.get(image_name, ()))
+        if self._prefix_globs or self._suffix_globs:
+            for length in range(len(image_name) + 1):
+                candidates.extend(self._prefix_globs.get(image_name[:length], ()))
+                candidates.extend(self._suffix_globs.get(image_name[length:], ()))
+        matching = [index for index in candidates if self.rules[index].matches_size(image_size)]
+        best = min(matching) if matching else None
+
+        match = self._glob_regex.match(image_name) if self._glob_regex is not None else None
+        if match is not None:
+            position = int(match.lastgroup[1:])
+            # The first matching glob usually decides; only if its size
+            # conditions fail are the later wildcard rules tried one by one
+            for position in range(position, len(self._wildcard_rules)):
+                index = self._wildcard_rules[position]
+                if best is not None and index > best:
+                    break
+                if (self._wildcard_regexes[position].match(image_name)
+                        and self.rules[index].matches_size(image_size)):
+                    best = index
+                    break
+        return best
+
+    def route(self, image_name: str,
+              image_size: Optional[Tuple[int, int]] = None) -> Tuple[str, Tuple[str, ...]]:
+        """
+        Get the model of an image
+
+        Args:
+            image_name (str): Input file name
+            image_size (Optional[Tuple[int, int]]): Image width and height, rules
+                with pixel or aspect conditions do not match without it
+
+        Returns:
+            Tuple[str, Tuple[str, ...]]: The model, and the faster models it may
+            fall back to under the latency budget
+        """
+        entry = self.config.get(image_name)
+        if isinstance(entry, dict):
+            return (entry.get('model', self.default_model),
+                    _fallback_models(entry.get('fallback')))
+
+        matched = self._first_glob_rule(image_name, image_size)
+        for index in self._property_rules:
+            if matched is not None and index > matched:
+                break
+            if self.rules[index].matches_size(image_size):
+                matched = index
+                break
+
+        if matched is None:
+            return self.default_model, ()
+        rule = self.rules[matched]
+        return rule.model, rule.fallback
+
+
+class LatencyBudget:
+    """
+    Falls back to faster models when the estimated latency exceeds a budget
+
+    The per-image processing time of each model is tracked as an exponentially
+    weighted moving average. The estimated latency of an image is the time to
+    work through the images already in flight plus its own processing time.
+    """
+
+    def __init__(self, budget_seconds: Optional[float], smoothing: float = 0.2):
+        """
+        Initialize the budget
+
+        Args:
+            budget_seconds (Optional[float]): Latency budget per image, None to
+                always use the preferred model
+            smoothing (float): Weight of the newest observation in the averages
+        """
+        self.budget_seconds = budget_seconds
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._model_seconds: Dict[str, float] = {}
+        self._overall_seconds: Optional[float] = None
+        self.in_flight = 0
+        self.fallbacks = 0
+
+    def observe(self, model_name: str, seconds: float):
+        """Add the processing time of one image"""
+        with self._lock:
+            previous = self._model_seconds.get(model_name)
+            self._model_seconds[model_name] = (
+                seconds if previous is None else previous + self.smoothing * (seconds - previous))
+            self._overall_seconds = (
+                seconds if self._overall_seconds is None
+                else self._overall_seconds + self.smoothing * (seconds - self._overall_seconds))
+
+    def begin(self):
+        """Count an image entering the pipeline"""
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self):
+        """Count an image leaving the pipeline, processed or failed"""
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def choose(self, model_name: str, fallback: Tuple[str, ...]) -> str:
+        """
+        Get the first of the model and its fallbacks expected to fit the budget
+
+        Models without observations yet are assumed to fit. If none fits, the
+        last (fastest) fallback is used.
+        """
+        if self.budget_seconds is None or not fallback:
+            return model_name
+        with self._lock:
+            # The image itself is counted in flight
+            wait = max(0, self.in_flight - 1) * (self._overall_seconds or 0.0)
+            candidates = (model_name,) + fallback
+            for candidate in candidates:
+                if wait + self._model_seconds.get(candidate, 0.0) <= self.budget_seconds:
+                    break
+            else:
+                candidate = candidates[-1]
+            if candidate != model_name:
+                self.fallbacks += 1
+        return candidate
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the averages and counters"""
+        with self._lock:
+            return {
+                "budget_ms": self.budget_seconds * 1000 if self.budget_seconds is not None else None,
+                "model_ms": {name: seconds * 1000 for name, seconds in self._model_seconds.items()},
+                "in_flight": self.in_flight,
+                "fallbacks": self.fallbacks,
+            }
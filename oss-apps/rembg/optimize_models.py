@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import PIL.Image
+import onnxruntime as ort
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from rembg.sessions import sessions
+
+from benchmark_models import available_models, synthetic_image
+from session_pool import (OPTIMIZED_INDEX, create_session, load_optimized_index,
+                          optimized_cache_dir)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = Path(__file__).parent / "models"
+
+OPTIMIZATION_LEVELS = {
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    # Includes layout optimizations specific to this machine's CPU
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def optimize_offline(source: Path, target: Path, level: str):
+    """Run the ONNX Runtime graph optimizations once and save the optimized graph"""
+    sess_opts = ort.SessionOptions()
+    sess_opts.graph_optimization_level = OPTIMIZATION_LEVELS[level]
+    sess_opts.optimized_model_filepath = str(target)
+    ort.InferenceSession(str(source), sess_opts, providers=["CPUExecutionProvider"])
+
+
+def load_fixtures(fixture_dir: Path, count: int) -> List[PIL.Image.Image]:
+    """Load the fixture images, or generate synthetic ones if no directory is given"""
+    if fixture_dir is None:
+        return [synthetic_image(640, seed) for seed in range(count)]
+    paths = sorted(path for path in fixture_dir.iterdir()
+                   if path.suffix.lower() in {'.png', '.jpg', '.jpeg', '.webp'}
+                   and not path.name.startswith("output_"))[:count]
+    if not paths:
+        raise FileNotFoundError(f"No images found in {fixture_dir}")
+    return [PIL.Image.open(path).convert("RGB") for path in paths]
+
+
+def predict_masks(session, images: List[PIL.Image.Image]) -> List[np.ndarray]:
+    """Predict the masks of the fixtures as uint8 arrays"""
+    return [np.asarray(session.predict(image)[0].convert("L")) for image in images]
+
+
+def compare_masks(reference: List[np.ndarray], masks: List[np.ndarray]) -> Dict[str, float]:
+    """Compare masks to the reference masks of the original model"""
+    abs_diffs = [np.abs(ref.astype(np.int16) - mask.astype(np.int16)) for ref, mask in zip(reference, masks)]
+    ious = []
+    for ref, mask in zip(reference, masks):
+        ref_fg, mask_fg = ref > 127, mask > 127
+        union = np.logical_or(ref_fg, mask_fg).sum()
+        ious.append(np.logical_and(ref_fg, mask_fg).sum() / union if union else 1.0)
+    return {
+        "mean_abs_diff": float(np.mean([diff.mean() for diff in abs_diffs])),
+        "max_abs_diff": int(max(diff.max() for diff in abs_diffs)),
+        "min_foreground_iou": float(min(ious)),
+    }
+
+
+def timed_session(model_name: str, model_path: Path, preoptimized: bool):
+    """Create a session and measure how long it took"""
+    start = time.perf_counter()
+    session = create_session(model_name, model_path, preoptimized=preoptimized)
+    return session, time.perf_counter() - start
+
+
+def timed_predict(session, images: List[PIL.Image.Image]):
+    """Predict the fixture masks and measure the mean time per image"""
+    start = time.perf_counter()
+    masks = predict_masks(session, images)
+    return masks, (time.perf_counter() - start) / len(images)
+
+
+def optimize_model(model_name: str, cache_dir: Path, level: str, quantize: bool,
+                   images: List[PIL.Image.Image]) -> Dict[str, Any]:
+    """
+    Write the optimized (and int8) variants of a model and evaluate them
+
+    Args:
+        model_name (str): Model name
+        cache_dir (Path): Versioned directory the variants are written to
+        level (str): Graph optimization level, a key of OPTIMIZATION_LEVELS
+        quantize (bool): Also write a dynamically quantized int8 variant
+        images (List[PIL.Image.Image]): Fixtures the variants are compared on
+
+    Returns:
+        Dict[str, Any]: Index entry of the model, with the evaluation report
+    """
+    source = MODELS_DIR / f"{model_name}.onnx"
+    stat = source.stat()
+    entry: Dict[str, Any] = {
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "level": level,
+        "report": {},
+    }
+
+    optimized = cache_dir / f"{model_name}.onnx"
+    start = time.perf_counter()
+    optimize_offline(source, optimized, level)
+    logger.info(f"Optimized {model_name} in {time.perf_counter() - start:.2f}s -> {optimized}")
+    entry["optimized"] = optimized.name
+
+    if quantize:
+        # Quantize the original graph, then optimize the quantized graph so it
+        # also loads without optimization work
+        quantized_raw = cache_dir / f"{model_name}.int8.raw.onnx"
+        quantized = cache_dir / f"{model_name}.int8.onnx"
+        start = time.perf_counter()
+        try:
+            quantize_dynamic(str(source), str(quantized_raw), weight_type=QuantType.QUInt8)
+            optimize_offline(quantized_raw, quantized, level)
+            entry["int8"] = quantized.name
+            logger.info(f"Quantized {model_name} in {time.perf_counter() - start:.2f}s -> {quantized}")
+        except Exception as e:
+            logger.error(f"Error quantizing {model_name}: {str(e)}")
+        finally:
+            quantized_raw.unlink(missing_ok=True)
+
+    session, cold_start = timed_session(model_name, source, preoptimized=False)
+    reference, latency = timed_predict(session, images)
+    entry["report"]["original"] = {
+        "file_mb": stat.st_size / 2**20,
+        "cold_start_seconds": cold_start,
+        "latency_ms": latency * 1000,
+    }
+    del session
+
+    for variant in ("optimized", "int8"):
+        if variant not in entry:
+            continue
+        path = cache_dir / entry[variant]
+        session, cold_start = timed_session(model_name, path, preoptimized=True)
+        masks, latency = timed_predict(session, images)
+        entry["report"][variant] = {
+            "file_mb": path.stat().st_size / 2**20,
+            "cold_start_seconds": cold_start,
+            "latency_ms": latency * 1000,
+            **compare_masks(reference, masks),
+        }
+        del session
+    return entry
+
+
+def markdown_table(index: Dict[str, Dict[str, Any]], fixtures: int) -> str:
+    """Render the evaluation reports as a markdown table"""
+    headers = ["model", "variant", "file (MB)", "cold start (s)", "latency (ms)",
+               "mean |Δ| (/255)", "max |Δ|", "min IoU"]
+    lines = [f"Accuracy delta against the original model on {fixtures} fixture images", "",
+             "| " + " | ".join(headers) + " |", "|" + "|".join(["---"] * len(headers)) + "|"]
+    for model_name, entry in sorted(index.items()):
+        for variant, report in entry.get("report", {}).items():
+            row = [
+                model_name,
+                variant,
+                f"{report['file_mb']:.1f}",
+                f"{report['cold_start_seconds']:.2f}",
+                f"{report['latency_ms']:.1f}",
+                f"{report['mean_abs_diff']:.3f}" if "mean_abs_diff" in report else "-",
+                str(report["max_abs_diff"]) if "max_abs_diff" in report else "-",
+                f"{report['min_foreground_iou']:.4f}" if "min_foreground_iou" in report else "-",
+            ]
+            lines.append("| " + " | ".join(row) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write pre-optimized and int8 quantized variants of the rembg models'
+    )
+    parser.add_argument('--models', nargs='+', default=None,
+                      help='Models to optimize (default: every model in models/)')
+    parser.add_argument('--level', choices=list(OPTIMIZATION_LEVELS), default='extended',
+                      help='Graph optimization level; "all" ties the files to this CPU type (default: extended)')
+    parser.add_argument('--no-quantize', action='store_true',
+                      help='Only write the optimized variant, without the int8 one')
+    parser.add_argument('--fixtures', default=None,
+                      help='Directory of images the accuracy is measured on (default: synthetic images)')
+    parser.add_argument('--fixture-count', type=int, default=8,
+                      help='Maximum number of fixture images (default: 8)')
+
+    args = parser.parse_args()
+
+    models = args.models or available_models(MODELS_DIR)
+    unknown = [model_name for model_name in models if model_name not in sessions]
+    if unknown:
+        parser.error(f"Unknown rembg models: {', '.join(unknown)}")
+    if not models:
+        logger.error(f"No models found in {MODELS_DIR}, run download_models.py first")
+        sys.exit(1)
+
+    cache_dir = optimized_cache_dir(MODELS_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    index = load_optimized_index(cache_dir)
+    images = load_fixtures(Path(args.fixtures) if args.fixtures else None, args.fixture_count)
+
+    for model_name in models:
+        logger.info(f"Processing {model_name}...")
+        try:
+            index[model_name] = optimize_model(model_name, cache_dir, args.level,
+                                               not args.no_quantize, images)
+        except Exception as e:
+            logger.error(f"Error optimizing {model_name}: {str(e)}")
+            continue
+        # Written after each model so finished work survives a later failure
+        tmp_path = cache_dir / f"{OPTIMIZED_INDEX}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, cache_dir / OPTIMIZED_INDEX)
+
+    report = markdown_table({name: index[name] for name in models if name in index}, len(images))
+    with open(cache_dir / "report.md", 'w') as f:
+        f.write(report)
+    print(report)
+    logger.info(f"Saved optimized models and report to {cache_dir}")
+
+if __name__ == "__main__":
+    main()
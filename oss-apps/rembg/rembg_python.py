@@ -1,13 +1,36 @@
 import os
 import sys
 import json
+import time
+import queue
+import signal
 import logging
+import threading
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional
-from rembg import remove, new_session
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+from rembg import remove
+from rembg.bg import fix_image_orientation, naive_cutout
+import numpy as np
 import PIL.Image
+import PIL.ImageColor
 import argparse
 
+from manifest import ProcessingManifest
+from mask_cache import MASK_CACHE_DIRNAME, MaskCache
+from model_router import LATENCY_BUDGET_KEY, LatencyBudget, ModelRouter
+from session_pool import MODEL_VARIANTS, PeakRSS, SessionPool
+from stage_metrics import StageMetrics
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    # Watch mode falls back to polling the directory
+    Observer = None
+
 # ロギングの設定
 logging.basicConfig(
     level=logging.INFO,
@@ -15,28 +38,197 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp'}
+
+# Export formats and their file extensions
+EXPORT_FORMATS = {"png": "png", "webp": "webp", "jpeg": "jpg"}
+
+# Marks the end of the stream on the queues between pipeline stages
+_STOP = object()
+
+# Images kept in the per image metrics breakdown in watch mode, which rewrites
+# the metrics files after every batch
+WATCH_METRICS_IMAGES = 1000
+
+# Guided filter upsampling the masks of the large image fast path
+LARGE_IMAGE_FILTER_RADIUS = 4
+LARGE_IMAGE_FILTER_EPS = 1e-3
+
+# Preprocessing of the rembg sessions that can run batched, mirroring their
+# predict(): (mean, std, input size, whether the output needs a sigmoid)
+_U2NET_SPEC = ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320), False)
+_BIREFNET_SPEC = ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (1024, 1024), True)
+BATCH_MODEL_SPECS = {
+    "u2net": _U2NET_SPEC,
+    "u2netp": _U2NET_SPEC,
+    "u2net_human_seg": _U2NET_SPEC,
+    "silueta": _U2NET_SPEC,
+    "isnet-general-use": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024), False),
+    "isnet-anime": ((0.485, 0.456, 0.406), (1.0, 1.0, 1.0), (1024, 1024), False),
+    "birefnet-general": _BIREFNET_SPEC,
+    "birefnet-general-lite": _BIREFNET_SPEC,
+    "birefnet-portrait": _BIREFNET_SPEC,
+    "birefnet-dis": _BIREFNET_SPEC,
+    "birefnet-hrsod": _BIREFNET_SPEC,
+    "birefnet-cod": _BIREFNET_SPEC,
+    "birefnet-massive": _BIREFNET_SPEC,
+}
+
+
+class LargeImage(NamedTuple):
+    """A large input decoded at full resolution, plus a reduced copy for inference"""
+    full: PIL.Image.Image
+    reduced: PIL.Image.Image
+    decode_seconds: float
+
+
+def _box_sum(a: np.ndarray, r: int, axis: int) -> np.ndarray:
+    """Sum over a window of 2r+1 elements along axis 0 or 1, zero padded"""
+    pad = [(0, 0)] * a.ndim
+    pad[axis] = (r + 1, r)
+    c = np.cumsum(np.pad(a, pad), axis=axis, dtype=np.float32)
+    n = a.shape[axis]
+    if axis == 0:
+        return c[2 * r + 1:] - c[:n]
+    return c[:, 2 * r + 1:] - c[:, :n]
+
+
+def _box_filter(a: np.ndarray, r: int) -> np.ndarray:
+    """Mean over a (2r+1) x (2r+1) window, shrinking the window at the borders"""
+    row_counts = _box_sum(np.ones(a.shape[0], dtype=np.float32), r, 0)
+    col_counts = _box_sum(np.ones(a.shape[1], dtype=np.float32), r, 0)
+    return _box_sum(_box_sum(a, r, 0), r, 1) / np.outer(row_counts, col_counts)
+
+
+def available_cpus() -> int:
+    """Get the number of CPUs this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Processor of the current worker process in the multi-process mode
+_worker_processor: Optional["ImageProcessor"] = None
+
+
+def _init_worker(input_dir: str, options: Dict[str, Any], prewarm_models: List[str]):
+    """Create the processor of a worker process, which keeps its own sessions"""
+    global _worker_processor
+    _worker_processor = ImageProcessor(input_dir, **options)
+    if prewarm_models:
+        _worker_processor.session_pool.prewarm(prewarm_models)
+
+
+def _process_shard(image_names: List[str], fingerprints: Dict[str, Dict],
+                   run_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Process a shard of images in a worker process
+
+    Returns:
+        Dict[str, Any]: Counts, the manifest entries recorded for the shard,
+        and the session pool stats of the worker
+    """
+    processor = _worker_processor
+    processor._fingerprints.update(fingerprints)
+    image_paths = [processor.input_dir / name for name in image_names]
+    processed, errors = processor._process_paths(image_paths, **run_kwargs)
+    return {
+        "pid": os.getpid(),
+        "processed": processed,
+        "errors": errors,
+        "entries": processor.manifest.take_recorded(),
+        "session_stats": processor.session_pool.stats(),
+        "metrics": processor.metrics.drain(),
+    }
+
+
 class ImageProcessor:
     """Background removal image processor class"""
     
-    def __init__(self, input_dir: str, model_name: str = "u2net"):
+    def __init__(self, input_dir: str, model_name: str = "u2net",
+                 memory_budget_mb: Optional[float] = None, budget_mode: str = "model-size",
+                 large_image_pixels: Optional[int] = None, large_image_max_side: int = 1024,
+                 large_image_compare: bool = False, intra_op_num_threads: Optional[int] = None,
+                 inter_op_num_threads: Optional[int] = None, metrics_path: Optional[str] = None,
+                 prometheus_path: Optional[str] = None, mask_cache_dir: Optional[str] = None,
+                 latency_budget_ms: Optional[float] = None, model_variant: str = "optimized"):
         """
         Initialize the image processor
         
         Args:
             input_dir (str): Input directory path containing images
             model_name (str): Default model name to use
+            memory_budget_mb (Optional[float]): Memory budget for the model
+                sessions in MiB, None for no limit
+            budget_mode (str): What the budget limits, "model-size" (summed
+                size of the loaded model files) or "rss" (process RSS)
+            large_image_pixels (Optional[int]): Pixel count above which images
+                take the downscaled fast path, None to disable it
+            large_image_max_side (int): Longest side of the copy inferred on
+                in the fast path
+            large_image_compare (bool): Also run the standard path on large
+                images and report the time saved and the mask difference
+            intra_op_num_threads (Optional[int]): ONNX Runtime intra-op threads
+                per session, None for the default
+            inter_op_num_threads (Optional[int]): ONNX Runtime inter-op threads
+                per session, None for sequential execution
+            metrics_path (Optional[str]): JSON file the per-stage metrics are
+                written to after each run, defaults to rembg_metrics.json in
+                the input directory
+            prometheus_path (Optional[str]): Prometheus text file the per-stage
+                metrics are also written to, None to skip it
+            mask_cache_dir (Optional[str]): Directory caching the predicted
+                masks, reused instead of running inference again. None disables
+                the cache
+            latency_budget_ms (Optional[float]): Per-image latency budget above
+                which routing rules fall back to faster models, defaults to
+                "_latency_budget_ms" in config.json
+            model_variant (str): Model files to prefer, "optimized" or "int8"
+                files written by optimize_models.py, or "original"
         """
         self.input_dir = Path(input_dir)
         self.default_model = model_name
-        self.model_sessions = {}
+        # Constructor arguments, to create the same processor in worker processes
+        self._options = dict(
+            model_name=model_name,
+            memory_budget_mb=memory_budget_mb,
+            budget_mode=budget_mode,
+            large_image_pixels=large_image_pixels,
+            large_image_max_side=large_image_max_side,
+            large_image_compare=large_image_compare,
+            intra_op_num_threads=intra_op_num_threads,
+            inter_op_num_threads=inter_op_num_threads,
+            mask_cache_dir=mask_cache_dir,
+            latency_budget_ms=latency_budget_ms,
+            model_variant=model_variant,
+        )
         self.models_dir = Path(__file__).parent / "models"
         self.config = self._load_config()
+        self.router = ModelRouter(self.config, model_name)
+        if latency_budget_ms is None:
+            latency_budget_ms = self.config.get(LATENCY_BUDGET_KEY)
+        self.latency_budget = LatencyBudget(latency_budget_ms / 1000 if latency_budget_ms else None)
         
         if not self.input_dir.exists():
             raise FileNotFoundError(f"Input directory '{input_dir}' does not exist")
         
         if not self.models_dir.exists():
             raise FileNotFoundError(f"Models directory '{self.models_dir}' does not exist")
+        
+        self.session_pool = SessionPool(self.models_dir, memory_budget_mb, budget_mode,
+                                        intra_op_num_threads, inter_op_num_threads, model_variant)
+        self.large_image_pixels = large_image_pixels
+        self.large_image_max_side = large_image_max_side
+        self.large_image_compare = large_image_compare
+        
+        # Outputs are written next to the inputs, so the manifest lives there too
+        self.manifest = ProcessingManifest(self.input_dir)
+        self._fingerprints: Dict[str, Dict] = {}
+        
+        self.metrics = StageMetrics()
+        self.metrics_path = Path(metrics_path) if metrics_path else self.input_dir / "rembg_metrics.json"
+        self.prometheus_path = Path(prometheus_path) if prometheus_path else None
+        self.mask_cache = MaskCache(Path(mask_cache_dir)) if mask_cache_dir else None
             
         logger.info(f"Initialized ImageProcessor with input directory: {input_dir}")
         logger.info(f"Using models directory: {self.models_dir}")
@@ -57,23 +249,475 @@ class ImageProcessor:
     
     def _get_model_session(self, model_name: str):
         """Get or create a model session"""
-        if model_name not in self.model_sessions:
-            model_path = self.models_dir / f"{model_name}.onnx"
-            if not model_path.exists():
-                raise FileNotFoundError(f"Model file not found: {model_path}")
-                
-            logger.info(f"Creating new session for model: {model_name} from {model_path}")
-            self.model_sessions[model_name] = new_session(model_name, model_path=str(model_path))
-        return self.model_sessions[model_name]
-    
-    def _get_model_for_image(self, image_path: Path) -> str:
-        """Get the model name for a specific image from config or use default"""
-        image_name = image_path.name
-        if image_name in self.config:
-            model_name = self.config[image_name].get('model', self.default_model)
-            logger.info(f"Using model '{model_name}' for image: {image_name}")
-            return model_name
-        return self.default_model
+        return self.session_pool.get(model_name)
+    
+    def _read_image_size(self, image_path: Path) -> Optional[Tuple[int, int]]:
+        """Get the size of an image from its header, None if it cannot be read"""
+        try:
+            with PIL.Image.open(image_path) as image:
+                return image.size
+        except OSError:
+            return None
+    
+    def _route(self, image_path: Path,
+               image_size: Optional[Tuple[int, int]] = None) -> Tuple[str, Tuple[str, ...]]:
+        """Get the preferred model of an image and its fallbacks from the routing rules"""
+        if image_size is None and self.router.needs_size:
+            image_size = self._read_image_size(image_path)
+        return self.router.route(image_path.name, image_size)
+    
+    def _get_model_for_image(self, image_path: Path,
+                             image_size: Optional[Tuple[int, int]] = None) -> str:
+        """
+        Get the preferred model of an image from config.json or use default
+        
+        Args:
+            image_path (Path): Path to the image
+            image_size (Optional[Tuple[int, int]]): Image width and height, read
+                from the file header when a routing rule needs it
+            
+        Returns:
+            str: Model name, ignoring the latency budget
+        """
+        model_name, _ = self._route(image_path, image_size)
+        if model_name != self.default_model:
+            logger.info(f"Using model '{model_name}' for image: {image_path.name}")
+        return model_name
+    
+    def _select_model(self, image_path: Path) -> str:
+        """
+        Get the model an image is processed with now
+        
+        This is the preferred model, or one of its faster fallbacks when the
+        estimated latency exceeds the latency budget. Images processed with a
+        fallback are recorded with it in the manifest, so the next run
+        reprocesses them with the preferred model.
+        """
+        model_name, fallback = self._route(image_path)
+        selected = self.latency_budget.choose(model_name, fallback)
+        if selected != model_name:
+            logger.info(f"Latency budget exceeded, using fallback model '{selected}' "
+                        f"instead of '{model_name}' for image: {image_path.name}")
+        return selected
+    
+    def _get_output_path(self, input_path: Path) -> Path:
+        """Get the output path for an input image"""
+        return input_path.parent / f"output_{input_path.stem}.png"
+    
+    def _is_input_image(self, file_path: Path) -> bool:
+        """Check whether a file is an input image rather than a previous output"""
+        return (file_path.suffix.lower() in IMAGE_EXTENSIONS
+                and not file_path.name.startswith("output_"))
+    
+    def _list_images(self) -> List[Path]:
+        """List the input image files in the input directory, skipping previous outputs"""
+        return [
+            file_path for file_path in sorted(self.input_dir.iterdir())
+            if self._is_input_image(file_path)
+        ]
+    
+    def _select_changed(self, image_paths: List[Path], workers: int = 1) -> List[Path]:
+        """
+        Filter out images whose recorded output is still valid
+        
+        An image is reprocessed when its content hash or size, its model or
+        the resolved variant of that model (including the large image fast
+        path settings), its config.json entry or its output file changed since
+        the last run.
+        
+        Args:
+            image_paths (List[Path]): Candidate images
+            workers (int): Number of threads used to hash the files
+            
+        Returns:
+            List[Path]: Images that need processing
+        """
+        def check(input_path: Path) -> bool:
+            try:
+                fingerprint = self.manifest.fingerprint(input_path)
+            except OSError as e:
+                logger.error(f"Error reading {input_path.name}: {str(e)}")
+                return True
+            self._fingerprints[input_path.name] = fingerprint
+            model_name = self._get_model_for_image(input_path)
+            try:
+                variant = self._output_variant(input_path, model_name)
+            except OSError as e:
+                logger.error(f"Error reading {input_path.name}: {str(e)}")
+                return True
+            return not self.manifest.is_up_to_date(
+                input_path,
+                fingerprint,
+                model_name,
+                variant,
+                self.config.get(input_path.name),
+                self._get_output_path(input_path),
+            )
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            needs_processing = list(executor.map(check, image_paths))
+        return [path for path, needed in zip(image_paths, needs_processing) if needed]
+    
+    def _content_hash(self, input_path: Path) -> str:
+        """Get the SHA-256 of an input, reusing the fingerprint taken when selecting changed files"""
+        fingerprint = self._fingerprints.get(input_path.name)
+        if fingerprint is None:
+            fingerprint = self.manifest.fingerprint(input_path)
+            self._fingerprints[input_path.name] = fingerprint
+        return fingerprint["sha256"]
+    
+    def _mask_variant(self, model_name: str, large: bool) -> str:
+        """
+        Get the variant a mask is cached under
+        
+        Masks of the large image fast path are upsampled from a reduced
+        copy, so they are kept apart from full inference masks and from fast
+        path masks computed with other parameters.
+        """
+        variant = self.session_pool.resolved_variant(model_name)
+        if not large:
+            return variant
+        return (f"{variant}+fast-{self.large_image_max_side}"
+                f"-r{LARGE_IMAGE_FILTER_RADIUS}-e{LARGE_IMAGE_FILTER_EPS:g}")
+    
+    def _cached_mask(self, input_path: Path, model_name: str,
+                     large: bool = False) -> Optional[PIL.Image.Image]:
+        """Get the cached mask of an input, None if it is not cached or the cache is disabled"""
+        if self.mask_cache is None:
+            return None
+        return self.mask_cache.get(self._content_hash(input_path), model_name,
+                                   self._mask_variant(model_name, large))
+    
+    def _store_mask(self, input_path: Path, model_name: str, mask: PIL.Image.Image,
+                    large: bool = False):
+        """Add the mask of an input to the cache, if enabled"""
+        if self.mask_cache is None:
+            return
+        try:
+            self.mask_cache.put(self._content_hash(input_path), model_name,
+                                self._mask_variant(model_name, large), mask)
+        except OSError as e:
+            logger.warning(f"Could not cache the mask of {input_path.name}: {str(e)}")
+    
+    def _uses_fast_path(self, size: Tuple[int, int], model_name: Optional[str]) -> bool:
+        """Whether an image of this size is processed on the large image fast path"""
+        width, height = size
+        return (self.large_image_pixels is not None and width * height > self.large_image_pixels
+                and model_name in BATCH_MODEL_SPECS
+                and max(width, height) > self.large_image_max_side)
+    
+    def _output_variant(self, input_path: Path, model_name: str) -> str:
+        """
+        Get the variant an input's output is produced with, for the manifest
+        
+        Like the mask cache key, it includes the fast path settings for large
+        images, so changing --large-image-mp or --large-image-max-side
+        reprocesses the images whose path changes. Only the image header is read.
+        """
+        with PIL.Image.open(input_path) as image:
+            size = image.size
+        return self._mask_variant(model_name, self._uses_fast_path(size, model_name))
+    
+    def _record_processed(self, input_path: Path, model_name: str, output_path: Path):
+        """Record a successfully written output in the manifest"""
+        try:
+            fingerprint = self._fingerprints.pop(input_path.name, None) or self.manifest.fingerprint(input_path)
+            self.manifest.record(input_path, fingerprint, model_name,
+                                 self._output_variant(input_path, model_name),
+                                 self.config.get(input_path.name), output_path)
+        except OSError as e:
+            logger.warning(f"Could not record {input_path.name} in the manifest: {str(e)}")
+    
+    def _decode_image(self, input_path: Path,
+                      model_name: Optional[str] = None) -> Union[PIL.Image.Image, LargeImage]:
+        """
+        Open an image and decode its pixel data
+        
+        Args:
+            input_path (Path): Path to the input image
+            model_name (Optional[str]): Model the image is processed with. Images
+                above the large image threshold whose model supports it are
+                returned as a LargeImage for the fast path
+            
+        Returns:
+            Union[PIL.Image.Image, LargeImage]: The decoded image
+        """
+        start = time.perf_counter()
+        image = PIL.Image.open(input_path)
+        image.load()
+        
+        if not self._uses_fast_path(image.size, model_name):
+            self._record_decode(input_path, model_name, time.perf_counter() - start)
+            return image
+        
+        full = fix_image_orientation(image)
+        # reduce() is a fast integer box filter, thumbnail() then fits the exact size
+        factor = max(1, max(full.size) // self.large_image_max_side)
+        reduced = full.reduce(factor) if factor > 1 else full.copy()
+        reduced.thumbnail((self.large_image_max_side, self.large_image_max_side),
+                          PIL.Image.Resampling.LANCZOS)
+        decode_seconds = time.perf_counter() - start
+        self._record_decode(input_path, model_name, decode_seconds)
+        return LargeImage(full, reduced, decode_seconds)
+    
+    def _record_decode(self, input_path: Path, model_name: Optional[str], seconds: float):
+        """Record the decode stage of an input file, sized by the encoded file"""
+        self.metrics.record(model_name or self.default_model, "decode", seconds,
+                            input_path.stat().st_size, input_path.name)
+    
+    def _upsample_mask(self, mask: PIL.Image.Image, reduced: PIL.Image.Image,
+                       full: PIL.Image.Image, radius: int = LARGE_IMAGE_FILTER_RADIUS,
+                       eps: float = LARGE_IMAGE_FILTER_EPS,
+                       tile_rows: int = 512) -> PIL.Image.Image:
+        """
+        Upsample a mask to full resolution with a fast guided filter
+        
+        The filter coefficients are computed at the reduced resolution with the
+        reduced image as guide, then bilinearly upsampled and applied to the
+        full resolution luminance in strips of `tile_rows` rows, so edges follow
+        the full resolution image without any full resolution float buffer.
+        
+        Args:
+            mask (PIL.Image.Image): Mask at the reduced resolution
+            reduced (PIL.Image.Image): Reduced image the mask was predicted on
+            full (PIL.Image.Image): Full resolution image
+            radius (int): Filter radius in reduced resolution pixels
+            eps (float): Regularization, larger values smooth more
+            tile_rows (int): Number of full resolution rows processed at once
+            
+        Returns:
+            PIL.Image.Image: Mask at full resolution
+        """
+        guide = np.asarray(reduced.convert("L"), dtype=np.float32) / 255
+        p = np.asarray(mask.convert("L"), dtype=np.float32) / 255
+        mean_i = _box_filter(guide, radius)
+        mean_p = _box_filter(p, radius)
+        cov_ip = _box_filter(guide * p, radius) - mean_i * mean_p
+        var_i = _box_filter(guide * guide, radius) - mean_i * mean_i
+        a = cov_ip / (var_i + eps)
+        b = mean_p - a * mean_i
+        # Scaled to 0-255 so they apply directly to the 8-bit full resolution guide
+        mean_a = PIL.Image.fromarray(_box_filter(a, radius).astype(np.float32))
+        mean_b = PIL.Image.fromarray((_box_filter(b, radius) * 255).astype(np.float32))
+        
+        width, height = full.size
+        low_width, low_height = mean_a.size
+        scale = low_height / height
+        full_guide = full.convert("L")
+        alpha = np.empty((height, width), dtype=np.uint8)
+        for top in range(0, height, tile_rows):
+            bottom = min(top + tile_rows, height)
+            size = (width, bottom - top)
+            box = (0, top * scale, low_width, bottom * scale)
+            strip_a = np.asarray(mean_a.resize(size, PIL.Image.Resampling.BILINEAR, box=box))
+            strip_b = np.asarray(mean_b.resize(size, PIL.Image.Resampling.BILINEAR, box=box))
+            strip = np.asarray(full_guide.crop((0, top, width, bottom)), dtype=np.float32)
+            q = strip_a * strip + strip_b
+            np.clip(q, 0, 255, out=q)
+            alpha[top:bottom] = q
+        return PIL.Image.fromarray(alpha)
+    
+    def _predict_large_mask(self, model_name: str, large: LargeImage,
+                            image_name: Optional[str] = None) -> Tuple[PIL.Image.Image, float]:
+        """Predict the mask of a large image on its reduced copy"""
+        start = time.perf_counter()
+        mask = self._remove_batch(model_name, [large.reduced], only_mask=True,
+                                  image_names=[image_name])[0]
+        predict_seconds = time.perf_counter() - start
+        self.latency_budget.observe(model_name, predict_seconds)
+        return mask, predict_seconds
+    
+    def _composite_large(self, input_name: str, model_name: str, large: LargeImage,
+                         mask: PIL.Image.Image, predict_seconds: float) -> PIL.Image.Image:
+        """
+        Composite a large image at full resolution from its reduced mask
+        
+        Logs the time spent in each step and the measured peak memory of the
+        upsampling and compositing, and of the standard path when comparing.
+        
+        Args:
+            input_name (str): Input file name, for the report
+            model_name (str): Model the mask was predicted with
+            large (LargeImage): The decoded large image
+            mask (PIL.Image.Image): Mask predicted on the reduced copy
+            predict_seconds (float): Time spent predicting the mask
+            
+        Returns:
+            PIL.Image.Image: RGBA cut-out at full resolution
+        """
+        width, height = large.full.size
+        report = ""
+        start = time.perf_counter()
+        with PeakRSS() as fast_memory:
+            alpha = self._upsample_mask(mask, large.reduced, large.full)
+            # Composited on a copy: large.full stays untouched for --large-image-compare
+            output_image = large.full.convert("RGB")
+            output_image.putalpha(alpha)
+        composite_seconds = time.perf_counter() - start
+        self.metrics.record(model_name, "postprocess", composite_seconds, width * height * 4, input_name)
+        self._store_mask(self.input_dir / input_name, model_name, alpha, large=True)
+        
+        fast_seconds = large.decode_seconds + predict_seconds + composite_seconds
+        if self.large_image_compare:
+            # Measured after the fast path, so its freed buffers are not counted
+            session = self._get_model_session(model_name)
+            start = time.perf_counter()
+            with PeakRSS() as standard_memory:
+                standard = remove(large.full, session=session)
+            standard_seconds = time.perf_counter() - start
+            difference = np.mean(np.abs(np.asarray(alpha, dtype=np.int16)
+                                        - np.asarray(standard.getchannel("A"), dtype=np.int16)))
+            report = (f", standard path {standard_seconds:.2f}s "
+                      f"(saved {standard_seconds - predict_seconds - composite_seconds:.2f}s) "
+                      f"with peak RSS +{standard_memory.peak_bytes / 2**20:.0f} MiB "
+                      f"(saved {(standard_memory.peak_bytes - fast_memory.peak_bytes) / 2**20:.0f} MiB), "
+                      f"mean alpha difference {difference:.2f}/255")
+        
+        logger.info(f"Large image fast path for {input_name}: {width}x{height} inferred at "
+                   f"{large.reduced.size[0]}x{large.reduced.size[1]}, decode {large.decode_seconds:.2f}s, "
+                   f"inference {predict_seconds:.2f}s, upsample+composite {composite_seconds:.2f}s "
+                   f"with peak RSS +{fast_memory.peak_bytes / 2**20:.0f} MiB, "
+                   f"total {fast_seconds:.2f}s{report}")
+        return output_image
+    
+    def _normalize(self, image: PIL.Image.Image, mean: Tuple[float, float, float],
+                   std: Tuple[float, float, float], size: Tuple[int, int]) -> np.ndarray:
+        """Resize and normalize an image into a CHW float32 array"""
+        im_ary = np.asarray(image.convert("RGB").resize(size, PIL.Image.Resampling.LANCZOS),
+                            dtype=np.float32)
+        im_ary = im_ary / max(float(np.max(im_ary)), 1.0)
+        im_ary = (im_ary - np.array(mean, dtype=np.float32)) / np.array(std, dtype=np.float32)
+        return im_ary.transpose((2, 0, 1))
+    
+    def _predict_masks(self, model_name: str, images: List[PIL.Image.Image],
+                       image_names: Optional[List[Optional[str]]] = None,
+                       cutout: bool = False) -> List[PIL.Image.Image]:
+        """
+        Predict the alpha masks of images sharing a model
+        
+        The images are stacked into one NCHW tensor so the session runs once
+        per batch. Models exported with a fixed batch dimension are run in
+        chunks of that size instead.
+        
+        Args:
+            model_name (str): Model name, must be a key of BATCH_MODEL_SPECS
+            images (List[PIL.Image.Image]): Orientation-corrected input images
+            image_names (Optional[List[Optional[str]]]): Input file names the
+                stage metrics are recorded under
+            cutout (bool): Return the cut-out images instead of the masks, the
+                cut-out being measured as part of the postprocessing
+            
+        Returns:
+            List[PIL.Image.Image]: One mask or cut-out per image, at the image resolution
+        """
+        mean, std, size, apply_sigmoid = BATCH_MODEL_SPECS[model_name]
+        session = self._get_model_session(model_name)
+        model_input = session.inner_session.get_inputs()[0]
+        chunk_size = model_input.shape[0] if isinstance(model_input.shape[0], int) else len(images)
+        
+        image_names = image_names or [None] * len(images)
+        
+        masks = []
+        for start in range(0, len(images), chunk_size):
+            chunk = images[start:start + chunk_size]
+            chunk_names = image_names[start:start + chunk_size]
+            
+            stage_start = time.perf_counter()
+            batch = np.stack([self._normalize(image, mean, std, size) for image in chunk])
+            self.metrics.record_batch(model_name, "preprocess", time.perf_counter() - stage_start,
+                                      batch.nbytes, chunk_names)
+            
+            stage_start = time.perf_counter()
+            preds = session.inner_session.run(None, {model_input.name: batch})[0][:, 0, :, :]
+            self.metrics.record_batch(model_name, "inference", time.perf_counter() - stage_start,
+                                      preds.nbytes, chunk_names)
+            
+            stage_start = time.perf_counter()
+            if apply_sigmoid:
+                preds = 1 / (1 + np.exp(-preds))
+            chunk_masks = []
+            for pred, image in zip(preds, chunk):
+                # Min-max scaling is done per image, as in the unbatched predict()
+                ma, mi = float(np.max(pred)), float(np.min(pred))
+                pred = (pred - mi) / (ma - mi) if ma > mi else np.zeros_like(pred)
+                mask = PIL.Image.fromarray((pred * 255).astype(np.uint8))
+                mask = mask.resize(image.size, PIL.Image.Resampling.LANCZOS)
+                chunk_masks.append(naive_cutout(image, mask) if cutout else mask)
+            self.metrics.record_batch(model_name, "postprocess", time.perf_counter() - stage_start,
+                                      sum(len(mask.getbands()) * mask.width * mask.height
+                                          for mask in chunk_masks), chunk_names)
+            masks.extend(chunk_masks)
+        return masks
+    
+    def _remove_batch(self, model_name: str, images: List[PIL.Image.Image],
+                      only_mask: bool = False,
+                      image_names: Optional[List[Optional[str]]] = None) -> List[PIL.Image.Image]:
+        """
+        Remove the background of images sharing a model
+        
+        Models without an entry in BATCH_MODEL_SPECS fall back to one
+        remove() call per image, recorded as a single inference stage.
+        
+        Args:
+            model_name (str): Model name
+            images (List[PIL.Image.Image]): Decoded input images
+            only_mask (bool): Return the alpha masks instead of the cut-out images
+            image_names (Optional[List[Optional[str]]]): Input file names the
+                stage metrics are recorded under
+            
+        Returns:
+            List[PIL.Image.Image]: Cut-out images or masks, in the order of `images`
+        """
+        image_names = image_names or [None] * len(images)
+        if model_name not in BATCH_MODEL_SPECS:
+            session = self._get_model_session(model_name)
+            outputs = []
+            for image, image_name in zip(images, image_names):
+                with self.metrics.time(model_name, "inference", image_name) as stage:
+                    output = remove(image, session=session, only_mask=only_mask)
+                    stage["bytes"] = output.width * output.height * len(output.getbands())
+                outputs.append(output)
+            return outputs
+        
+        images = [fix_image_orientation(image) for image in images]
+        return self._predict_masks(model_name, images, image_names, cutout=not only_mask)
+    
+    def _apply_mask(self, input_image: Union[PIL.Image.Image, LargeImage], mask: PIL.Image.Image,
+                    model_name: str, image_name: str) -> PIL.Image.Image:
+        """Cut out an image with a cached mask, as remove() does with a predicted one"""
+        with self.metrics.time(model_name, "postprocess", image_name) as stage:
+            if isinstance(input_image, LargeImage):
+                image = input_image.full
+            else:
+                image = fix_image_orientation(input_image)
+            if mask.size != image.size:
+                raise ValueError(f"Cached mask size {mask.size} does not match the image size {image.size}")
+            output_image = naive_cutout(image, mask)
+            stage["bytes"] = output_image.width * output_image.height * 4
+        return output_image
+    
+    def _remove_and_cache(self, model_name: str, images: List[PIL.Image.Image],
+                          input_paths: List[Path]) -> List[PIL.Image.Image]:
+        """Remove the background of images sharing a model, caching their masks if enabled"""
+        image_names = [input_path.name for input_path in input_paths]
+        start = time.perf_counter()
+        if self.mask_cache is None:
+            output_images = self._remove_batch(model_name, images, image_names=image_names)
+        else:
+            masks = self._remove_batch(model_name, images, only_mask=True, image_names=image_names)
+            output_images = []
+            for input_path, image, mask in zip(input_paths, images, masks):
+                self._store_mask(input_path, model_name, mask)
+                output_images.append(self._apply_mask(image, mask, model_name, input_path.name))
+        self.latency_budget.observe(model_name, (time.perf_counter() - start) / len(images))
+        return output_images
+    
+    def _save_output(self, output_image: PIL.Image.Image, output_path: Path,
+                     model_name: str, image_name: str):
+        """Encode and write an output image, recording the encode stage"""
+        with self.metrics.time(model_name, "encode", image_name) as stage:
+            output_image.save(output_path)
+            stage["bytes"] = output_path.stat().st_size
     
     def process_image(self, input_path: Path) -> bool:
         """
@@ -87,18 +731,27 @@ class ImageProcessor:
         """
         try:
             # Generate output path with prefix
-            output_path = input_path.parent / f"output_{input_path.stem}.png"
+            output_path = self._get_output_path(input_path)
             
             # Get model for this image
-            model_name = self._get_model_for_image(input_path)
-            session = self._get_model_session(model_name)
+            model_name = self._select_model(input_path)
             
             # Load and process image
-            input_image = PIL.Image.open(input_path)
-            output_image = remove(input_image, session=session)
+            input_image = self._decode_image(input_path, model_name)
+            mask = self._cached_mask(input_path, model_name, isinstance(input_image, LargeImage))
+            if mask is not None:
+                output_image = self._apply_mask(input_image, mask, model_name, input_path.name)
+            elif isinstance(input_image, LargeImage):
+                mask, predict_seconds = self._predict_large_mask(model_name, input_image, input_path.name)
+                output_image = self._composite_large(input_path.name, model_name, input_image,
+                                                     mask, predict_seconds)
+            else:
+                # Same result as remove(), with each stage measured
+                output_image = self._remove_and_cache(model_name, [input_image], [input_path])[0]
             
             # Save processed image
-            output_image.save(output_path)
+            self._save_output(output_image, output_path, model_name, input_path.name)
+            self._record_processed(input_path, model_name, output_path)
             logger.info(f"Successfully processed {input_path.name} -> {output_path.name}")
             return True
             
@@ -106,35 +759,706 @@ class ImageProcessor:
             logger.error(f"Error processing {input_path.name}: {str(e)}")
             return False
     
-    def process_directory(self):
-        """Process all images in the input directory"""
-        image_extensions = {'.png', '.jpg', '.jpeg', '.webp'}
-        processed_count = 0
-        error_count = 0
+    def _process_pipelined(self, image_paths: List[Path], workers: int,
+                           queue_depth: int, batch_size: int = 1,
+                           batch_max_wait: float = 0.1) -> Tuple[int, int]:
+        """
+        Process images through a decode -> inference -> encode pipeline
         
-        logger.info(f"Starting directory processing: {self.input_dir}")
+        Decoding and PNG encoding run on pools of `workers` threads while
+        inference runs on the calling thread. The stages are connected by
+        queues holding at most `queue_depth` images, so memory stays bounded
+        regardless of the number of files.
+        
+        The inference stage groups decoded images by model and runs a batch
+        once `batch_size` images are pending for a model, or once the oldest
+        of them has waited `batch_max_wait` seconds.
+        
+        Args:
+            image_paths (List[Path]): Images to process
+            workers (int): Number of threads in each of the decode and encode pools
+            queue_depth (int): Maximum number of images waiting between two stages
+            batch_size (int): Maximum number of images per inference batch
+            batch_max_wait (float): Maximum seconds an image waits for its batch to fill
+            
+        Returns:
+            Tuple[int, int]: Number of processed images and number of errors
+        """
+        path_queue = queue.Queue()
+        for image_path in image_paths:
+            path_queue.put(image_path)
+        decoded_queue = queue.Queue(maxsize=queue_depth)
+        encode_queue = queue.Queue(maxsize=queue_depth)
+        
+        counts = {"processed": 0, "errors": 0}
+        counts_lock = threading.Lock()
+        
+        def count(key: str):
+            with counts_lock:
+                counts[key] += 1
+            self.latency_budget.end()
+        
+        def decode_worker():
+            while True:
+                try:
+                    input_path = path_queue.get_nowait()
+                except queue.Empty:
+                    return
+                # Counted in flight until count() records its outcome
+                self.latency_budget.begin()
+                try:
+                    model_name = self._select_model(input_path)
+                    input_image = self._decode_image(input_path, model_name)
+                    mask = self._cached_mask(input_path, model_name, isinstance(input_image, LargeImage))
+                except Exception as e:
+                    logger.error(f"Error decoding {input_path.name}: {str(e)}")
+                    count("errors")
+                    continue
+                if mask is not None:
+                    # Cached masks skip inference, the cut-out is done by the encode pool
+                    encode_queue.put((input_path, model_name, functools.partial(
+                        self._apply_mask, input_image, mask, model_name, input_path.name
+                    )))
+                    continue
+                # Blocks while the inference stage is behind
+                decoded_queue.put((input_path, model_name, input_image))
+        
+        def encode_worker():
+            while True:
+                item = encode_queue.get()
+                if item is _STOP:
+                    return
+                input_path, model_name, output_image = item
+                output_path = self._get_output_path(input_path)
+                try:
+                    if callable(output_image):
+                        # Compositing deferred from the inference or decode stage
+                        output_image = output_image()
+                    self._save_output(output_image, output_path, model_name, input_path.name)
+                    self._record_processed(input_path, model_name, output_path)
+                    logger.info(f"Successfully processed {input_path.name} -> {output_path.name}")
+                    count("processed")
+                except Exception as e:
+                    logger.error(f"Error saving {output_path.name}: {str(e)}")
+                    count("errors")
+        
+        decoders = [
+            threading.Thread(target=decode_worker, name=f"rembg-decode-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        encoders = [
+            threading.Thread(target=encode_worker, name=f"rembg-encode-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in decoders + encoders:
+            thread.start()
         
-        for file_path in self.input_dir.iterdir():
-            if file_path.suffix.lower() in image_extensions:
+        def close_decoded_queue():
+            for thread in decoders:
+                thread.join()
+            decoded_queue.put(_STOP)
+        
+        threading.Thread(target=close_decoded_queue, daemon=True).start()
+        
+        # Pending images per model, and when the oldest of them was queued
+        pending: Dict[str, List[Tuple[Path, PIL.Image.Image]]] = {}
+        pending_since: Dict[str, float] = {}
+        
+        def flush(model_name: str):
+            batch = pending.pop(model_name)
+            del pending_since[model_name]
+            try:
+                output_images = self._remove_and_cache(model_name, [image for _, image in batch],
+                                                       [path for path, _ in batch])
+            except Exception as e:
+                for input_path, _ in batch:
+                    logger.error(f"Error processing {input_path.name}: {str(e)}")
+                    count("errors")
+                return
+            for (input_path, _), output_image in zip(batch, output_images):
+                # Blocks while the encode pool is behind
+                encode_queue.put((input_path, model_name, output_image))
+        
+        # Inference stage: ONNX Runtime already parallelizes each run internally
+        while True:
+            timeout = None
+            if pending_since:
+                timeout = max(0.0, min(pending_since.values()) + batch_max_wait - time.monotonic())
+            try:
+                item = decoded_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            
+            if item is _STOP:
+                for model_name in list(pending):
+                    flush(model_name)
+                break
+            
+            if item is not None and isinstance(item[2], LargeImage):
+                # Large images are inferred alone on their reduced copy
+                input_path, model_name, large = item
+                try:
+                    mask, predict_seconds = self._predict_large_mask(model_name, large, input_path.name)
+                except Exception as e:
+                    logger.error(f"Error processing {input_path.name}: {str(e)}")
+                    count("errors")
+                else:
+                    encode_queue.put((input_path, model_name, functools.partial(
+                        self._composite_large, input_path.name, model_name, large, mask, predict_seconds
+                    )))
+            elif item is not None:
+                input_path, model_name, input_image = item
+                pending.setdefault(model_name, []).append((input_path, input_image))
+                pending_since.setdefault(model_name, time.monotonic())
+                if len(pending[model_name]) >= batch_size:
+                    flush(model_name)
+            
+            now = time.monotonic()
+            for model_name, since in list(pending_since.items()):
+                if now - since >= batch_max_wait:
+                    flush(model_name)
+        
+        for _ in encoders:
+            encode_queue.put(_STOP)
+        for thread in encoders:
+            thread.join()
+        
+        return counts["processed"], counts["errors"]
+    
+    def _process_paths(self, image_paths: List[Path], workers: int = 1, queue_depth: int = 8,
+                       batch_size: int = 1, batch_max_wait: float = 0.1) -> Tuple[int, int]:
+        """
+        Process images in this process, pipelined or one by one
+        
+        Returns:
+            Tuple[int, int]: Number of processed images and number of errors
+        """
+        if workers > 1 or batch_size > 1:
+            return self._process_pipelined(image_paths, workers, queue_depth, batch_size, batch_max_wait)
+        
+        processed_count = 0
+        error_count = 0
+        for file_path in image_paths:
+            self.latency_budget.begin()
+            try:
                 if self.process_image(file_path):
                     processed_count += 1
                 else:
                     error_count += 1
-                    
+            finally:
+                self.latency_budget.end()
+        return processed_count, error_count
+    
+    def _process_sharded(self, image_paths: List[Path], processes: int,
+                         prewarm_models: List[str], **run_kwargs) -> Tuple[int, int]:
+        """
+        Process images on a pool of worker processes
+        
+        Each worker process has its own processor and session pool, with the
+        ONNX Runtime intra-op threads set to its share of the CPUs unless set
+        explicitly, so the workers do not oversubscribe the cores. The images
+        are split into contiguous shards, several per worker so that faster
+        workers pick up more of them; images are expected in model order so a
+        worker mostly keeps using the same session. The manifest entries the
+        workers record are merged into this process's manifest.
+        
+        Args:
+            image_paths (List[Path]): Images to process
+            processes (int): Number of worker processes
+            prewarm_models (List[str]): Models each worker loads at startup
+            **run_kwargs: Arguments for the per-worker processing, as for _process_paths()
+            
+        Returns:
+            Tuple[int, int]: Number of processed images and number of errors
+        """
+        options = dict(self._options)
+        if options["intra_op_num_threads"] is None:
+            options["intra_op_num_threads"] = max(1, available_cpus() // processes)
+        logger.info(f"Using {processes} worker processes with "
+                   f"{options['intra_op_num_threads']} intra-op threads each")
+        
+        shard_size = max(1, -(-len(image_paths) // (processes * 4)))
+        shards = [image_paths[i:i + shard_size] for i in range(0, len(image_paths), shard_size)]
+        
+        processed_count = 0
+        error_count = 0
+        worker_stats: Dict[int, Dict[str, Any]] = {}
+        # spawn: forking a process that already runs ONNX Runtime threads is unsafe
+        with ProcessPoolExecutor(max_workers=processes,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker,
+                                 initargs=(str(self.input_dir), options, prewarm_models)) as executor:
+            futures = []
+            for shard in shards:
+                fingerprints = {path.name: self._fingerprints.pop(path.name)
+                                for path in shard if path.name in self._fingerprints}
+                futures.append((shard, executor.submit(
+                    _process_shard, [path.name for path in shard], fingerprints, run_kwargs
+                )))
+            for shard, future in futures:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Worker failed on {len(shard)} images "
+                                 f"({shard[0].name} .. {shard[-1].name}): {str(e)}")
+                    error_count += len(shard)
+                    continue
+                processed_count += result["processed"]
+                error_count += result["errors"]
+                self.manifest.merge(result["entries"])
+                self.metrics.merge(result["metrics"])
+                worker_stats[result["pid"]] = result["session_stats"]
+        
+        logger.info(f"Session pool stats across {len(worker_stats)} workers: "
+                   f"hits={sum(s['hits'] for s in worker_stats.values())}, "
+                   f"misses={sum(s['misses'] for s in worker_stats.values())}, "
+                   f"evictions={sum(s['evictions'] for s in worker_stats.values())}")
+        return processed_count, error_count
+    
+    def process_directory(self, workers: int = 1, queue_depth: int = 8,
+                          batch_size: int = 1, batch_max_wait: float = 0.1,
+                          force: bool = False, prewarm: bool = False, processes: int = 1):
+        """
+        Process all images in the input directory
+        
+        Args:
+            workers (int): Number of decode/encode threads. Values above 1
+                enable the pipelined mode, 1 processes images one by one
+            queue_depth (int): Maximum number of images buffered between
+                pipeline stages
+            batch_size (int): Maximum number of images per inference batch.
+                Values above 1 enable batched inference in the pipelined mode
+            batch_max_wait (float): Maximum seconds an image waits for its
+                batch to fill
+            force (bool): Reprocess every image, even those whose output
+                recorded in the manifest is still valid
+            prewarm (bool): Load the sessions of the models the images need
+                before processing starts, as far as the memory budget allows
+            processes (int): Number of worker processes. Values above 1 shard
+                the images across processes, each running `workers` threads
+                and its own session pool
+        """
+        logger.info(f"Starting directory processing: {self.input_dir}")
+        start_time = time.perf_counter()
+        self.metrics.drain()
+        
+        image_paths = self._list_images()
+        skipped_count = 0
+        if not force:
+            changed_paths = self._select_changed(image_paths, workers)
+            skipped_count = len(image_paths) - len(changed_paths)
+            image_paths = changed_paths
+            logger.info(f"Skipping {skipped_count} unchanged images, {len(image_paths)} to process")
+        
+        processes = min(processes, max(1, len(image_paths)))
+        model_order: List[str] = []
+        if self.session_pool.memory_budget is not None or prewarm or processes > 1:
+            image_models = {path: self._get_model_for_image(path) for path in image_paths}
+            model_order = list(dict.fromkeys(image_models.values()))
+            # Group images by model so each session is loaded once under the
+            # budget, and each worker process needs few sessions
+            image_paths = sorted(image_paths, key=lambda path: model_order.index(image_models[path]))
+            if prewarm and processes == 1:
+                self.session_pool.prewarm(model_order)
+        
+        run_kwargs = dict(workers=workers, queue_depth=queue_depth,
+                          batch_size=batch_size, batch_max_wait=batch_max_wait)
+        if workers > 1 or batch_size > 1:
+            logger.info(f"Using pipelined mode with {workers} workers, queue depth {queue_depth}, "
+                       f"batch size {batch_size}")
+        try:
+            if processes > 1:
+                processed_count, error_count = self._process_sharded(
+                    image_paths, processes, model_order if prewarm else [], **run_kwargs
+                )
+            else:
+                processed_count, error_count = self._process_paths(image_paths, **run_kwargs)
+        finally:
+            self.manifest.save()
+        
+        elapsed = time.perf_counter() - start_time
+        images_per_sec = processed_count / elapsed if elapsed > 0 else 0.0
         logger.info(f"Directory processing complete. "
-                   f"Processed: {processed_count}, Errors: {error_count}")
+                   f"Processed: {processed_count}, Skipped: {skipped_count}, Errors: {error_count}, "
+                   f"Elapsed: {elapsed:.2f}s ({images_per_sec:.2f} images/sec)")
+        if processes == 1:
+            logger.info(f"Session pool stats: {self.session_pool.stats()}")
+            if self.mask_cache is not None:
+                logger.info(f"Mask cache stats: {self.mask_cache.stats()}")
+            if self.latency_budget.budget_seconds is not None:
+                logger.info(f"Latency budget stats: {self.latency_budget.stats()}")
+        self._export_metrics(run={
+            "processed": processed_count,
+            "skipped": skipped_count,
+            "errors": error_count,
+            "elapsed_seconds": elapsed,
+            "images_per_sec": images_per_sec,
+        })
+    
+    def _export_metrics(self, **extra):
+        """Write the per-stage metrics to the JSON file and, if set, the Prometheus file"""
+        try:
+            self.metrics.write_json(self.metrics_path, **extra)
+            if self.prometheus_path is not None:
+                self.metrics.write_prometheus(self.prometheus_path)
+        except OSError as e:
+            logger.warning(f"Could not write stage metrics: {str(e)}")
+
+    def _composite_export(self, image: PIL.Image.Image, mask: PIL.Image.Image,
+                          bgcolor: Optional[Tuple[int, ...]], image_format: str,
+                          trim: bool) -> PIL.Image.Image:
+        """Composite an exported image from its mask"""
+        if mask.size != image.size:
+            raise ValueError(f"Cached mask size {mask.size} does not match the image size {image.size}")
+        if bgcolor is None:
+            output_image = naive_cutout(image, mask)
+        else:
+            output_image = PIL.Image.new("RGBA", image.size, bgcolor)
+            output_image.paste(image.convert("RGB"), mask=mask)
+        if trim:
+            bbox = mask.getbbox()
+            if bbox is not None:
+                output_image = output_image.crop(bbox)
+        if image_format == "jpeg":
+            output_image = output_image.convert("RGB")
+        return output_image
+    
+    def export(self, output_dir: str, bgcolor: Optional[Tuple[int, ...]] = None,
+               image_format: str = "png", trim: bool = False, workers: int = 1) -> Tuple[int, int]:
+        """
+        Export the images of the input directory from their cached masks only
+        
+        No model session is loaded: images without a cached mask for their
+        model are reported and skipped, so re-exports are bound by decoding
+        and encoding rather than inference.
+        
+        Args:
+            output_dir (str): Directory the exported images are written to, as
+                <input stem>.<format extension>
+            bgcolor (Optional[Tuple[int, ...]]): Background color (RGB or RGBA),
+                None for a transparent background. JPEG defaults to white
+            image_format (str): One of EXPORT_FORMATS
+            trim (bool): Crop the canvas to the bounding box of the mask
+            workers (int): Number of export threads
+            
+        Returns:
+            Tuple[int, int]: Number of exported images and number of images
+            that were missing a mask or failed
+        """
+        if self.mask_cache is None:
+            raise ValueError("Exporting requires a mask cache directory")
+        if image_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{image_format}', expected one of {list(EXPORT_FORMATS)}")
+        if image_format == "jpeg" and bgcolor is None:
+            bgcolor = (255, 255, 255)
+        
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Exporting {self.input_dir} from cached masks to {output_dir}")
+        start_time = time.perf_counter()
+        self.metrics.drain()
+        
+        def export_one(input_path: Path) -> str:
+            model_name = self._get_model_for_image(input_path)
+            try:
+                mask = self._cached_mask(input_path, model_name)
+                if mask is None and self.large_image_pixels is not None:
+                    # Large images processed on the fast path
+                    mask = self._cached_mask(input_path, model_name, large=True)
+                if mask is None:
+                    logger.warning(f"No cached mask for {input_path.name} with model '{model_name}', skipping")
+                    return "missing"
+                with self.metrics.time(model_name, "decode", input_path.name) as stage:
+                    image = fix_image_orientation(PIL.Image.open(input_path))
+                    stage["bytes"] = input_path.stat().st_size
+                with self.metrics.time(model_name, "postprocess", input_path.name) as stage:
+                    output_image = self._composite_export(image, mask, bgcolor, image_format, trim)
+                    stage["bytes"] = output_image.width * output_image.height * len(output_image.getbands())
+                output_path = output_dir / f"{input_path.stem}.{EXPORT_FORMATS[image_format]}"
+                self._save_output(output_image, output_path, model_name, input_path.name)
+                return "exported"
+            except Exception as e:
+                logger.error(f"Error exporting {input_path.name}: {str(e)}")
+                return "errors"
+        
+        # Decoding and encoding release the GIL, so threads scale for this I/O-bound work
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(export_one, self._list_images()))
+        
+        exported_count = results.count("exported")
+        missing_count = results.count("missing")
+        error_count = results.count("errors")
+        elapsed = time.perf_counter() - start_time
+        images_per_sec = exported_count / elapsed if elapsed > 0 else 0.0
+        logger.info(f"Export complete. Exported: {exported_count}, Missing masks: {missing_count}, "
+                   f"Errors: {error_count}, Elapsed: {elapsed:.2f}s ({images_per_sec:.2f} images/sec)")
+        self._export_metrics(run={
+            "mode": "export",
+            "exported": exported_count,
+            "missing_masks": missing_count,
+            "errors": error_count,
+            "elapsed_seconds": elapsed,
+            "images_per_sec": images_per_sec,
+        })
+        return exported_count, missing_count + error_count
+    
+    def _snapshot(self) -> Dict[Path, Tuple[int, int]]:
+        """Get the size and modification time of every input image"""
+        snapshot = {}
+        with os.scandir(self.input_dir) as entries:
+            for entry in entries:
+                file_path = Path(entry.path)
+                if entry.is_file() and self._is_input_image(file_path):
+                    stat = entry.stat()
+                    snapshot[file_path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+    
+    def _start_observer(self, events: "queue.Queue[Path]"):
+        """
+        Start an inotify-backed watchdog observer on the input directory
+        
+        Args:
+            events (queue.Queue[Path]): Queue receiving the paths of created,
+                modified or moved-in files
+            
+        Returns:
+            The started observer, or None if watchdog or inotify is unavailable
+        """
+        if Observer is None:
+            logger.info("watchdog is not installed, falling back to polling")
+            return None
+        
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                events.put(Path(getattr(event, 'dest_path', '') or event.src_path))
+        
+        observer = Observer()
+        try:
+            observer.schedule(Handler(), str(self.input_dir), recursive=False)
+            observer.start()
+        except OSError as e:
+            # e.g. the inotify watch limit is reached
+            logger.warning(f"Could not start file system observer ({e}), falling back to polling")
+            return None
+        logger.info(f"Watching {self.input_dir} with {type(observer).__name__}")
+        return observer
+    
+    def watch(self, poll_interval: float = 1.0, debounce: float = 2.0,
+              use_inotify: bool = True, **directory_kwargs):
+        """
+        Process the directory, then keep processing images as they arrive
+        
+        Sessions stay loaded between files. A new or changed file is processed
+        once its size and modification time have been stable for `debounce`
+        seconds, so partially written uploads are not picked up. Files whose
+        content did not change according to the manifest are skipped.
+        The metrics keep the per image breakdown of the last
+        WATCH_METRICS_IMAGES images only. Runs until interrupted.
+        
+        Args:
+            poll_interval (float): Seconds between checks for changed files
+            debounce (float): Seconds a file must stay unchanged before processing
+            use_inotify (bool): Use inotify through watchdog when available,
+                otherwise poll the directory
+            **directory_kwargs: Arguments for the initial process_directory() pass
+        """
+        self.metrics.max_images = WATCH_METRICS_IMAGES
+        self.process_directory(**directory_kwargs)
+        
+        events: "queue.Queue[Path]" = queue.Queue()
+        observer = self._start_observer(events) if use_inotify else None
+        snapshot = None
+        if observer is None:
+            logger.info(f"Watching {self.input_dir} by polling every {poll_interval}s")
+            snapshot = self._snapshot()
+        
+        # Changed files waiting to settle: last observed (size, mtime) and since when
+        pending: Dict[Path, Optional[Tuple[Tuple[int, int], float]]] = {}
+        try:
+            while True:
+                time.sleep(poll_interval)
+                
+                changed = set()
+                while not events.empty():
+                    changed.add(events.get_nowait())
+                if snapshot is not None:
+                    current = self._snapshot()
+                    changed.update(path for path, sig in current.items() if snapshot.get(path) != sig)
+                    snapshot = current
+                for file_path in changed:
+                    if self._is_input_image(file_path):
+                        pending[file_path] = None
+                
+                now = time.monotonic()
+                ready = []
+                for file_path, last_seen in list(pending.items()):
+                    try:
+                        stat = file_path.stat()
+                    except FileNotFoundError:
+                        del pending[file_path]
+                        continue
+                    sig = (stat.st_size, stat.st_mtime_ns)
+                    if last_seen is None or last_seen[0] != sig:
+                        pending[file_path] = (sig, now)
+                    elif now - last_seen[1] >= debounce:
+                        ready.append(file_path)
+                        del pending[file_path]
+                
+                if ready:
+                    changed_paths = self._select_changed(sorted(ready))
+                    # The whole batch of ready files counts as backlog for the latency budget
+                    for _ in changed_paths:
+                        self.latency_budget.begin()
+                    for file_path in changed_paths:
+                        try:
+                            self.process_image(file_path)
+                        finally:
+                            self.latency_budget.end()
+                    self.manifest.save()
+                    self._export_metrics()
+        except KeyboardInterrupt:
+            logger.info("Stopping watch mode")
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            self.manifest.save()
+            logger.info(f"Session pool stats: {self.session_pool.stats()}")
+
+
+def parse_color(value: str) -> Tuple[int, ...]:
+    """Parse a color given as R,G,B[,A] or in any format PIL understands (e.g. #ffffff, white)"""
+    try:
+        if ',' in value:
+            color = tuple(int(part) for part in value.split(','))
+            if len(color) not in (3, 4) or not all(0 <= c <= 255 for c in color):
+                raise ValueError(value)
+            return color
+        return PIL.ImageColor.getcolor(value, "RGBA")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid color: {value}")
+
 
 def main():
     parser = argparse.ArgumentParser(description='Remove background from images in a directory')
     parser.add_argument('input_dir', help='Input directory containing images')
     parser.add_argument('--model', default='u2net', 
                       help='Default model to use (default: u2net)')
+    parser.add_argument('--workers', type=int, default=1,
+                      help='Decode/encode threads; values above 1 enable the pipelined mode (default: 1)')
+    parser.add_argument('--queue-depth', type=int, default=8,
+                      help='Maximum images buffered between pipeline stages (default: 8)')
+    parser.add_argument('--processes', type=int, default=1,
+                      help='Worker processes the images are sharded across, each with its own sessions (default: 1)')
+    parser.add_argument('--intra-op-threads', type=int, default=None,
+                      help='ONNX Runtime intra-op threads per session (default: ONNX Runtime default, '
+                           'or the CPUs divided by --processes)')
+    parser.add_argument('--inter-op-threads', type=int, default=None,
+                      help='ONNX Runtime inter-op threads per session (default: sequential execution)')
+    parser.add_argument('--batch-size', type=int, default=1,
+                      help='Images per batched inference run for the same model (default: 1)')
+    parser.add_argument('--batch-max-wait', type=float, default=0.1,
+                      help='Maximum seconds an image waits for its batch to fill (default: 0.1)')
+    parser.add_argument('--force', action='store_true',
+                      help='Reprocess all images, ignoring the manifest of previous runs')
+    parser.add_argument('--memory-budget-mb', type=float, default=None,
+                      help='Memory budget for loaded model sessions in MiB (default: no limit)')
+    parser.add_argument('--budget-mode', choices=['model-size', 'rss'], default='model-size',
+                      help='Measure the budget by loaded model file size or process RSS (default: model-size)')
+    parser.add_argument('--prewarm', action='store_true',
+                      help='Load the sessions needed by the directory before processing')
+    parser.add_argument('--large-image-mp', type=float, default=None,
+                      help='Megapixels above which images are inferred on a downscaled copy (default: disabled)')
+    parser.add_argument('--large-image-max-side', type=int, default=1024,
+                      help='Longest side of the downscaled copy for large images (default: 1024)')
+    parser.add_argument('--large-image-compare', action='store_true',
+                      help='Also run the standard path on large images and report the difference')
+    parser.add_argument('--model-variant', choices=MODEL_VARIANTS, default='optimized',
+                      help='Model files to load: files pre-optimized by optimize_models.py when present, '
+                           'their int8 quantized variant, or the original files (default: optimized)')
+    parser.add_argument('--latency-budget-ms', type=float, default=None,
+                      help='Per-image latency budget above which routing rules fall back to faster '
+                           'models (default: _latency_budget_ms in config.json, or none)')
+    parser.add_argument('--metrics-file', default=None,
+                      help='JSON file for the per-stage timing metrics (default: <input_dir>/rembg_metrics.json)')
+    parser.add_argument('--prometheus-file', default=None,
+                      help='Also write the metrics in the Prometheus text format to this file')
+    parser.add_argument('--mask-cache', nargs='?', const='', default=None, metavar='DIR',
+                      help=f'Cache predicted masks and reuse them instead of running inference '
+                           f'(default directory: <input_dir>/{MASK_CACHE_DIRNAME})')
+    parser.add_argument('--export', default=None, metavar='OUTPUT_DIR',
+                      help='Export the images from cached masks only, without running inference')
+    parser.add_argument('--bgcolor', type=parse_color, default=None,
+                      help='Export background color as R,G,B[,A] or e.g. "#ffffff" (default: transparent)')
+    parser.add_argument('--format', dest='image_format', choices=list(EXPORT_FORMATS), default='png',
+                      help='Export image format (default: png)')
+    parser.add_argument('--trim', action='store_true',
+                      help='Crop exported images to the bounding box of the mask')
+    parser.add_argument('--watch', action='store_true',
+                      help='Keep running and process new or changed images as they arrive')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                      help='Seconds between checks for changed files in watch mode (default: 1.0)')
+    parser.add_argument('--debounce', type=float, default=2.0,
+                      help='Seconds a file must stay unchanged before it is processed (default: 2.0)')
+    parser.add_argument('--polling', action='store_true',
+                      help='Poll the directory in watch mode instead of using inotify')
     
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.queue_depth < 1:
+        parser.error("--queue-depth must be at least 1")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.processes < 1:
+        parser.error("--processes must be at least 1")
+    if args.batch_max_wait < 0:
+        parser.error("--batch-max-wait must not be negative")
+    
+    mask_cache_dir = args.mask_cache
+    if mask_cache_dir == '' or (mask_cache_dir is None and args.export):
+        mask_cache_dir = str(Path(args.input_dir) / MASK_CACHE_DIRNAME)
     
     try:
-        processor = ImageProcessor(args.input_dir, args.model)
-        processor.process_directory()
+        processor = ImageProcessor(args.input_dir, args.model,
+                                   memory_budget_mb=args.memory_budget_mb,
+                                   budget_mode=args.budget_mode,
+                                   large_image_pixels=(int(args.large_image_mp * 1_000_000)
+                                                       if args.large_image_mp else None),
+                                   large_image_max_side=args.large_image_max_side,
+                                   large_image_compare=args.large_image_compare,
+                                   intra_op_num_threads=args.intra_op_threads,
+                                   inter_op_num_threads=args.inter_op_threads,
+                                   metrics_path=args.metrics_file,
+                                   prometheus_path=args.prometheus_file,
+                                   mask_cache_dir=mask_cache_dir,
+                                   latency_budget_ms=args.latency_budget_ms,
+                                   model_variant=args.model_variant)
+        directory_kwargs = dict(
+            workers=args.workers,
+            queue_depth=args.queue_depth,
+            batch_size=args.batch_size,
+            batch_max_wait=args.batch_max_wait,
+            force=args.force,
+            prewarm=args.prewarm,
+            processes=args.processes,
+        )
+        if args.export:
+            processor.export(args.export, bgcolor=args.bgcolor, image_format=args.image_format,
+                             trim=args.trim, workers=args.workers)
+        elif args.watch:
+            # Stop cleanly under service managers so the manifest gets saved
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            processor.watch(
+                poll_interval=args.poll_interval,
+                debounce=args.debounce,
+                use_inotify=not args.polling,
+                **directory_kwargs,
+            )
+        else:
+            processor.process_directory(**directory_kwargs)
     except Exception as e:
         logger.error(f"Application error: {str(e)}")
         sys.exit(1)
@@ -0,0 +1,225 @@
+import io
+import sys
+import asyncio
+import logging
+import argparse
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import PIL.Image
+import uvicorn
+from fastapi import FastAPI, File, HTTPException, Query, UploadFile
+from fastapi.responses import Response
+
+from rembg_python import ImageProcessor
+from session_pool import MODEL_VARIANTS
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Gathers concurrent requests for one model into micro-batches"""
+
+    def __init__(self, processor: ImageProcessor, model_name: str, only_mask: bool,
+                 executor: ThreadPoolExecutor, max_batch_size: int, max_latency: float):
+        """
+        Initialize the batcher
+
+        Args:
+            processor (ImageProcessor): Processor running the inference
+            model_name (str): Model the batches are run with
+            only_mask (bool): Return alpha masks instead of cut-out images
+            executor (ThreadPoolExecutor): Executor the inference runs on
+            max_batch_size (int): Maximum number of images per batch
+            max_latency (float): Maximum seconds the first request of a batch
+                waits for more requests to join
+        """
+        self.processor = processor
+        self.model_name = model_name
+        self.only_mask = only_mask
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self._queue: "asyncio.Queue[Tuple[PIL.Image.Image, asyncio.Future]]" = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, image: PIL.Image.Image) -> PIL.Image.Image:
+        """Queue an image and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, future))
+        return await future
+
+    async def _run(self):
+        """Collect and run batches until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            images = [image for image, _ in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.processor._remove_batch,
+                    self.model_name, images, self.only_mask,
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def close(self):
+        """Stop collecting batches"""
+        self._task.cancel()
+
+
+def _decode(data: bytes) -> PIL.Image.Image:
+    """Decode an uploaded image"""
+    image = PIL.Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def _encode_png(image: PIL.Image.Image) -> bytes:
+    """Encode an image as PNG"""
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def create_app(processor: ImageProcessor, max_batch_size: int = 8, max_latency: float = 0.02,
+               max_concurrency: int = 64, prewarm: Optional[List[str]] = None) -> FastAPI:
+    """
+    Create the background removal server
+
+    Args:
+        processor (ImageProcessor): Processor holding the model sessions and config
+        max_batch_size (int): Maximum number of images per inference batch
+        max_latency (float): Maximum seconds a request waits for its batch to fill
+        max_concurrency (int): Maximum number of requests decoded or queued at once
+        prewarm (Optional[List[str]]): Models to load at startup
+
+    Returns:
+        FastAPI: The application
+    """
+    # A single inference thread: ONNX Runtime parallelizes each run internally
+    inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rembg-inference")
+    batchers: Dict[Tuple[str, bool], MicroBatcher] = {}
+
+    def get_batcher(model_name: str, only_mask: bool) -> MicroBatcher:
+        key = (model_name, only_mask)
+        if key not in batchers:
+            batchers[key] = MicroBatcher(processor, model_name, only_mask, inference_executor,
+                                         max_batch_size, max_latency)
+        return batchers[key]
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # Created here so it binds to the server's event loop
+        app.state.slots = asyncio.Semaphore(max_concurrency)
+        if prewarm:
+            await asyncio.get_running_loop().run_in_executor(
+                inference_executor, processor.session_pool.prewarm, prewarm
+            )
+        yield
+        for batcher in batchers.values():
+            batcher.close()
+        inference_executor.shutdown(wait=False)
+
+    app = FastAPI(title="rembg server", lifespan=lifespan)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "sessions": processor.session_pool.stats()}
+
+    @app.post("/remove")
+    async def remove_background(
+        file: UploadFile = File(...),
+        model: Optional[str] = Query(None, description="Model name, defaults to config.json or the default model"),
+        only_mask: bool = Query(False, description="Return the alpha mask instead of the cut-out image"),
+    ):
+        if model and not (processor.models_dir / f"{model}.onnx").exists():
+            raise HTTPException(status_code=404, detail=f"Model not found: {model}")
+
+        async with app.state.slots:
+            data = await file.read()
+            try:
+                image = await asyncio.to_thread(_decode, data)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Invalid image: {str(e)}")
+
+            # Routing rules may depend on the image size, known once decoded
+            model_name = model or processor._get_model_for_image(Path(file.filename or ""), image.size)
+            if not (processor.models_dir / f"{model_name}.onnx").exists():
+                raise HTTPException(status_code=404, detail=f"Model not found: {model_name}")
+
+            try:
+                result = await get_batcher(model_name, only_mask).submit(image)
+            except Exception as e:
+                logger.error(f"Error processing {file.filename}: {str(e)}")
+                raise HTTPException(status_code=500, detail=str(e))
+
+            png = await asyncio.to_thread(_encode_png, result)
+        return Response(content=png, media_type="image/png")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve background removal over HTTP')
+    parser.add_argument('--config-dir', default='.',
+                      help='Directory containing config.json for per-file model selection (default: .)')
+    parser.add_argument('--model', default='u2net',
+                      help='Default model to use (default: u2net)')
+    parser.add_argument('--host', default='127.0.0.1',
+                      help='Host to bind (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=7000,
+                      help='Port to bind (default: 7000)')
+    parser.add_argument('--batch-size', type=int, default=8,
+                      help='Maximum images per inference batch (default: 8)')
+    parser.add_argument('--max-latency-ms', type=float, default=20,
+                      help='Maximum milliseconds a request waits for its batch to fill (default: 20)')
+    parser.add_argument('--max-concurrency', type=int, default=64,
+                      help='Maximum requests decoded or queued at once (default: 64)')
+    parser.add_argument('--memory-budget-mb', type=float, default=None,
+                      help='Memory budget for loaded model sessions in MiB (default: no limit)')
+    parser.add_argument('--model-variant', choices=MODEL_VARIANTS, default='optimized',
+                      help='Model files to load, see optimize_models.py (default: optimized)')
+    parser.add_argument('--prewarm', nargs='*', default=None,
+                      help='Models to load at startup')
+
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
+    try:
+        processor = ImageProcessor(args.config_dir, args.model, memory_budget_mb=args.memory_budget_mb,
+                                   model_variant=args.model_variant)
+    except Exception as e:
+        logger.error(f"Application error: {str(e)}")
+        sys.exit(1)
+
+    app = create_app(
+        processor,
+        max_batch_size=args.batch_size,
+        max_latency=args.max_latency_ms / 1000,
+        max_concurrency=args.max_concurrency,
+        prewarm=args.prewarm,
+    )
+    uvicorn.run(app, host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+import os
+import gc
+import json
+import logging
+import resource
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import onnxruntime as ort
+from rembg.sessions import sessions
+
+logger = logging.getLogger(__name__)
+
+BUDGET_MODES = ("model-size", "rss")
+
+# Model files written by optimize_models.py, preferred over the originals
+MODEL_VARIANTS = ("original", "optimized", "int8")
+OPTIMIZED_DIRNAME = "optimized"
+OPTIMIZED_INDEX = "index.json"
+
+
+def optimized_cache_dir(models_dir: Path) -> Path:
+    """Get the optimized model directory, versioned by the ONNX Runtime release that wrote it"""
+    return Path(models_dir) / OPTIMIZED_DIRNAME / ort.__version__
+
+
+def load_optimized_index(cache_dir: Path) -> Dict[str, Dict[str, Any]]:
+    """Load the entries of the optimized models, empty if there are none"""
+    try:
+        with open(cache_dir / OPTIMIZED_INDEX, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Ignoring unreadable optimized model index in {cache_dir}: {e}")
+        return {}
+
+
+def resolve_model_file(models_dir: Path, model_name: str, variant: str = "optimized") -> Tuple[Path, str]:
+    """
+    Get the model file to load for a variant
+
+    Cached variants are only used if they were produced by this ONNX Runtime
+    version from the current original file (same size and modification time).
+    "int8" falls back to "optimized", which falls back to the original.
+
+    Args:
+        models_dir (Path): Directory containing the <model_name>.onnx files
+        model_name (str): Model name
+        variant (str): One of MODEL_VARIANTS
+
+    Returns:
+        Tuple[Path, str]: The file, and the variant it actually is. Any
+        variant other than "original" has its graph already optimized
+    """
+    original = Path(models_dir) / f"{model_name}.onnx"
+    if variant == "original":
+        return original, "original"
+
+    cache_dir = optimized_cache_dir(models_dir)
+    entry = load_optimized_index(cache_dir).get(model_name)
+    if entry is not None:
+        stat = original.stat()
+        if entry["source_size"] == stat.st_size and entry["source_mtime_ns"] == stat.st_mtime_ns:
+            for candidate in (("int8", "optimized") if variant == "int8" else ("optimized",)):
+                file_name = entry.get(candidate)
+                if file_name and (cache_dir / file_name).exists():
+                    return cache_dir / file_name, candidate
+        else:
+            logger.info(f"Optimized files of {model_name} are stale, run optimize_models.py again")
+    return original, "original"
+
+
+def current_rss_bytes() -> int:
+    """Get the resident set size of the current process"""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs (e.g. macOS): fall back to the peak RSS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    """Get the peak resident set size since the last reset, None without procfs"""
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class PeakRSS:
+    """
+    Context manager measuring the peak resident set size above its start
+
+    On Linux the kernel's high-water mark is reset on entry (clear_refs) and
+    read on exit, so short spikes are caught. Elsewhere a thread samples the
+    RSS every `interval` seconds. The RSS covers the whole process, so work
+    done concurrently by other threads is included.
+    """
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._baseline = 0
+        self._sampled = 0
+        self._stop: Optional[threading.Event] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._sampled = max(self._sampled, current_rss_bytes())
+
+    def __enter__(self) -> "PeakRSS":
+        self._baseline = current_rss_bytes()
+        try:
+            with open("/proc/self/clear_refs", 'w') as f:
+                f.write("5")
+            kernel_peak = _peak_rss_bytes() is not None
+        except OSError:
+            kernel_peak = False
+        if not kernel_peak:
+            self._sampled = self._baseline
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._sample, name="rembg-peak-rss", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is None:
+            peak = _peak_rss_bytes()
+        else:
+            self._stop.set()
+            self._thread.join()
+            peak = max(self._sampled, current_rss_bytes())
+        self.peak_bytes = max(peak - self._baseline, 0)
+        return False
+
+
+def create_session(model_name: str, model_path: Path,
+                   intra_op_num_threads: Optional[int] = None,
+                   inter_op_num_threads: Optional[int] = None,
+                   preoptimized: bool = False):
+    """
+    Create a rembg session from an explicit model file
+
+    Unlike new_session(), the given file is loaded instead of the copy in
+    rembg's download cache, and ONNX Runtime thread counts can be set.
+
+    Args:
+        model_name (str): rembg model name, selecting the pre/postprocessing
+        model_path (Path): ONNX file to load
+        intra_op_num_threads (Optional[int]): Threads used inside an operator,
+            None for the ONNX Runtime default
+        inter_op_num_threads (Optional[int]): Threads used to run independent
+            operators in parallel, None to run them sequentially
+        preoptimized (bool): The file was already optimized offline, skip the
+            graph optimizations at load time
+
+    Returns:
+        The rembg session
+    """
+    session_class = sessions.get(model_name)
+    if session_class is None:
+        raise ValueError(f"Unknown rembg model: {model_name}")
+
+    class LocalModelSession(session_class):
+        @classmethod
+        def download_models(cls, *args, **kwargs):
+            return str(model_path)
+
+    sess_opts = ort.SessionOptions()
+    if intra_op_num_threads:
+        sess_opts.intra_op_num_threads = intra_op_num_threads
+    if inter_op_num_threads:
+        sess_opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        sess_opts.inter_op_num_threads = inter_op_num_threads
+    if preoptimized:
+        sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+    return LocalModelSession(model_name, sess_opts)
+
+
+class SessionPool:
+    """LRU pool of rembg model sessions kept under a memory budget"""
+
+    def __init__(self, models_dir: Path, memory_budget_mb: Optional[float] = None,
+                 budget_mode: str = "model-size", intra_op_num_threads: Optional[int] = None,
+                 inter_op_num_threads: Optional[int] = None, model_variant: str = "optimized"):
+        """
+        Initialize the session pool
+
+        Args:
+            models_dir (Path): Directory containing the <model_name>.onnx files
+            memory_budget_mb (Optional[float]): Memory budget in MiB, None for no limit
+            budget_mode (str): "model-size" budgets the summed size of the resident
+                model files, "rss" budgets the resident set size of the process
+            intra_op_num_threads (Optional[int]): ONNX Runtime intra-op threads
+                per session, None for the default
+            inter_op_num_threads (Optional[int]): ONNX Runtime inter-op threads
+                per session, None for sequential execution
+            model_variant (str): Model files to prefer, one of MODEL_VARIANTS.
+                Variants not produced by optimize_models.py fall back to the
+                original files
+        """
+        if budget_mode not in BUDGET_MODES:
+            raise ValueError(f"Unknown budget mode '{budget_mode}', expected one of {BUDGET_MODES}")
+        if model_variant not in MODEL_VARIANTS:
+            raise ValueError(f"Unknown model variant '{model_variant}', expected one of {MODEL_VARIANTS}")
+
+        self.models_dir = Path(models_dir)
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024) if memory_budget_mb else None
+        self.budget_mode = budget_mode
+        self.intra_op_num_threads = intra_op_num_threads
+        self.inter_op_num_threads = inter_op_num_threads
+        self.model_variant = model_variant
+        self._sessions: "OrderedDict[str, Any]" = OrderedDict()
+        self._model_sizes: Dict[str, int] = {}
+        self._variants: Dict[str, str] = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, model_name: str) -> bool:
+        return model_name in self._sessions
+
+    def _model_path(self, model_name: str) -> Path:
+        """Get the model file path, checking that it exists"""
+        model_path = self.models_dir / f"{model_name}.onnx"
+        if not model_path.exists():
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+        return model_path
+
+    def _resident_model_bytes(self) -> int:
+        """Get the summed file size of the resident models"""
+        return sum(self._model_sizes[name] for name in self._sessions)
+
+    def _used_bytes(self) -> int:
+        """Get the memory usage measured against the budget"""
+        if self.budget_mode == "rss":
+            return current_rss_bytes()
+        return self._resident_model_bytes()
+
+    def _evict_lru(self, keep: Optional[str] = None) -> bool:
+        """Evict the least recently used session other than `keep`"""
+        for model_name in self._sessions:
+            if model_name != keep:
+                del self._sessions[model_name]
+                self.evictions += 1
+                # Release the ONNX Runtime buffers before memory is measured again
+                gc.collect()
+                logger.info(f"Evicted session for model: {model_name}")
+                return True
+        return False
+
+    def _make_room(self, incoming_bytes: int, keep: Optional[str] = None):
+        """Evict sessions until `incoming_bytes` more fit in the budget"""
+        if self.memory_budget is None:
+            return
+        while self._used_bytes() + incoming_bytes > self.memory_budget:
+            if not self._evict_lru(keep=keep):
+                logger.warning(f"Memory budget of {self.memory_budget / 2**20:.0f} MiB exceeded "
+                               f"with no session left to evict")
+                return
+
+    def get(self, model_name: str):
+        """
+        Get the session of a model, creating it if needed
+
+        Args:
+            model_name (str): Model name
+
+        Returns:
+            The rembg session of the model
+        """
+        with self._lock:
+            if model_name in self._sessions:
+                self._sessions.move_to_end(model_name)
+                self.hits += 1
+                return self._sessions[model_name]
+
+            self.misses += 1
+            self._model_path(model_name)
+            model_path, variant = resolve_model_file(self.models_dir, model_name, self.model_variant)
+            model_size = model_path.stat().st_size
+            self._make_room(model_size)
+
+            logger.info(f"Creating new session for model: {model_name} from {model_path}")
+            self._sessions[model_name] = create_session(
+                model_name, model_path, self.intra_op_num_threads, self.inter_op_num_threads,
+                variant != "original",
+            )
+            self._model_sizes[model_name] = model_size
+            self._variants[model_name] = variant
+            if self.budget_mode == "rss":
+                # The actual footprint is only known once the session is loaded
+                self._make_room(0, keep=model_name)
+            return self._sessions[model_name]
+
+    def resolved_variant(self, model_name: str) -> str:
+        """
+        Get the variant a model's masks are predicted with
+
+        This is the variant of the loaded session, or the one the session
+        would be loaded from. Masks and outputs depend on it (int8 masks
+        differ from the original model's), so it is part of their cache keys.
+
+        Args:
+            model_name (str): Model name
+
+        Returns:
+            str: One of MODEL_VARIANTS
+        """
+        with self._lock:
+            variant = self._variants.get(model_name)
+            if variant is None:
+                try:
+                    _, variant = resolve_model_file(self.models_dir, model_name, self.model_variant)
+                except FileNotFoundError:
+                    # Processing fails on the missing file anyway, don't remember it
+                    return self.model_variant
+                self._variants[model_name] = variant
+            return variant
+
+    def prewarm(self, model_names: Iterable[str]):
+        """
+        Create the sessions of the given models ahead of use
+
+        Models are loaded in the given order as long as they fit in the budget
+        without evicting another session.
+
+        Args:
+            model_names (Iterable[str]): Models to load
+        """
+        with self._lock:
+            for model_name in model_names:
+                if model_name in self._sessions:
+                    continue
+                try:
+                    self._model_path(model_name)
+                    model_path, _ = resolve_model_file(self.models_dir, model_name, self.model_variant)
+                    model_size = model_path.stat().st_size
+                except FileNotFoundError as e:
+                    logger.error(f"Cannot prewarm model '{model_name}': {str(e)}")
+                    continue
+                if self.memory_budget is not None and self._used_bytes() + model_size > self.memory_budget:
+                    logger.info(f"Stopping prewarm before '{model_name}': memory budget reached")
+                    break
+                # Prewarming is not a lookup, keep it out of the hit/miss counters
+                self.get(model_name)
+                self.misses -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the pool counters"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "resident_models": list(self._sessions),
+                "resident_model_bytes": self._resident_model_bytes(),
+                "rss_bytes": current_rss_bytes(),
+            }
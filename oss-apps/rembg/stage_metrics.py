@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Processing stages, in pipeline order
+STAGES = ("decode", "preprocess", "inference", "postprocess", "encode")
+
+
+class StageMetrics:
+    """Per-stage durations and byte sizes, per image and per model"""
+
+    def __init__(self, max_samples: int = 10000, max_images: Optional[int] = None):
+        """
+        Initialize the metrics
+
+        Args:
+            max_samples (int): Number of most recent durations kept per model
+                and stage for the percentiles, so long-running processes stay
+                bounded. Counts and totals cover every recorded duration
+            max_images (Optional[int]): Number of most recently recorded images
+                kept in the per image breakdown, None to keep all of them.
+                Image counts cover every recorded image
+        """
+        self.max_samples = max_samples
+        self.max_images = max_images
+        self._lock = threading.Lock()
+        # (model, stage) -> count, total seconds, max seconds, bytes and recent durations
+        self._stages: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # image name -> model, seconds and bytes per stage, least recently recorded first
+        self._images: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # model -> number of images recorded
+        self._image_counts: Dict[str, int] = {}
+
+    def _stage(self, key: Tuple[str, str]) -> Dict[str, Any]:
+        """Get the totals of a model and stage, creating them if needed"""
+        if key not in self._stages:
+            self._stages[key] = {"count": 0, "seconds": 0.0, "max": 0.0, "bytes": 0,
+                                 "recent": deque(maxlen=self.max_samples)}
+        return self._stages[key]
+
+    def record(self, model_name: str, stage: str, seconds: float, nbytes: int = 0,
+               image_name: Optional[str] = None):
+        """
+        Record the time spent in a stage
+
+        Args:
+            model_name (str): Model the image is processed with
+            stage (str): One of STAGES
+            seconds (float): Time spent in the stage
+            nbytes (int): Size of the data the stage produced
+            image_name (Optional[str]): Input file name, None when the work is
+                not tied to a file (e.g. server requests)
+        """
+        with self._lock:
+            totals = self._stage((model_name, stage))
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            totals["max"] = max(totals["max"], seconds)
+            totals["bytes"] += nbytes
+            totals["recent"].append(seconds)
+            if image_name is not None:
+                image = self._images.get(image_name)
+                if image is None:
+                    image = self._images[image_name] = {"model": model_name, "seconds": {}, "bytes": {}}
+                    self._image_counts[model_name] = self._image_counts.get(model_name, 0) + 1
+                    self._trim_images()
+                else:
+                    self._images.move_to_end(image_name)
+                image["seconds"][stage] = image["seconds"].get(stage, 0.0) + seconds
+                image["bytes"][stage] = image["bytes"].get(stage, 0) + nbytes
+
+    def _trim_images(self):
+        """Drop the least recently recorded images beyond max_images"""
+        if self.max_images is not None:
+            while len(self._images) > self.max_images:
+                self._images.popitem(last=False)
+
+    def record_batch(self, model_name: str, stage: str, seconds: float, nbytes: int,
+                     image_names: List[Optional[str]]):
+        """Record a stage run once for a batch, splitting it evenly across its images"""
+        for image_name in image_names:
+            self.record(model_name, stage, seconds / len(image_names),
+                        nbytes // len(image_names), image_name)
+
+    @contextmanager
+    def time(self, model_name: str, stage: str, image_name: Optional[str] = None) -> Iterator[Dict[str, int]]:
+        """
+        Time a block as one stage
+
+        Yields a dict whose "bytes" entry the block can set to the size of its output.
+        """
+        result = {"bytes": 0}
+        start = time.perf_counter()
+        try:
+            yield result
+        finally:
+            self.record(model_name, stage, time.perf_counter() - start, result["bytes"], image_name)
+
+    def drain(self) -> Dict[str, Any]:
+        """Get the raw records and clear them, e.g. to hand them to another process"""
+        with self._lock:
+            raw = {"stages": self._stages, "images": self._images, "image_counts": self._image_counts}
+            self._stages, self._images, self._image_counts = {}, OrderedDict(), {}
+        return raw
+
+    def merge(self, raw: Dict[str, Any]):
+        """Add the raw records drained from another instance"""
+        with self._lock:
+            for key, other in raw["stages"].items():
+                totals = self._stage(key)
+                totals["count"] += other["count"]
+                totals["seconds"] += other["seconds"]
+                totals["max"] = max(totals["max"], other["max"])
+                totals["bytes"] += other["bytes"]
+                totals["recent"].extend(other["recent"])
+            self._images.update(raw["images"])
+            for model_name, count in raw["image_counts"].items():
+                self._image_counts[model_name] = self._image_counts.get(model_name, 0) + count
+            self._trim_images()
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Summarize the recorded stages
+
+        Returns:
+            Dict[str, Any]: Per model and stage counts, totals and latency
+            percentiles, plus the per image breakdown (limited to the
+            max_images most recent images, if set)
+        """
+        with self._lock:
+            models: Dict[str, Dict[str, Any]] = {}
+            for (model_name, stage), totals in self._stages.items():
+                recent = np.asarray(totals["recent"]) * 1000
+                models.setdefault(model_name, {"images": 0, "stages": {}})["stages"][stage] = {
+                    "count": totals["count"],
+                    "total_seconds": totals["seconds"],
+                    "mean_ms": totals["seconds"] * 1000 / totals["count"],
+                    "p50_ms": float(np.percentile(recent, 50)),
+                    "p95_ms": float(np.percentile(recent, 95)),
+                    "max_ms": totals["max"] * 1000,
+                    "bytes": totals["bytes"],
+                }
+            for model_name, count in self._image_counts.items():
+                models.setdefault(model_name, {"images": 0, "stages": {}})["images"] += count
+            for model in models.values():
+                model["stages"] = {stage: model["stages"][stage] for stage in STAGES if stage in model["stages"]}
+            return {
+                "generated_at": datetime.now().isoformat(),
+                "images": sum(self._image_counts.values()),
+                "models": models,
+                "per_image": {name: dict(image) for name, image in sorted(self._images.items())},
+            }
+
+    def write_json(self, path: Path, **extra):
+        """Write the summary, plus any extra top-level fields, as JSON atomically"""
+        summary = self.summary()
+        summary.update(extra)
+        _write_atomic(Path(path), json.dumps(summary, indent=2))
+        logger.info(f"Saved stage metrics for {summary['images']} images to {path}")
+
+    def write_prometheus(self, path: Path):
+        """Write the per model and stage totals in the Prometheus text format, e.g. for the node exporter"""
+        summary = self.summary()
+        lines = [
+            "# HELP rembg_stage_duration_seconds Time spent in each processing stage",
+            "# TYPE rembg_stage_duration_seconds summary",
+        ]
+        for model_name, model in sorted(summary["models"].items()):
+            for stage, stats in model["stages"].items():
+                labels = f'model="{model_name}",stage="{stage}"'
+                lines.append(f'rembg_stage_duration_seconds{{{labels},quantile="0.5"}} {stats["p50_ms"] / 1000:.6f}')
+                lines.append(f'rembg_stage_duration_seconds{{{labels},quantile="0.95"}} {stats["p95_ms"] / 1000:.6f}')
+                lines.append(f'rembg_stage_duration_seconds_sum{{{labels}}} {stats["total_seconds"]:.6f}')
+                lines.append(f'rembg_stage_duration_seconds_count{{{labels}}} {stats["count"]}')
+        lines += [
+            "# HELP rembg_stage_bytes_total Bytes produced by each processing stage",
+            "# TYPE rembg_stage_bytes_total counter",
+        ]
+        for model_name, model in sorted(summary["models"].items()):
+            for stage, stats in model["stages"].items():
+                lines.append(f'rembg_stage_bytes_total{{model="{model_name}",stage="{stage}"}} {stats["bytes"]}')
+        lines += [
+            "# HELP rembg_images_total Images processed per model",
+            "# TYPE rembg_images_total counter",
+        ]
+        for model_name, model in sorted(summary["models"].items()):
+            lines.append(f'rembg_images_total{{model="{model_name}"}} {model["images"]}')
+        _write_atomic(Path(path), "\n".join(lines) + "\n")
+        logger.info(f"Saved Prometheus metrics to {path}")
+
+
+def _write_atomic(path: Path, text: str):
+    """Write a file so readers never see it half written"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
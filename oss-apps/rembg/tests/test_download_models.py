@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import download_models
+from download_models import ChecksumError, create_session, download_file
+
+PAYLOAD = os.urandom(256 * 1024 + 123)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves PAYLOAD for any path, honouring single "bytes=<start>-" ranges"""
+
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.headers.get("Range"))
+        data = PAYLOAD
+        range_header = self.headers.get("Range")
+        if range_header:
+            start = int(range_header.split("=", 1)[1].rstrip("-"))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+            data = data[start:]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    RangeHandler.requests_seen = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def session():
+    with create_session(1) as session:
+        yield session
+
+
+def md5(data):
+    return f"md5:{hashlib.md5(data).hexdigest()}"
+
+
+def test_download_renames_part_file(server, session, tmp_path):
+    target = tmp_path / "u2net.onnx"
+    sha256 = download_file(session, server + "u2net.onnx", str(target), md5(PAYLOAD))
+    assert target.read_bytes() == PAYLOAD
+    assert sha256 == hashlib.sha256(PAYLOAD).hexdigest()
+    assert not (tmp_path / "u2net.onnx.part").exists()
+    assert RangeHandler.requests_seen == [None]
+
+
+def test_download_resumes_part_file(server, session, tmp_path):
+    target = tmp_path / "u2net.onnx"
+    (tmp_path / "u2net.onnx.part").write_bytes(PAYLOAD[:100_000])
+    download_file(session, server + "u2net.onnx", str(target), f"sha256:{hashlib.sha256(PAYLOAD).hexdigest()}")
+    assert target.read_bytes() == PAYLOAD
+    assert RangeHandler.requests_seen == ["bytes=100000-"]
+
+
+def test_checksum_mismatch_keeps_no_file(server, session, tmp_path):
+    target = tmp_path / "u2net.onnx"
+    with pytest.raises(ChecksumError):
+        download_file(session, server + "u2net.onnx", str(target), md5(b"something else"))
+    assert not target.exists()
+    assert not (tmp_path / "u2net.onnx.part").exists()
+
+
+def test_corrupt_part_file_is_downloaded_again(server, session, tmp_path):
+    target = tmp_path / "u2net.onnx"
+    (tmp_path / "u2net.onnx.part").write_bytes(b"\0" * 100_000)
+    download_file(session, server + "u2net.onnx", str(target), md5(PAYLOAD))
+    assert target.read_bytes() == PAYLOAD
+    assert RangeHandler.requests_seen == ["bytes=100000-", None]
+
+
+def run_main(monkeypatch, *args):
+    monkeypatch.setattr("sys.argv", ["download_models.py", *args])
+    return download_models.main()
+
+
+def test_main_fails_without_manifest_entry(server, tmp_path, monkeypatch):
+    checksums = tmp_path / "checksums.json"
+    checksums.write_text(json.dumps({"u2net.onnx": md5(PAYLOAD)}))
+    models_dir = tmp_path / "models"
+    with pytest.raises(SystemExit) as exc:
+        run_main(monkeypatch, "--models", "u2net", "u2netp", "--base-url", server,
+                 "--models-dir", str(models_dir), "--checksums", str(checksums))
+    assert exc.value.code != 0
+    assert (models_dir / "u2net.onnx").read_bytes() == PAYLOAD
+    assert not (models_dir / "u2netp.onnx").exists()
+    assert json.loads(checksums.read_text()) == {"u2net.onnx": md5(PAYLOAD)}
+
+
+def test_main_upgrades_verified_md5(server, tmp_path, monkeypatch):
+    checksums = tmp_path / "checksums.json"
+    checksums.write_text(json.dumps({"u2net.onnx": md5(PAYLOAD)}))
+    run_main(monkeypatch, "--models", "u2net", "--base-url", server, "--models-dir", str(tmp_path / "models"),
+             "--checksums", str(checksums), "--upgrade-checksums")
+    assert json.loads(checksums.read_text()) == {"u2net.onnx": f"sha256:{hashlib.sha256(PAYLOAD).hexdigest()}"}